@@ -0,0 +1,1353 @@
+"""Офлайн-бенчмарки бота (не требуют токена и доступа к Telegram).
+
+Запуск:
+    python benchmark.py db --updates 300
+    python benchmark.py rows --tasks 20000
+    python benchmark.py send --messages 600 --chats 200
+    python benchmark.py webhook --updates 2000 --concurrency 100
+    python benchmark.py workers --workers 4 --messages 600
+    python benchmark.py render
+    python benchmark.py search --tasks 1000000
+    python benchmark.py import --tasks 100000
+    python benchmark.py stats --tasks 1000000
+    python benchmark.py handlers --updates 300 --chats 50 --messages 2000 --json results.json
+    python benchmark.py digest --chats 200 --messages 2000
+    python benchmark.py recurrence --tasks 20000
+    python benchmark.py graph --tasks 20000
+    python benchmark.py history --tasks 20000 --updates 50
+    python benchmark.py inline --chats 200
+
+С --json результаты сценария записываются в файл JSON (вместе с коммитом git),
+чтобы сравнивать замеры разных версий.
+"""
+import argparse
+import asyncio
+import csv
+import datetime
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import aiohttp
+from aiohttp import web
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import EditMessageText, SendMessage
+from aiogram.types import Chat, Message, User
+
+from db import Database, PRIORITIES, STATUS_ACTIVE, STATUS_COMPLETED
+from history import TaskHistory
+from inline import InlineQueryCache
+from recurrence import next_deadline, parse_rule
+from keyboards import AssigneeCallback, FieldCallback, PriorityCallback, ProjectCallback
+from render import TaskCards, format_deadline
+from sender import OutboundQueue
+
+
+# Результаты для --json: сценарии добавляют сюда записи через record()
+RESULTS: List[Dict[str, Any]] = []
+
+
+def percentile_values(samples: List[float]) -> Dict[str, float]:
+    """p50/p99/max списка задержек в секундах - в миллисекундах"""
+    samples = sorted(samples)
+    p50 = samples[len(samples) // 2]
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    return {'p50_ms': p50 * 1000, 'p99_ms': p99 * 1000, 'max_ms': samples[-1] * 1000}
+
+
+def percentiles(samples: List[float]) -> str:
+    """Форматирование p50/p99/max для списка задержек в секундах"""
+    values = percentile_values(samples)
+    return f"p50={values['p50_ms']:.2f}мс p99={values['p99_ms']:.2f}мс max={values['max_ms']:.2f}мс"
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Пиковый объем памяти процесса (RSS), МБ; None, если модуль resource недоступен"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux сообщает килобайты, macOS - байты
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024
+
+
+def record(case: str, **values: Any) -> None:
+    """Запись результата для --json"""
+    RESULTS.append({'case': case, **values})
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def fake_user(telegram_id: int) -> SimpleNamespace:
+    return SimpleNamespace(id=telegram_id, username=f"user{telegram_id}", first_name="Имя", last_name=None)
+
+
+def task_data(creator_id: int) -> dict:
+    return {
+        'name': 'Задача', 'description': 'Описание', 'project_id': 1,
+        'creator_id': creator_id, 'assignee_id': creator_id, 'priority': 'Средний',
+        'deadline': int(datetime.datetime(2030, 1, 1, 12, 0).timestamp()),
+    }
+
+
+class LegacyDB:
+    """Прежняя схема работы: новое соединение на каждый вызов прямо в цикле событий"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    async def register_user(self, user) -> int:
+        conn = sqlite3.connect(self.path)
+        cursor = conn.cursor()
+        cursor.execute('SELECT id FROM users WHERE telegram_id = ?', (user.id,))
+        result = cursor.fetchone()
+        if not result:
+            cursor.execute('INSERT INTO users (telegram_id, username) VALUES (?, ?)', (user.id, user.username))
+            conn.commit()
+            user_db_id = cursor.lastrowid
+        else:
+            user_db_id = result[0]
+        conn.close()
+        return user_db_id
+
+    async def add_task_to_db(self, data: dict) -> int:
+        conn = sqlite3.connect(self.path)
+        cursor = conn.cursor()
+        cursor.execute(
+            'INSERT INTO tasks (name, description, project_id, creator_id, assignee_id, priority, deadline, created_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (data['name'], data['description'], data['project_id'], data['creator_id'], data['assignee_id'],
+             data['priority'], data['deadline'], datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        )
+        conn.commit()
+        conn.close()
+        return cursor.lastrowid
+
+    async def get_user_tasks(self, user_id: int):
+        conn = sqlite3.connect(self.path)
+        rows = conn.execute(
+            "SELECT id FROM tasks WHERE (creator_id = ? OR assignee_id = ?) AND status = 'Активная'",
+            (user_id, user_id)
+        ).fetchall()
+        conn.close()
+        return rows
+
+
+async def simulate_updates(store, updates: int) -> None:
+    """Одновременная обработка `updates` обновлений: регистрация, запись задачи, чтение списка"""
+    latencies: List[float] = []
+    lags: List[float] = []
+    done = asyncio.Event()
+
+    async def ticker() -> None:
+        # Задержка цикла событий показывает, насколько БД блокирует остальные чаты
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - started - 0.001)
+
+    async def handler(n: int) -> None:
+        # Все обновления приходят одновременно, задержка считается от момента поступления
+        user_id = await store.register_user(fake_user(n % 50))
+        if n % 3 == 0:
+            await store.add_task_to_db(task_data(user_id))
+        await store.get_user_tasks(user_id)
+        latencies.append(time.perf_counter() - started)
+
+    tick = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(n) for n in range(updates)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await tick
+
+    print(f"  {type(store).__name__}: {updates / elapsed:.0f} обновлений/с")
+    print(f"    задержка обработчика: {percentiles(latencies)}")
+    print(f"    задержка цикла событий: {percentiles(lags or [0.0])}")
+
+
+async def bench_db(args: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        db = Database(path)
+        await db.connect()
+        await db.init_db()
+
+        print(f"Одновременных обновлений: {args.updates}")
+        await simulate_updates(LegacyDB(path), args.updates)
+        await simulate_updates(db, args.updates)
+        await db.close()
+
+
+# Прежний запрос завершенных задач: все задачи пользователя, фильтр по статусу в Python
+LEGACY_SHOW_COMPLETED_SQL = '''
+SELECT t.id, t.name, t.description, p.name, t.priority, t.deadline, t.status,
+       u.username as creator, a.username as assignee
+FROM tasks t
+LEFT JOIN projects p ON t.project_id = p.id
+LEFT JOIN users u ON t.creator_id = u.id
+LEFT JOIN users a ON t.assignee_id = a.id
+WHERE t.creator_id = ? OR t.assignee_id = ?
+ORDER BY
+    CASE t.status WHEN 'Активная' THEN 0 WHEN 'Выполнена' THEN 1 END,
+    CASE t.priority WHEN 'Высокий' THEN 0 WHEN 'Средний' THEN 1 WHEN 'Низкий' THEN 2 END,
+    t.deadline
+'''
+
+
+def count_steps(conn: sqlite3.Connection, func: Callable) -> Tuple[Any, int]:
+    """Выполнение func с подсчетом шагов виртуальной машины SQLite (мера прочитанных строк)"""
+    steps = [0]
+
+    def progress() -> int:
+        steps[0] += 1
+        return 0
+
+    conn.set_progress_handler(progress, 1)
+    try:
+        return func(), steps[0]
+    finally:
+        conn.set_progress_handler(None, 1)
+
+
+async def bench_rows(args: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        await db.connect()
+        await db.init_db()
+        user_id = await db.register_user(fake_user(1))
+
+        # Большой хвост активных задач и немного завершенных
+        completed = max(1, args.tasks // 100)
+        for n in range(args.tasks):
+            task_id = await db.add_task_to_db(task_data(user_id))
+            if n < completed:
+                await db.complete_task(task_id)
+
+        def legacy():
+            rows = db._conn.execute(LEGACY_SHOW_COMPLETED_SQL, (user_id, user_id)).fetchall()
+            return rows, [row for row in rows if row[6] == STATUS_COMPLETED]
+
+        (legacy_rows, legacy_result), legacy_steps = await db.run(count_steps, db._conn, legacy)
+        new_result, new_steps = await db.run(
+            count_steps, db._conn, lambda: db.get_user_tasks.__wrapped__(db, user_id, status=STATUS_COMPLETED)
+        )
+
+        print(f"Задач у пользователя: {args.tasks}, завершенных: {completed}")
+        print(f"  прежний запрос: строк из БД {len(legacy_rows)}, шагов VM {legacy_steps}")
+        print(f"  get_user_tasks(status=...): строк из БД {len(new_result)}, шагов VM {new_steps}")
+        await db.close()
+
+    # Запрос по индексу читает только завершенные задачи: возврат к полному просмотру
+    # всех задач пользователя (шагов VM столько же, сколько у прежнего запроса) - ошибка
+    if [row[0] for row in legacy_result] != [row[0] for row in new_result]:
+        raise SystemExit("Результаты прежнего и нового запроса не совпадают")
+    if len(new_result) != completed:
+        raise SystemExit(f"Найдено завершенных задач: {len(new_result)} из {completed}")
+    if new_steps * 5 >= legacy_steps:
+        raise SystemExit(f"Шагов VM не меньше в 5 раз: {new_steps} против {legacy_steps}")
+
+
+def legacy_format_active_task(task: Tuple) -> str:
+    """Прежняя карточка активной задачи: собирается целиком при каждом показе"""
+    task_id, name, description, project, priority, deadline, status, creator, assignee = task[:9]
+    priority_emoji = {
+        "Низкий": "🟢",
+        "Средний": "🟡",
+        "Высокий": "🔴"
+    }.get(priority, "")
+    lines = [
+        f"ID: {task_id}",
+        f"📌 {name}",
+        f"📝 {description[:50]}..." if len(description) > 50 else f"📝 {description}",
+        f"📁 Проект: {project}",
+        f"{priority_emoji} Приоритет: {priority}",
+    ]
+    if deadline:
+        deadline_date = datetime.datetime.strptime(deadline, '%Y-%m-%d %H:%M')
+        days_left = (deadline_date - datetime.datetime.now()).days
+        deadline_str = f"⏰ Дедлайн: {deadline}"
+        if days_left < 0:
+            deadline_str += " (просрочено!)"
+        elif days_left == 0:
+            deadline_str += " (сегодня!)"
+        lines.append(deadline_str)
+    lines.append(f"👤 Создатель: {creator}")
+    lines.append(f"👥 Исполнитель: {assignee}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def bench_render(args: argparse.Namespace) -> None:
+    """Время отрисовки списка из 1000 активных задач: прежние карточки и TaskCards"""
+    size, rounds = 1000, 50
+    # Дедлайны с точностью до минуты, как при вводе пользователем
+    base = int(time.time()) // 60 * 60
+    tasks = [
+        (n, f"Задача {n}", "Описание " * (n % 12), "Основной проект", ('Высокий', 'Средний', 'Низкий')[n % 3],
+         base + (n % 96 - 24) * 3600, STATUS_ACTIVE, f"user{n % 50}", f"user{n % 7}", 0)
+        for n in range(size)
+    ]
+    # Прежняя схема хранила дедлайн текстом и разбирала его при каждом показе
+    legacy_tasks = [task[:5] + (format_deadline(task[5]),) + task[6:] for task in tasks]
+    cards = TaskCards()
+
+    def measure(render: Callable[[], str]) -> Tuple[str, float]:
+        started = time.perf_counter()
+        for _ in range(rounds):
+            text = render()
+        return text, (time.perf_counter() - started) / rounds
+
+    legacy_text, legacy_time = measure(lambda: "".join(legacy_format_active_task(task) for task in legacy_tasks))
+    started = time.perf_counter()
+    cards.render_list(tasks)
+    cold_time = time.perf_counter() - started
+    cached_text, cached_time = measure(lambda: cards.render_list(tasks))
+    assert cached_text == legacy_text
+
+    print(f"Список из {size} задач, среднее по {rounds} отрисовкам")
+    print(f"  прежние карточки: {legacy_time * 1000:.2f} мс")
+    print(f"  TaskCards, пустой кэш: {cold_time * 1000:.2f} мс")
+    print(f"  TaskCards, из кэша: {cached_time * 1000:.2f} мс ({legacy_time / cached_time:.1f}x)")
+
+
+def synthetic_words(count: int, seed: int = 1) -> List[str]:
+    """Словарь случайных слов из русских букв длиной 3-10"""
+    rng = random.Random(seed)
+    letters = 'абвгдежзиклмнопрстуфхцчшщэюя'
+    words = set()
+    while len(words) < count:
+        words.add(''.join(rng.choice(letters) for _ in range(rng.randint(3, 10))))
+    return sorted(words)
+
+
+async def bench_search(args: argparse.Namespace) -> None:
+    """Задержка /search на большой синтетической таблице задач"""
+    users, rounds = 1000, 30
+    rng = random.Random(2)
+    words = synthetic_words(5000)
+    # Частота слов по закону Ципфа: есть и очень частые, и редкие слова
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        await db.connect()
+        await db.init_db()
+        for n in range(users):
+            await db.register_user(fake_user(n + 1))
+
+        def fill(rows: List[Tuple]) -> None:
+            with db._transaction() as conn:
+                conn.executemany(
+                    'INSERT INTO tasks (name, description, project_id, creator_id, assignee_id, priority, '
+                    'priority_rank, deadline, created_at) VALUES (?, ?, 1, ?, ?, ?, ?, ?, ?)', rows
+                )
+
+        started = time.perf_counter()
+        now = int(time.time())
+        for chunk in range(0, args.tasks, 10000):
+            rows = []
+            for _ in range(min(10000, args.tasks - chunk)):
+                text = rng.choices(words, weights, k=11)
+                # Пользователь 1 создает 5% задач, остальные - поровну
+                creator = 1 if rng.random() < 0.05 else rng.randint(2, users)
+                rank = rng.randint(0, 2)
+                rows.append((' '.join(text[:3]), ' '.join(text[3:]), creator, rng.randint(1, users),
+                             PRIORITIES[rank], rank, now + rng.randint(-30, 60) * 86400, now))
+            await db.run(fill, rows)
+        print(f"Задач: {args.tasks}, пользователей: {users}, заполнение с индексом: {time.perf_counter() - started:.1f} с")
+
+        queries = [
+            ('частое слово', words[0]), ('редкое слово', words[-1]), ('начало слова', words[1][:3]),
+            ('два слова', f"{words[2]} {words[40]}"), ('нет совпадений', 'несуществующее'),
+        ]
+        for user_id, who in ((1, 'активный пользователь'), (500, 'обычный пользователь')):
+            print(f"  {who}:")
+            for title, query in queries:
+                latencies = []
+                for _ in range(rounds):
+                    started = time.perf_counter()
+                    found = await db.search_tasks(user_id, query, 11)
+                    latencies.append(time.perf_counter() - started)
+                print(f"    {title} ({query}): найдено {len(found)}, {percentiles(latencies)}")
+        await db.close()
+
+
+class FakeBot:
+    """Локальная замена Bot: задержка сети и ограничения частоты как у Telegram
+
+    При превышении общего лимита или лимита чата отвечает TelegramRetryAfter.
+    """
+
+    def __init__(self, global_rate: float = 30, per_chat_rate: float = 1, latency: float = 0.02) -> None:
+        self.global_rate = global_rate
+        self.chat_interval = 1 / per_chat_rate
+        self.latency = latency
+        self.delivered: List[Tuple[float, int]] = []
+        self.rejected = 0
+        self._chat_last: dict = {}
+
+    async def send_message(self, chat_id: int, text: str, **kwargs) -> None:
+        await asyncio.sleep(self.latency)
+        now = time.monotonic()
+        recent = sum(1 for t, _ in self.delivered[-int(self.global_rate) * 2:] if now - t < 1)
+        if recent >= self.global_rate or now - self._chat_last.get(chat_id, -1e9) < self.chat_interval * 0.95:
+            self.rejected += 1
+            raise TelegramRetryAfter(SendMessage(chat_id=chat_id, text=text), "Flood control exceeded", 1)
+        self._chat_last[chat_id] = now
+        self.delivered.append((now, chat_id))
+
+
+async def bench_send(args: argparse.Namespace) -> None:
+    messages = [(n % args.chats, f"Напоминание {n}") for n in range(args.messages)]
+    print(f"Сообщений: {args.messages}, чатов: {args.chats}")
+
+    # Прямые вызовы bot.send_message, как раньше отправлялись напоминания
+    bot = FakeBot()
+    started = time.perf_counter()
+    results = await asyncio.gather(*(bot.send_message(chat, text) for chat, text in messages), return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    lost = sum(1 for result in results if isinstance(result, Exception))
+    print(f"  напрямую: {elapsed:.2f}с, доставлено {len(bot.delivered)}, потеряно {lost}")
+
+    bot = FakeBot()
+    outbox = OutboundQueue(bot, global_rate=args.rate)
+    outbox.start()
+    started = time.perf_counter()
+    for chat, text in messages:
+        await outbox.send_message(chat, text)
+    await outbox.join()
+    elapsed = time.perf_counter() - started
+    await outbox.stop()
+    print(f"  через очередь: {elapsed:.2f}с, {len(bot.delivered) / elapsed:.1f} сообщений/с, "
+          f"доставлено {len(bot.delivered)}, отказов Telegram {bot.rejected}, повторов {outbox.retried}, "
+          f"потеряно {outbox.failed}")
+
+
+class FakeSession(BaseSession):
+    """Сессия Bot без сети: на отправку сообщений отвечает правдоподобным Message"""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        super().__init__()
+        self.latency = latency
+        self.requests = 0
+        self.sent: List[str] = []
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, SendMessage):
+            self.sent.append(method.text)
+        if isinstance(method, (SendMessage, EditMessageText)):
+            return Message(
+                message_id=self.requests, date=datetime.datetime.now(),
+                chat=Chat(id=method.chat_id or 0, type='private'),
+                from_user=User(id=bot.id, is_bot=True, first_name='bot'), text=method.text,
+            )
+        return True
+
+    async def stream_content(self, *args, **kwargs):
+        yield b''
+
+    async def close(self) -> None:
+        pass
+
+
+def load_bot(db_path: str, latency: float = 0.0, **settings):
+    """Импорт main.py с временной базой и сессией без сети (токен из config.py не используется)"""
+    import config
+    config.BOT_TOKEN = '123456:' + 'A' * 35
+    config.DB_PATH = db_path
+    for name, value in settings.items():
+        setattr(config, name, value)
+    import main
+    main.bot.session = FakeSession(latency)
+    # Журнал каждого обновления искажает замеры
+    logging.getLogger('aiogram').setLevel(logging.WARNING)
+    logging.getLogger('apscheduler').setLevel(logging.WARNING)
+    return main
+
+
+async def start_bot(main) -> None:
+    await main.start_services()
+
+
+async def stop_bot(main) -> None:
+    await main.storage.close()
+    await main.stop_services()
+
+
+def message_update(update_id: int, telegram_id: int, text: str) -> dict:
+    """JSON обновления Telegram с текстовым сообщением пользователя"""
+    user = {'id': telegram_id, 'is_bot': False, 'first_name': f'Пользователь {telegram_id}',
+            'username': f'user{telegram_id}'}
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id, 'date': int(time.time()), 'text': text,
+            'chat': {'id': telegram_id, 'type': 'private'}, 'from': user,
+        },
+    }
+
+
+def callback_update(update_id: int, telegram_id: int, data: str) -> dict:
+    """JSON обновления Telegram с нажатием кнопки под сообщением бота"""
+    user = {'id': telegram_id, 'is_bot': False, 'first_name': f'Пользователь {telegram_id}',
+            'username': f'user{telegram_id}'}
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id), 'chat_instance': str(telegram_id), 'from': user, 'data': data,
+            'message': {
+                'message_id': update_id, 'date': int(time.time()), 'text': '...',
+                'chat': {'id': telegram_id, 'type': 'private'},
+                'from': {'id': 123456, 'is_bot': True, 'first_name': 'bot'},
+            },
+        },
+    }
+
+
+def inline_update(update_id: int, telegram_id: int, query: str, offset: str = '') -> dict:
+    """JSON обновления Telegram с inline-запросом (@бот текст)"""
+    user = {'id': telegram_id, 'is_bot': False, 'first_name': f'Пользователь {telegram_id}',
+            'username': f'user{telegram_id}'}
+    return {
+        'update_id': update_id,
+        'inline_query': {'id': str(update_id), 'from': user, 'query': query, 'offset': offset},
+    }
+
+
+class UpdateFeeder:
+    """Подача синтетических обновлений прямо в dp с замером времени обработки каждого"""
+
+    def __init__(self, main) -> None:
+        self.main = main
+        self._ids = itertools.count(1)
+        self.latencies: List[float] = []
+
+    async def send(self, telegram_id: int, text: Optional[str] = None, data: Optional[str] = None,
+                   query: Optional[str] = None, offset: str = '') -> None:
+        update_id = next(self._ids)
+        if query is not None:
+            update = inline_update(update_id, telegram_id, query, offset)
+        elif data is None:
+            update = message_update(update_id, telegram_id, text)
+        else:
+            update = callback_update(update_id, telegram_id, data)
+        started = time.perf_counter()
+        await self.main.dp.feed_raw_update(self.main.bot, update)
+        self.latencies.append(time.perf_counter() - started)
+
+    def take(self) -> List[float]:
+        """Задержки с прошлого вызова"""
+        latencies, self.latencies = self.latencies, []
+        return latencies
+
+
+def report(case: str, title: str, latencies: List[float], elapsed: float, **extra: Any) -> None:
+    """Вывод и запись результата одного случая: пропускная способность, задержки и пик памяти"""
+    rss = peak_rss_mb()
+    print(f"  {title}: {len(latencies) / elapsed:.0f} обновлений/с, {percentiles(latencies)}"
+          + (f", пик RSS {rss:.0f} МБ" if rss is not None else ""))
+    record(case, updates=len(latencies), seconds=elapsed, updates_per_second=len(latencies) / elapsed,
+           peak_rss_mb=rss, **percentile_values(latencies), **extra)
+
+
+async def bench_handlers(args: argparse.Namespace) -> None:
+    """Обработчики бота под нагрузкой: настоящий dp, синтетические обновления, Telegram без сети
+
+    Лимиты исходящих сообщений подняты, чтобы мерить работу бота, а не ограничения Telegram.
+    """
+    users = args.chats
+    rng = random.Random(5)
+    with tempfile.TemporaryDirectory() as tmp:
+        main = load_bot(os.path.join(tmp, 'bench.db'), SEND_RATE_GLOBAL=100000, SEND_RATE_PER_CHAT=100000)
+        await start_bot(main)
+        feeder = UpdateFeeder(main)
+        remind_before = int(main.REMINDER_BEFORE.total_seconds())
+        print(f"Пользователей: {users}")
+
+        # 1. /add_task целиком: 7 обновлений на задачу, пользователи работают одновременно
+        deadline_text = (datetime.datetime.now() + datetime.timedelta(days=3)).strftime('%Y-%m-%d %H:%M')
+
+        async def add_tasks(telegram_id: int, count: int) -> None:
+            for n in range(count):
+                await feeder.send(telegram_id, '/add_task')
+                await feeder.send(telegram_id, f'Задача {n}')
+                await feeder.send(telegram_id, 'Описание задачи')
+                await feeder.send(telegram_id, data=ProjectCallback(project_id=1).pack())
+                await feeder.send(telegram_id, data=PriorityCallback(rank=rng.randrange(len(PRIORITIES))).pack())
+                await feeder.send(telegram_id, deadline_text)
+                await feeder.send(telegram_id, data=AssigneeCallback(user_id=0).pack())
+
+        per_user = max(1, args.updates // users)
+        started = time.perf_counter()
+        await asyncio.gather(*(add_tasks(1000 + n, per_user) for n in range(users)))
+        report('add_task', f"/add_task ({per_user * users} задач)", feeder.take(), time.perf_counter() - started,
+               tasks=per_user * users)
+
+        # 2. /list_tasks у пользователей с 10, 1000 и 10000 задач (задачи загружаются напрямую в базу)
+        now = int(time.time())
+        for size in (10, 1000, 10000):
+            telegram_id = 900000 + size
+            user_id = await main.db.register_user(fake_user(telegram_id))
+            rows = [(f'Задача {n}', 'Описание ' * (n % 8), 1, user_id, user_id, PRIORITIES[n % 3],
+                     now + rng.randint(-5, 60) * 86400, STATUS_ACTIVE) for n in range(size)]
+            for chunk in range(0, size, 1000):
+                await main.db.import_tasks(rows[chunk:chunk + 1000], remind_before, now)
+            started = time.perf_counter()
+            for _ in range(50):
+                await feeder.send(telegram_id, '/list_tasks')
+            report(f'list_tasks_{size}', f"/list_tasks, {size} задач", feeder.take(), time.perf_counter() - started,
+                   tasks=size)
+
+        # 3. /update_task с новым дедлайном: напоминание переносится в ближайшее окно планировщика
+        owners = await main.db.run(lambda: main.db._conn.execute(
+            'SELECT u.telegram_id, t.id FROM tasks t JOIN users u ON u.id = t.creator_id '
+            'WHERE u.telegram_id BETWEEN ? AND ?', (1000, 1000 + users - 1)
+        ).fetchall())
+        tasks_by_user: Dict[int, List[int]] = {}
+        for telegram_id, task_id in owners:
+            tasks_by_user.setdefault(telegram_id, []).append(task_id)
+        new_deadline = (datetime.datetime.now() + main.REMINDER_BEFORE + datetime.timedelta(minutes=30))
+        new_deadline_text = new_deadline.strftime('%Y-%m-%d %H:%M')
+
+        async def update_deadlines(telegram_id: int, task_ids: List[int]) -> None:
+            for task_id in task_ids:
+                await feeder.send(telegram_id, '/update_task')
+                await feeder.send(telegram_id, str(task_id))
+                await feeder.send(telegram_id, data=FieldCallback(field='deadline').pack())
+                await feeder.send(telegram_id, new_deadline_text)
+
+        jobs_before = len(main.scheduler.get_jobs())
+        started = time.perf_counter()
+        await asyncio.gather(*(update_deadlines(telegram_id, ids) for telegram_id, ids in tasks_by_user.items()))
+        jobs = len(main.scheduler.get_jobs()) - jobs_before
+        report('update_deadline', f"/update_task, дедлайн ({len(owners)} задач, новых заданий напоминаний: {jobs})",
+               feeder.take(), time.perf_counter() - started, tasks=len(owners), reminder_jobs=jobs)
+
+        # 4. Шторм напоминаний: args.messages заданий срабатывают в одну секунду, пользователь в это время
+        # листает /list_tasks - видно, насколько рассылка задерживает ответы
+        for _ in range(100):
+            if main.is_reminder_leader:
+                break
+            await asyncio.sleep(0.05)
+        storm_user = await main.db.register_user(fake_user(1000))
+        due = int(time.time()) + 2
+        rows = [(f'Напоминание {n}', '', 1, storm_user, await main.db.register_user(fake_user(1000 + n % users)),
+                 PRIORITIES[n % 3], due + remind_before, STATUS_ACTIVE) for n in range(args.messages)]
+        for chunk in range(0, len(rows), 1000):
+            await main.db.import_tasks(rows[chunk:chunk + 1000], remind_before, int(time.time()))
+        await main.load_reminders()
+        main.bot.session.sent.clear()
+
+        def delivered() -> int:
+            return sum(1 for text in main.bot.session.sent if text.startswith('⚠️ Напоминание'))
+
+        async def browse() -> None:
+            # Запросы идут каждые 10 мс независимо от того, ответил ли бот на предыдущий
+            pending = []
+            while delivered() < args.messages and time.perf_counter() - started < 60:
+                pending.append(asyncio.create_task(feeder.send(900010, '/list_tasks')))
+                await asyncio.sleep(0.01)
+            await asyncio.gather(*pending)
+
+        await asyncio.sleep(max(0.0, due - time.time()))
+        started = time.perf_counter()
+        await browse()
+        elapsed = time.perf_counter() - started
+        delivered = delivered()
+        print(f"  шторм напоминаний: отправлено {delivered} из {args.messages} за {elapsed:.2f} с "
+              f"({delivered / elapsed:.0f}/с)")
+        report('reminder_storm', "/list_tasks во время шторма", feeder.take(), elapsed,
+               reminders=args.messages, reminders_delivered=delivered, reminders_per_second=delivered / elapsed)
+        await stop_bot(main)
+
+
+async def bench_inline(args: argparse.Namespace) -> None:
+    """Inline-режим: args.chats пользователей одновременно набирают запрос по букве
+
+    Сравниваются запросы к базе и задержка ответа с кэшем InlineQueryCache и без него
+    (TTL 0); у части пользователей задач больше INLINE_CANDIDATES - у них работает поиск по индексу.
+    """
+    users = args.chats
+    words = ('отчет', 'квартал', 'звонок', 'клиент', 'договор', 'проверка', 'бюджет', 'встреча')
+    phrases = ('отчет квартал', 'звонок клиенту', 'договор', 'проверка бюджета')
+    with tempfile.TemporaryDirectory() as tmp:
+        main = load_bot(os.path.join(tmp, 'bench.db'))
+        await start_bot(main)
+        feeder = UpdateFeeder(main)
+        rng = random.Random(8)
+        now = int(time.time())
+        # Каждый десятый пользователь - с 2000 активных задач, остальные - со 100
+        for n in range(users):
+            user_id = await main.db.register_user(fake_user(5000 + n))
+            size = 2000 if n % 10 == 0 else 100
+            rows = [(f'{rng.choice(words).capitalize()} {rng.choice(words)} {k}', rng.choice(words), 1, user_id,
+                     user_id, PRIORITIES[k % 3], now + rng.randint(1, 60) * 86400, STATUS_ACTIVE) for k in range(size)]
+            await main.db.import_tasks(rows, 0, now)
+        queries = Counter()
+        observe = main.db.query_observer
+
+        def count(name: str, seconds: float, rows: int) -> None:
+            queries.update([name])
+            observe(name, seconds, rows)
+
+        main.db.query_observer = count
+
+        async def type_phrase(telegram_id: int, phrase: str, pace: random.Random) -> None:
+            # Пустой запрос, затем по букве, затем вторая страница результатов; пользователи
+            # начинают в течение секунды и набирают 5-10 букв в секунду
+            await asyncio.sleep(pace.uniform(0, 1))
+            for length in range(len(phrase) + 1):
+                await feeder.send(telegram_id, query=phrase[:length])
+                await asyncio.sleep(pace.uniform(0.1, 0.2))
+            await feeder.send(telegram_id, query=phrase, offset=str(main.INLINE_PAGE_SIZE))
+
+        for case, ttl in (('no_cache', 0), ('cache', main.INLINE_CACHE_TTL)):
+            main.inline_cache = InlineQueryCache(ttl)
+            main.inline_article.cache_clear()
+            queries.clear()
+            pace = random.Random(9)
+            started = time.perf_counter()
+            await asyncio.gather(*(type_phrase(5000 + n, phrases[n % len(phrases)], pace) for n in range(users)))
+            elapsed = time.perf_counter() - started
+            lookups = queries['get_user_tasks'] + queries['search_tasks']
+            latencies = feeder.take()
+            report(f'inline_{case}', f"{'с кэшем' if ttl else 'без кэша'}: запросов к базе {lookups}",
+                   latencies, elapsed, db_queries=lookups, **main.inline_cache.stats())
+        await stop_bot(main)
+
+
+async def bench_webhook(args: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        main = load_bot(os.path.join(tmp, 'bench.db'), latency=args.latency)
+        await start_bot(main)
+
+        handler_latencies: List[float] = []
+
+        async def timing(handler, event, data):
+            started = time.perf_counter()
+            try:
+                return await handler(event, data)
+            finally:
+                handler_latencies.append(time.perf_counter() - started)
+
+        main.dp.update.outer_middleware(timing)
+
+        runner = web.AppRunner(main.create_webhook_app())
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        url = f"http://127.0.0.1:{port}{main.WEBHOOK_PATH}"
+
+        commands = ['/start', '/list_tasks', '/add_task', 'Новая задача', 'Описание']
+        updates = [message_update(n, 1000 + n % args.chats, commands[n // args.chats % len(commands)])
+                   for n in range(args.updates)]
+
+        ack_latencies: List[float] = []
+        limit = asyncio.Semaphore(args.concurrency)
+
+        async def post(client: aiohttp.ClientSession, update: dict) -> None:
+            async with limit:
+                started = time.perf_counter()
+                async with client.post(url, json=update) as response:
+                    response.raise_for_status()
+                ack_latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        async with aiohttp.ClientSession() as client:
+            await asyncio.gather(*(post(client, update) for update in updates))
+        await runner.cleanup()
+        elapsed = time.perf_counter() - started
+
+        print(f"Обновлений: {args.updates}, чатов: {args.chats}, одновременных запросов: {args.concurrency}, "
+              f"лимит обработки: {main.WEBHOOK_MAX_CONCURRENCY}")
+        print(f"  {args.updates / elapsed:.0f} обновлений/с")
+        print(f"  ответ webhook: {percentiles(ack_latencies)}")
+        print(f"  обработчик: {percentiles(handler_latencies)}")
+        await stop_bot(main)
+
+
+async def bench_import(args: argparse.Namespace) -> None:
+    """/import большого CSV-файла против добавления задач по одной и /export обратно"""
+    rng = random.Random(3)
+    words = synthetic_words(2000)
+    with tempfile.TemporaryDirectory() as tmp:
+        main = load_bot(os.path.join(tmp, 'bench.db'))
+        await main.db.connect()
+        await main.db.init_db()
+        user_id = await main.db.register_user(fake_user(1))
+        for n in range(2, 50):
+            await main.db.register_user(fake_user(n))
+
+        path = os.path.join(tmp, 'tasks.csv')
+        now = datetime.datetime.now()
+        with open(path, 'w', encoding='utf-8', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(('name', 'description', 'priority', 'deadline', 'assignee'))
+            for n in range(args.tasks):
+                deadline = now + datetime.timedelta(hours=rng.randint(-48, 24 * 60))
+                writer.writerow((' '.join(rng.choices(words, k=3)), ' '.join(rng.choices(words, k=6)),
+                                 rng.choice(PRIORITIES), deadline.strftime('%Y-%m-%d %H:%M'),
+                                 f"@user{rng.randint(1, 49)}"))
+        print(f"Файл: {args.tasks} строк, {os.path.getsize(path) / 2 ** 20:.1f} МБ")
+
+        # Прежний путь: задача и напоминание - отдельными транзакциями
+        sample = min(2000, args.tasks)
+        started = time.perf_counter()
+        for n in range(sample):
+            data = task_data(user_id)
+            data['deadline'] = int((now + datetime.timedelta(days=3)).timestamp())
+            task_id = await main.db.add_task_to_db(data)
+            await main.schedule_reminder(task_id, data['deadline'])
+        single_rate = sample / (time.perf_counter() - started)
+        print(f"  по одной задаче: {single_rate:.0f} задач/с")
+
+        started = time.perf_counter()
+        result = await main.import_tasks_file(path, 'tasks.csv', user_id, None)
+        elapsed = time.perf_counter() - started
+        print(f"  /import: {result.imported / elapsed:.0f} задач/с ({result.imported / elapsed / single_rate:.0f}x), "
+              f"{elapsed:.1f} с, пропущено строк: {result.error_count}")
+
+        # Повторный импорт того же файла под tracemalloc: память не растет с размером файла
+        tracemalloc.start()
+        await main.import_tasks_file(path, 'tasks.csv', user_id, None)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"  пик памяти Python при импорте: {peak / 2 ** 20:.1f} МБ")
+
+        started = time.perf_counter()
+        count = 0
+        with open(os.path.join(tmp, 'export.csv'), 'w', encoding='utf-8-sig', newline='') as file:
+            export = main.TaskExport(file, 'csv')
+            async for rows in main.db.export_user_tasks(user_id):
+                export.write(rows)
+                count += len(rows)
+        print(f"  /export: {count} задач за {time.perf_counter() - started:.1f} с")
+        await main.db.close()
+
+
+# Сводка по проекту подсчетом по всей таблице - так /project_stats работал бы без счетчиков
+PROJECT_STATS_SCAN_SQL = '''
+SELECT status_rank, COALESCE(priority_rank, -1), COUNT(*),
+       SUM(COALESCE(status_rank = 0 AND deadline < :now, 0))
+FROM tasks WHERE project_id = :project_id
+GROUP BY 1, 2
+'''
+
+
+async def bench_stats(args: argparse.Namespace) -> None:
+    """/project_stats: счетчики project_counts против GROUP BY по tasks и цена триггеров при записи"""
+    users, projects, rounds = 200, 10, 30
+    rng = random.Random(4)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        await db.connect()
+        await db.init_db()
+        for n in range(users):
+            await db.register_user(fake_user(n + 1))
+        with db._transaction() as conn:
+            conn.executemany('INSERT INTO projects (name, description) VALUES (?, ?)',
+                             [(f"Проект {n}", '') for n in range(2, projects + 1)])
+
+        def fill(rows: List[Tuple]) -> None:
+            with db._transaction() as conn:
+                conn.executemany(
+                    'INSERT INTO tasks (name, description, project_id, creator_id, assignee_id, priority, '
+                    'priority_rank, deadline, status, status_rank, created_at) '
+                    'VALUES (\'Задача\', \'\', ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows
+                )
+
+        now = int(time.time())
+        started = time.perf_counter()
+        for chunk in range(0, args.tasks, 10000):
+            rows = []
+            for _ in range(min(10000, args.tasks - chunk)):
+                # Половина задач - в первом проекте, треть выполнена
+                project = 1 if rng.random() < 0.5 else rng.randint(2, projects)
+                rank, done = rng.randint(0, 2), int(rng.random() < 0.3)
+                rows.append((project, rng.randint(1, users), rng.randint(1, users), PRIORITIES[rank], rank,
+                             now + rng.randint(-30, 60) * 86400, (STATUS_ACTIVE, STATUS_COMPLETED)[done], done, now))
+            await db.run(fill, rows)
+        print(f"Задач: {args.tasks}, проектов: {projects}, заполнение: {time.perf_counter() - started:.1f} с")
+
+        # Запись по одной задаче: со счетчиками и без них (триггеры временно удалены в копии базы)
+        async def write_rate(store: Database) -> float:
+            started = time.perf_counter()
+            for n in range(1000):
+                task_id = await store.add_task_to_db(task_data(1 + n % users))
+                await store.update_task_field(task_id, 'deadline', now - 3600)
+                await store.complete_task(task_id)
+            return 1000 / (time.perf_counter() - started)
+
+        with_triggers = await write_rate(db)
+        plain_path = os.path.join(tmp, 'plain.db')
+        await db.run(lambda: db._conn.execute('VACUUM INTO ?', (plain_path,)))
+        plain = Database(plain_path)
+        await plain.connect()
+        for trigger in ('tasks_stats_insert', 'tasks_stats_delete', 'tasks_stats_update'):
+            await plain.run(plain._conn.execute, f'DROP TRIGGER {trigger}')
+        without_triggers = await write_rate(plain)
+        await plain.close()
+        print(f"  запись (добавление, дедлайн, выполнение): {with_triggers:.0f} задач/с со счетчиками, "
+              f"{without_triggers:.0f} задач/с без них")
+
+        for project_id, title in ((1, 'большой проект'), (projects, 'обычный проект')):
+            scan, counters = [], []
+            for n in range(rounds):
+                moment = now + n * 60
+                started = time.perf_counter()
+                expected = await db.run(
+                    lambda: db._conn.execute(PROJECT_STATS_SCAN_SQL, {'now': moment, 'project_id': project_id})
+                    .fetchall()
+                )
+                scan.append(time.perf_counter() - started)
+                started = time.perf_counter()
+                counts, _ = await db.get_project_stats(project_id, moment)
+                counters.append(time.perf_counter() - started)
+            if sorted(counts) != sorted(expected):
+                raise SystemExit(f"Счетчики проекта {project_id} не совпадают с подсчетом по таблице")
+            print(f"  {title}: GROUP BY {percentiles(scan)}")
+            print(f"  {title}: счетчики {percentiles(counters)}")
+        await db.close()
+
+
+async def bench_digest(args: argparse.Namespace) -> None:
+    """Напоминания о каждой задаче против ежедневной сводки: запросы к базе, сообщения и время рассылки"""
+    with tempfile.TemporaryDirectory() as tmp:
+        main = load_bot(os.path.join(tmp, 'bench.db'), SEND_RATE_GLOBAL=100000, SEND_RATE_PER_CHAT=100000)
+        # Без выборов ведущего: рассылки запускаются вручную
+        await main.db.connect()
+        await main.db.init_db()
+        main.outbox.start()
+        queries = Counter()
+        main.db.query_observer = lambda name, seconds, rows: queries.update([name])
+
+        now = int(time.time())
+        user_ids = [await main.db.register_user(fake_user(1000 + n)) for n in range(args.chats)]
+        task_ids = []
+        for n in range(args.messages):
+            data = task_data(user_ids[n % args.chats])
+            data['deadline'] = now + 3600 + n % 22 * 3600
+            task_id = await main.db.add_task_to_db(data)
+            await main.db.set_reminder(task_id, now - 60)
+            task_ids.append(task_id)
+        print(f"Пользователей: {args.chats}, задач со сроком в ближайшие сутки: {args.messages}")
+
+        async def measure(case: str, title: str, send: Callable) -> set:
+            queries.clear()
+            main.bot.session.sent.clear()
+            started = time.perf_counter()
+            await send()
+            await main.outbox.join()
+            elapsed = time.perf_counter() - started
+            sent = len(main.bot.session.sent)
+            print(f"  {title}: {sum(queries.values())} запросов к базе, {sent} сообщений, {elapsed:.2f} с")
+            record(case, queries=sum(queries.values()), messages=sent, seconds=elapsed)
+            return {int(task_id) for text in main.bot.session.sent for task_id in re.findall(r'\(ID: (\d+)\)', text)}
+
+        async def send_reminders() -> None:
+            await asyncio.gather(*(main.send_reminder(task_id) for task_id in task_ids))
+
+        reminded = await measure('reminders', "напоминания о каждой задаче", send_reminders)
+
+        for user_id in user_ids:
+            await main.db.set_user_digest(user_id, 9, now - 1)
+        digested = await measure('digest', "ежедневная сводка", main.send_digests)
+        await main.outbox.stop()
+        await main.db.close()
+
+    if args.messages <= args.chats * main.DIGEST_SECTION_SIZE and reminded != digested:
+        raise SystemExit("В сводках не те задачи, что в напоминаниях")
+
+
+async def bench_recurrence(args: argparse.Namespace) -> None:
+    """Повторяющиеся задачи: строк tasks при создании повторений на горизонт против года вперед,
+    время прохода задания materialize_recurrences и создание следующего повторения при выполнении
+    """
+    # Интервалы из текста: недели переводятся в дни, месяцы и другие единицы отклоняются
+    assert parse_rule('каждые 3 дня') == 'days:3' and parse_rule('every 3 weeks') == 'days:21'
+    for text in ('каждые 2 месяца', 'every 2 months', 'каждые 2 часа'):
+        try:
+            parse_rule(text)
+        except ValueError:
+            continue
+        raise AssertionError(f'правило {text!r} не отклонено')
+
+    rules = ('daily', 'weekdays:0,1,2,3,4', 'weekly', 'monthly')
+    horizon, remind_before, users = 2 * 86400, 24 * 3600, 100
+    rng = random.Random(6)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        await db.connect()
+        await db.init_db()
+        for n in range(users):
+            await db.register_user(fake_user(n + 1))
+        now = int(time.time())
+        templates = []
+        for n in range(args.tasks):
+            anchor = now + rng.randint(0, 7 * 86400)
+            templates.append((f'Задача {n}', 1 + n % users, 1 + n % users, rules[n % len(rules)], anchor, anchor, now))
+        with db._transaction() as conn:
+            conn.executemany(
+                'INSERT INTO recurrences (name, description, project_id, creator_id, assignee_id, priority, '
+                'rule, timezone, anchor, next_deadline, created_at) '
+                'VALUES (?, \'\', 1, ?, ?, \'Средний\', ?, NULL, ?, ?, ?)', templates
+            )
+
+        # Сколько строк дал бы год повторений, созданных заранее
+        year = 0
+        for rule in rules:
+            deadline = now
+            while deadline < now + 365 * 86400:
+                deadline = next_deadline(rule, deadline, now)
+                year += 1
+        year = year * args.tasks // len(rules)
+
+        async def materialize(moment: int) -> Tuple[int, float]:
+            created, started = 0, time.perf_counter()
+            while True:
+                processed, rows = await db.materialize_recurrences(moment + horizon, moment, remind_before, 500,
+                                                                   next_deadline)
+                created += len(rows)
+                if processed < 500:
+                    return created, time.perf_counter() - started
+
+        created, elapsed = await materialize(now)
+        print(f"Шаблонов: {args.tasks}; повторений на год вперед было бы {year}, "
+              f"на горизонт {horizon // 86400} дн. создано {created} за {elapsed:.2f} с")
+        record('materialize_first', templates=args.tasks, year_rows=year, created=created, seconds=elapsed)
+        created, elapsed = await materialize(now)
+        print(f"  повторный проход без новых повторений: {elapsed * 1000:.1f} мс")
+        record('materialize_idle', created=created, seconds=elapsed)
+        created, elapsed = await materialize(now + 86400)
+        print(f"  проход через сутки: создано {created} за {elapsed:.2f} с")
+        record('materialize_next_day', created=created, seconds=elapsed)
+
+        # Выполнение всех активных повторений пользователя: каждое последнее активное дает следующее
+        task_ids = await db.run(lambda: [row[0] for row in db._conn.execute(
+            'SELECT id FROM tasks WHERE creator_id = 1 AND status_rank = 0 AND recurrence_id IS NOT NULL'
+        )])
+        latencies, created = [], 0
+        for task_id in task_ids:
+            started = time.perf_counter()
+            await db.complete_task(task_id)
+            created += len(await db.advance_recurrence(task_id, remind_before, next_deadline))
+            latencies.append(time.perf_counter() - started)
+        print(f"  выполнение {len(task_ids)} повторений: {percentiles(latencies)}, создано следующих {created}")
+        record('complete', tasks=len(task_ids), created=created, **percentile_values(latencies))
+        await db.close()
+
+
+async def bench_graph(args: argparse.Namespace) -> None:
+    """Подзадачи и зависимости: дерево из args.tasks подзадач и цепочка зависимостей той же длины
+
+    Прогресс по дереву и список «можно делать» сравниваются с обходом в Python по запросу
+    на задачу; замеряются проверка цикла и выполнение задачи в глубоком графе.
+    """
+    rounds = 20
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        await db.connect()
+        await db.init_db()
+        user_id = await db.register_user(fake_user(1))
+        # Корень, под ним дерево с ветвлением 10, затем цепочка задач, каждая ждет предыдущую
+        root = await db.add_task_to_db(task_data(user_id))
+        rows = [('Задача', '', 1, user_id, user_id, 'Средний', 2000000000, STATUS_ACTIVE)] * (2 * args.tasks)
+        for chunk in range(0, len(rows), 10000):
+            await db.import_tasks(rows[chunk:chunk + 10000], 0, int(time.time()))
+        tree = list(range(root + 1, root + 1 + args.tasks))
+        chain = list(range(root + 1 + args.tasks, root + 1 + 2 * args.tasks))
+        started = time.perf_counter()
+        for n, task_id in enumerate(tree):
+            await db.set_parent(task_id, root if n < 10 else tree[n // 10 - 1])
+        for previous, task_id in zip(chain, chain[1:]):
+            await db.add_dependency(task_id, previous)
+        print(f"Дерево подзадач: {len(tree)}, цепочка зависимостей: {len(chain)}, "
+              f"связи с проверкой цикла: {time.perf_counter() - started:.1f} с")
+        await db.run(lambda: db._conn.executemany('UPDATE tasks SET status = ?, status_rank = 1 WHERE id = ?',
+                                                  [(STATUS_COMPLETED, task_id) for task_id in tree[::3]]))
+
+        def python_progress(task_id: int) -> Tuple[int, int]:
+            # Прежний способ: обход дерева по запросу на узел
+            total = done = 0
+            stack = [task_id]
+            while stack:
+                for child_id, status_rank in db._conn.execute(
+                        'SELECT id, status_rank FROM tasks WHERE parent_id = ?', (stack.pop(),)):
+                    total += 1
+                    done += status_rank
+                    stack.append(child_id)
+            return total, done
+
+        def python_ready() -> List[int]:
+            # Прежний способ: активные задачи, затем запрос блокирующих задач и подзадач для каждой
+            ready = []
+            for (task_id,) in db._conn.execute(
+                    'SELECT id FROM tasks WHERE creator_id = ? AND status_rank = 0', (user_id,)).fetchall():
+                if not db._conn.execute(
+                        'SELECT 1 FROM task_dependencies d JOIN tasks t ON t.id = d.blocker_id '
+                        'WHERE d.task_id = ? AND t.status_rank = 0 UNION ALL '
+                        'SELECT 1 FROM tasks WHERE parent_id = ? AND status_rank = 0', (task_id, task_id)).fetchone():
+                    ready.append(task_id)
+            return ready
+
+        async def measure(case: str, title: str, call: Callable) -> Any:
+            latencies = []
+            for _ in range(rounds):
+                started = time.perf_counter()
+                result = await call()
+                latencies.append(time.perf_counter() - started)
+            print(f"  {title}: {percentiles(latencies)}")
+            record(case, **percentile_values(latencies))
+            return result
+
+        expected = await measure('progress_python', "прогресс дерева, обход в Python",
+                                 lambda: db.run(python_progress, root))
+        progress = await measure('progress_cte', "прогресс дерева, рекурсивный CTE",
+                                 lambda: db.get_subtask_progress(root))
+        if tuple(progress) != expected:
+            raise SystemExit(f"Прогресс не совпадает: {progress} != {expected}")
+        await measure('ready_python', "«можно делать», проверка каждой задачи в Python",
+                      lambda: db.run(python_ready))
+        await measure('ready_page', "«можно делать», страница из 10 задач по частичному индексу",
+                      lambda: db.get_user_tasks(user_id, limit=10, ready=True))
+        cycle = await measure('cycle_check', f"отказ в зависимости, замыкающей цепочку из {len(chain)} задач",
+                              lambda: db.add_dependency(chain[0], chain[-1]))
+        if cycle:
+            raise SystemExit("Цикл не обнаружен")
+        blocked = await measure('complete_blocked', "отказ выполнить корень дерева",
+                                lambda: db.complete_task(root))
+        if blocked:
+            raise SystemExit("Корень с активными подзадачами отмечен выполненным")
+        latencies = []
+        for task_id in chain[:rounds]:
+            started = time.perf_counter()
+            if not await db.complete_task(task_id):
+                raise SystemExit(f"Задача {task_id} цепочки заблокирована")
+            latencies.append(time.perf_counter() - started)
+        print(f"  выполнение задачи цепочки (следующая разблокируется): {percentiles(latencies)}")
+        record('complete_chain', **percentile_values(latencies))
+        await db.close()
+
+
+def reminder_worker(db_path: str, task_ids: List[int], seconds: float) -> Tuple[List[int], bool]:
+    """Процесс бота в режиме sweeper; дополнительно сам пытается отправить напоминания task_ids
+
+    Возвращает ID задач, напоминания о которых он отправил, и был ли он ведущим в конце.
+    """
+    return asyncio.run(_reminder_worker(db_path, task_ids, seconds))
+
+
+async def _reminder_worker(db_path: str, task_ids: List[int], seconds: float) -> Tuple[List[int], bool]:
+    main = load_bot(db_path, REMINDER_MODE='sweeper', REMINDER_SWEEP_SECONDS=0.2, REMINDER_LEASE_SECONDS=3,
+                    SEND_RATE_GLOBAL=1000, SEND_RATE_PER_CHAT=1000)
+    await start_bot(main)
+    started = time.monotonic()
+    # Посторонние задания напоминаний (как после смены ведущего) соревнуются со sweeper'ом
+    random.shuffle(task_ids)
+    await asyncio.gather(*(main.send_reminder(task_id) for task_id in task_ids))
+    await asyncio.sleep(max(0.0, seconds - (time.monotonic() - started)))
+    await main.outbox.join()
+    sent = [int(re.search(r'\(ID: (\d+)\)', text).group(1)) for text in main.bot.session.sent]
+    leader = main.is_reminder_leader
+    await stop_bot(main)
+    return sent, leader
+
+
+async def bench_history(args: argparse.Namespace) -> None:
+    """История изменений: args.tasks правок задач в args.updates одновременных обработчиках
+
+    Запись события в отдельной транзакции на каждую правку сравнивается с отложенной записью
+    TaskHistory пачками; замеряются чтение истории задачи и очистка старых событий.
+    """
+    tasks, keep = 1000, 100
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        await db.connect()
+        await db.init_db()
+        user_id = await db.register_user(fake_user(1))
+        rows = [('Задача', '', 1, user_id, user_id, 'Средний', 2000000000, STATUS_ACTIVE)] * tasks
+        await db.import_tasks(rows, 0, int(time.time()))
+        calls = Counter()
+        db.query_observer = lambda name, seconds, rows: calls.update([name])
+
+        async def edit(task_id: int, n: int, audit: Callable) -> float:
+            started = time.perf_counter()
+            old_value = await db.update_task_field(task_id, 'name', f'Задача {n}')
+            await audit((task_id, user_id, 'name', old_value, f'Задача {n}', int(time.time())))
+            return time.perf_counter() - started
+
+        async def run(name: str, audit: Callable, close: Callable) -> None:
+            calls.clear()
+            queue = iter(range(args.tasks))
+            latencies = []
+
+            async def handler() -> None:
+                for n in queue:
+                    latencies.append(await edit(1 + n % tasks, n, audit))
+
+            started = time.perf_counter()
+            await asyncio.gather(*(handler() for _ in range(args.updates)))
+            await close()
+            elapsed = time.perf_counter() - started
+            print(f"  {name}: {args.tasks / elapsed:.0f} правок/с, {percentiles(latencies)}, "
+                  f"транзакций истории: {calls['add_task_events']}")
+            record(name, edits=args.tasks, seconds=elapsed, history_transactions=calls['add_task_events'],
+                   **percentile_values(latencies))
+
+        async def write_now(event: Tuple) -> None:
+            await db.add_task_events([event], keep)
+
+        async def nothing() -> None:
+            pass
+
+        print(f"Правок: {args.tasks}, одновременных обработчиков: {args.updates}")
+        await run('without_history', lambda event: nothing(), nothing)
+        await run('history_per_edit', write_now, nothing)
+        history = TaskHistory(db, keep=keep)
+        await history.start()
+
+        async def buffer(event: Tuple) -> None:
+            history.record(*event[:5])
+
+        await run('history_buffered', buffer, history.close)
+
+        # Чтение истории и очистка: половина событий старше срока хранения
+        now = int(time.time())
+        events = [(1 + n % tasks, user_id, 'deadline', now, now + 3600, now - (400 if n % 2 else 0) * 86400)
+                  for n in range(tasks * keep)]
+        for chunk in range(0, len(events), 10000):
+            await db.add_task_events(events[chunk:chunk + 10000], keep)
+        latencies = []
+        for n in range(200):
+            started = time.perf_counter()
+            await db.get_task_events(1 + n % tasks, 20)
+            latencies.append(time.perf_counter() - started)
+        print(f"  /history (20 событий из {len(events)}): {percentiles(latencies)}")
+        record('read', events=len(events), **percentile_values(latencies))
+        history = TaskHistory(db, keep=keep)
+        started = time.perf_counter()
+        deleted = await history.compact(now - 365 * 86400)
+        elapsed = time.perf_counter() - started
+        print(f"  очистка: удалено {deleted} событий за {elapsed:.2f} с")
+        record('compact', deleted=deleted, seconds=elapsed)
+        await db.close()
+
+
+async def bench_workers(args: argparse.Namespace) -> None:
+    """Несколько процессов бота на одной базе: каждое напоминание должно уйти ровно один раз"""
+    seconds = 6
+    loop = asyncio.get_running_loop()
+    with tempfile.TemporaryDirectory() as tmp, \
+            ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        # Процессы запускаются и импортируют aiogram заранее, чтобы время напоминаний не ушло на старт
+        await asyncio.gather(*(loop.run_in_executor(pool, fake_user, n) for n in range(args.workers)))
+
+        db_path = os.path.join(tmp, 'bench.db')
+        store = Database(db_path)
+        await store.connect()
+        await store.init_db()
+        now = int(time.time())
+        task_ids = []
+        for n in range(args.messages):
+            user_id = await store.register_user(fake_user(1000 + n % args.chats))
+            data = task_data(user_id)
+            data['deadline'] = now + 23 * 3600
+            task_id = await store.add_task_to_db(data)
+            # Половина напоминаний уже наступила, остальные наступают во время теста
+            remind_at = now - 60 if n % 2 == 0 else now + 1 + n % (seconds - 2)
+            await store.set_reminder(task_id, remind_at)
+            task_ids.append(task_id)
+        await store.close()
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(
+            loop.run_in_executor(pool, reminder_worker, db_path, task_ids[::2], seconds)
+            for _ in range(args.workers)
+        ))
+        elapsed = time.perf_counter() - started
+
+    counts = Counter(task_id for sent, _ in results for task_id in sent)
+    duplicates = sum(1 for count in counts.values() if count > 1)
+    missing = len(set(task_ids) - set(counts))
+    print(f"Процессов: {args.workers}, напоминаний: {len(task_ids)}, время: {elapsed:.1f} с")
+    for n, (sent, leader) in enumerate(results):
+        print(f"  процесс {n}: отправлено {len(sent)}{', ведущий' if leader else ''}")
+    print(f"  дубликатов: {duplicates}, не отправлено: {missing}")
+    if duplicates or missing:
+        raise SystemExit("Напоминания отправлены не ровно по одному разу")
+
+
+BENCHMARKS = {
+    'db': bench_db,
+    'digest': bench_digest,
+    'graph': bench_graph,
+    'handlers': bench_handlers,
+    'history': bench_history,
+    'import': bench_import,
+    'inline': bench_inline,
+    'recurrence': bench_recurrence,
+    'rows': bench_rows,
+    'render': bench_render,
+    'search': bench_search,
+    'send': bench_send,
+    'stats': bench_stats,
+    'webhook': bench_webhook,
+    'workers': bench_workers,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--updates', type=int, default=300, help='число одновременных обновлений')
+    parser.add_argument('--tasks', type=int, default=20000, help='число задач у пользователя')
+    parser.add_argument('--messages', type=int, default=600, help='число исходящих сообщений')
+    parser.add_argument('--chats', type=int, default=200, help='число разных чатов')
+    parser.add_argument('--rate', type=float, default=28, help='общий лимит очереди, сообщений в секунду')
+    parser.add_argument('--concurrency', type=int, default=100, help='одновременных запросов к webhook')
+    parser.add_argument('--latency', type=float, default=0.05, help='задержка ответа Telegram API, с')
+    parser.add_argument('--workers', type=int, default=4, help='число процессов бота')
+    parser.add_argument('--json', metavar='PATH', help='записать результаты в файл JSON')
+    args = parser.parse_args()
+    asyncio.run(BENCHMARKS[args.benchmark](args))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump({
+                'benchmark': args.benchmark, 'commit': git_commit(), 'time': datetime.datetime.now().isoformat(),
+                'python': sys.version.split()[0], 'sqlite': sqlite3.sqlite_version,
+                'args': vars(args), 'results': RESULTS,
+            }, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,89 @@
 # Конфигурационный файл для Telegram-бота
 # Замените 'YOUR_BOT_TOKEN' на реальный токен вашего бота, полученный от @BotFather
 
-BOT_TOKEN = 'YOUR_BOT_TOKEN'
\ No newline at end of file
+BOT_TOKEN = 'YOUR_BOT_TOKEN'
+
+# Необязательные настройки (если их нет, используются значения по умолчанию)
+
+# Путь к файлу базы данных SQLite
+DB_PATH = 'tasks.db'
+
+# Сколько миллисекунд ждать, пока базу держит запись другого процесса бота
+DB_BUSY_TIMEOUT_MS = 5000
+
+# Размер кэша подготовленных SQL-выражений на соединение
+DB_CACHED_STATEMENTS = 256
+
+# Размер LRU-кэша пользователей (telegram_id -> внутренний ID)
+USER_CACHE_SIZE = 10000
+
+# Размер кэша готовых карточек задач для /list_tasks
+TASK_CARD_CACHE_SIZE = 10000
+
+# Количество задач на одной странице /list_tasks
+TASKS_PAGE_SIZE = 10
+
+# Окно (в минутах), на которое напоминания из базы заранее ставятся в планировщик
+REMINDER_WINDOW_MINUTES = 60
+
+# Режим напоминаний: 'jobs' - задание планировщика на каждое напоминание,
+# 'sweeper' - одно периодическое задание раз в REMINDER_SWEEP_SECONDS секунд.
+# При WEBHOOK_WORKERS > 1 всегда используется 'sweeper'
+REMINDER_MODE = 'jobs'
+REMINDER_SWEEP_SECONDS = 60
+
+# Как часто (в секундах) проверяется, не наступил ли час ежедневной сводки (/digest) у пользователей
+DIGEST_CHECK_SECONDS = 60
+
+# За сколько дней до дедлайна создается очередное повторение повторяющейся задачи (/repeat)
+RECURRENCE_HORIZON_DAYS = 2
+
+# История изменений задач (/history): как часто (в секундах) накопленные события пишутся в базу,
+# сколько последних событий хранится у задачи и через сколько дней события удаляются
+HISTORY_FLUSH_SECONDS = 2
+HISTORY_MAX_EVENTS_PER_TASK = 100
+HISTORY_RETENTION_DAYS = 365
+
+# Inline-режим (@бот текст): сколько секунд бот помнит результаты запросов пользователя.
+# Изменения задач самого пользователя сбрасывают их сразу, изменения из других процессов видны через это время
+INLINE_CACHE_SECONDS = 15
+
+# Ограничения исходящих сообщений бота: всего в секунду, в один чат в секунду, число воркеров
+SEND_RATE_GLOBAL = 30
+SEND_RATE_PER_CHAT = 1
+SEND_CONCURRENCY = 8
+
+# Хранилище состояний диалогов: 'sqlite' (переживает перезапуск) или 'memory'
+FSM_STORAGE = 'sqlite'
+# Через сколько часов бездействия незавершенный диалог удаляется
+FSM_STATE_TTL_HOURS = 24
+
+# Способ получения обновлений: 'polling' (для разработки) или 'webhook'
+RUN_MODE = 'polling'
+# Настройки webhook: публичный адрес (https://example.com), путь, адрес и порт локального сервера,
+# секрет для заголовка X-Telegram-Bot-Api-Secret-Token и лимит одновременно обрабатываемых обновлений
+WEBHOOK_URL = ''
+WEBHOOK_PATH = '/webhook'
+WEBHOOK_HOST = '0.0.0.0'
+WEBHOOK_PORT = 8080
+WEBHOOK_SECRET = ''
+WEBHOOK_MAX_CONCURRENCY = 64
+
+# Число процессов-воркеров в режиме webhook: при значении больше 1 основной процесс принимает
+# обновления и распределяет их по id чата, воркер n слушает 127.0.0.1:WEBHOOK_WORKER_PORT + n
+WEBHOOK_WORKERS = 1
+WEBHOOK_WORKER_PORT = 8081
+
+# Напоминания рассылает один процесс; срок (в секундах) его аренды в базе
+REMINDER_LEASE_SECONDS = 30
+
+# Сколько строк файла /import записывается в базу одной транзакцией
+IMPORT_BATCH_SIZE = 1000
+
+# Метрики в формате Prometheus: http://METRICS_HOST:METRICS_PORT/metrics (0 - выключены).
+# Процессы-воркеры отдают свои метрики на METRICS_PORT + 1, METRICS_PORT + 2, ...
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 0
+
+# Запросы к базе дольше стольких миллисекунд пишутся в журнал (None - не писать), например 100
+SLOW_QUERY_MS = None
@@ -0,0 +1,1624 @@
+import asyncio
+import contextlib
+import datetime
+import functools
+import logging
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, AsyncIterator, Iterable, Optional, List, Tuple, Callable
+
+logger = logging.getLogger(__name__)
+
+# Поля задачи, которые разрешено менять через /update_task
+UPDATABLE_FIELDS = ('name', 'description', 'priority', 'deadline')
+
+# Приоритеты и статусы; позиция в кортеже хранится в колонках *_rank для сортировки по индексу
+PRIORITIES = ('Высокий', 'Средний', 'Низкий')
+STATUS_ACTIVE = 'Активная'
+STATUS_COMPLETED = 'Выполнена'
+STATUSES = (STATUS_ACTIVE, STATUS_COMPLETED)
+
+
+def priority_rank(priority: Optional[str]) -> int:
+    """Значение tasks.priority_rank: позиция в PRIORITIES, -1 - приоритет не из списка (старые данные)"""
+    return PRIORITIES.index(priority) if priority in PRIORITIES else -1
+
+
+def user_search_names(username: Optional[str], first_name: Optional[str], last_name: Optional[str]) -> set:
+    """Нормализованные части имени пользователя для поиска по префиксу"""
+    return {name.lower() for name in (username, first_name, last_name) if name}
+
+
+# Самый длинный префиксный индекс tasks_fts (prefix='2 3 4 5 6' в миграции 9)
+FTS_PREFIX_LENGTH = 6
+
+# Буквы, которыми обычно кончаются окончания русских слов
+_WORD_ENDINGS = 'аеиоуыэюяйь'
+
+
+def _fts_values(row: str) -> str:
+    """SQL-значения строки индекса tasks_fts для задачи row (new, old или tasks)
+
+    ё заменяется на е (unicode61 их не отождествляет), в owners - токены u<id>
+    создателя и исполнителя, по ним поиск ограничивается задачами пользователя.
+    """
+    return (
+        f"{row}.id, replace(replace({row}.name, 'ё', 'е'), 'Ё', 'Е'), "
+        f"replace(replace(COALESCE({row}.description, ''), 'ё', 'е'), 'Ё', 'Е'), "
+        f"'u' || {row}.creator_id || COALESCE(' u' || {row}.assignee_id, '')"
+    )
+
+
+def _search_stem(word: str) -> str:
+    # Обрезка до самого длинного префиксного индекса tasks_fts и гласных окончания: поиск идет
+    # по готовому индексу и находит другие формы слова (отчеты - отчет, проверками - проверка)
+    word = word[:FTS_PREFIX_LENGTH]
+    stem = word.rstrip(_WORD_ENDINGS)
+    return stem if len(stem) >= 3 else word
+
+
+def search_terms(text: str) -> List[str]:
+    """Основы слов запроса для поиска по началу слова: нижний регистр, ё -> е, не больше 8 слов"""
+    return [_search_stem(word) for word in re.findall(r'\w+', text.lower().replace('ё', 'е'))[:8]]
+
+
+def fts_query(terms: List[str], user_id: int) -> str:
+    """Выражение MATCH для задач пользователя, в названии или описании которых есть все слова terms"""
+    # Каждое слово - в кавычках, чтобы операторы FTS5 в тексте пользователя не работали
+    words = ' AND '.join(f'"{term}"*' if len(term) > 1 else f'"{term}"' for term in terms)
+    return f'owners : "u{user_id}" AND {{name description}} : ({words})'
+
+
+def _name_has_terms(name: str, terms: List[str]) -> bool:
+    tokens = re.findall(r'\w+', name.lower().replace('ё', 'е'))
+    return all(any(token.startswith(term) for token in tokens) for term in terms)
+
+
+def _stats_delta(row: str, sign: int) -> str:
+    """SQL изменения счетчиков project_counts и project_workload на задачу row (new или old) со знаком sign
+
+    Просроченной считается активная задача с дедлайном раньше отметки overdue_mark.until;
+    задачи без проекта, исполнителя или приоритета учитываются под 0 (приоритет - под -1).
+    """
+    overdue = f"COALESCE({row}.status_rank = 0 AND {row}.deadline < (SELECT until FROM overdue_mark), 0)"
+    return f'''
+            INSERT INTO project_counts (project_id, status_rank, priority_rank, tasks, overdue)
+            VALUES (COALESCE({row}.project_id, 0), {row}.status_rank, COALESCE({row}.priority_rank, -1),
+                    {sign}, {sign} * {overdue})
+            ON CONFLICT DO UPDATE SET tasks = tasks + excluded.tasks, overdue = overdue + excluded.overdue;
+            INSERT INTO project_workload (project_id, assignee_id, active, completed, overdue)
+            VALUES (COALESCE({row}.project_id, 0), COALESCE({row}.assignee_id, 0),
+                    {sign} * ({row}.status_rank = 0), {sign} * ({row}.status_rank = 1), {sign} * {overdue})
+            ON CONFLICT DO UPDATE SET active = active + excluded.active, completed = completed + excluded.completed,
+                                      overdue = overdue + excluded.overdue;
+    '''
+
+
+def _backfill_user_names(conn: sqlite3.Connection) -> None:
+    # lower() в SQLite понимает только ASCII, поэтому имена нормализуются в Python
+    rows = conn.execute('SELECT id, username, first_name, last_name FROM users').fetchall()
+    conn.executemany(
+        'INSERT OR IGNORE INTO user_names (name, user_id) VALUES (?, ?)',
+        [(name, user_id) for user_id, *names in rows for name in user_search_names(*names)]
+    )
+
+
+# Версионированные миграции схемы: (версия, список SQL-выражений или функций от соединения).
+# Миграции только добавляются в конец, уже выпущенные не редактируются.
+MIGRATIONS: List[Tuple[int, List[str]]] = [
+    (1, [
+        # Исходная схема; IF NOT EXISTS позволяет принять существующие базы без изменений
+        '''
+        CREATE TABLE IF NOT EXISTS projects (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            description TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            telegram_id INTEGER NOT NULL UNIQUE,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            description TEXT,
+            project_id INTEGER,
+            creator_id INTEGER NOT NULL,
+            assignee_id INTEGER,
+            priority TEXT CHECK(priority IN ('Низкий', 'Средний', 'Высокий')),
+            deadline TEXT,
+            status TEXT DEFAULT 'Активная' CHECK(status IN ('Активная', 'Выполнена')),
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (project_id) REFERENCES projects (id),
+            FOREIGN KEY (creator_id) REFERENCES users (id),
+            FOREIGN KEY (assignee_id) REFERENCES users (id)
+        )
+        ''',
+    ]),
+    (2, [
+        # Целочисленные ранги приоритета и статуса, чтобы ORDER BY шел по индексу
+        'ALTER TABLE tasks ADD COLUMN priority_rank INTEGER',
+        'ALTER TABLE tasks ADD COLUMN status_rank INTEGER NOT NULL DEFAULT 0',
+        '''
+        UPDATE tasks SET
+            priority_rank = CASE priority WHEN 'Высокий' THEN 0 WHEN 'Средний' THEN 1 WHEN 'Низкий' THEN 2 END,
+            status_rank = CASE status WHEN 'Выполнена' THEN 1 ELSE 0 END
+        ''',
+        # Списки задач пользователя: отдельный индекс для каждой ветки creator_id OR assignee_id
+        'CREATE INDEX IF NOT EXISTS idx_tasks_creator ON tasks (creator_id, status_rank, priority_rank, deadline)',
+        'CREATE INDEX IF NOT EXISTS idx_tasks_assignee ON tasks (assignee_id, status_rank, priority_rank, deadline)',
+        # Фильтр по статусу и поиск задач с приближающимся дедлайном
+        'CREATE INDEX IF NOT EXISTS idx_tasks_status_deadline ON tasks (status_rank, deadline)',
+    ]),
+    (3, [
+        # Напоминания переживают перезапуск; время хранится в секундах UTC
+        '''
+        CREATE TABLE IF NOT EXISTS reminders (
+            task_id INTEGER PRIMARY KEY,
+            remind_at INTEGER NOT NULL,
+            sent_at INTEGER,
+            FOREIGN KEY (task_id) REFERENCES tasks (id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_reminders_pending ON reminders (remind_at) WHERE sent_at IS NULL',
+        # Напоминания для активных задач, дедлайн которых еще не наступил (время задач - локальное)
+        '''
+        INSERT OR IGNORE INTO reminders (task_id, remind_at)
+        SELECT id, CAST(strftime('%s', deadline, 'utc') AS INTEGER) - 86400
+        FROM tasks
+        WHERE status_rank = 0 AND deadline IS NOT NULL
+          AND CAST(strftime('%s', deadline, 'utc') AS INTEGER) > CAST(strftime('%s', 'now') AS INTEGER)
+        ''',
+    ]),
+    (4, [
+        # Индекс имен для поиска исполнителя по префиксу (username, имя, фамилия в нижнем регистре)
+        '''
+        CREATE TABLE IF NOT EXISTS user_names (
+            name TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (name, user_id),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        ) WITHOUT ROWID
+        ''',
+        _backfill_user_names,
+        # Недавние исполнители, которым пользователь назначал задачи
+        '''
+        CREATE TABLE IF NOT EXISTS collaborators (
+            user_id INTEGER NOT NULL,
+            collaborator_id INTEGER NOT NULL,
+            last_used INTEGER NOT NULL,
+            PRIMARY KEY (user_id, collaborator_id),
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (collaborator_id) REFERENCES users (id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_collaborators_recent ON collaborators (user_id, last_used)',
+        '''
+        INSERT OR IGNORE INTO collaborators (user_id, collaborator_id, last_used)
+        SELECT creator_id, assignee_id, CAST(strftime('%s', MAX(created_at), 'utc') AS INTEGER)
+        FROM tasks
+        WHERE assignee_id IS NOT NULL AND assignee_id != creator_id
+        GROUP BY creator_id, assignee_id
+        ''',
+    ]),
+    (5, [
+        # Состояния диалогов FSM (данные - JSON), переживают перезапуск бота
+        '''
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states (updated_at)',
+    ]),
+    (6, [
+        # Аренды ролей, которые в каждый момент должен исполнять только один процесс бота
+        '''
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at INTEGER NOT NULL
+        )
+        ''',
+    ]),
+    (7, [
+        # Версия строки задачи растет при каждом изменении; по ней проверяется кэш карточек
+        'ALTER TABLE tasks ADD COLUMN version INTEGER NOT NULL DEFAULT 0',
+    ]),
+    (8, [
+        # Часовой пояс пользователя (имя IANA); NULL - локальное время сервера
+        'ALTER TABLE users ADD COLUMN timezone TEXT',
+        # deadline и created_at - секунды UTC вместо текста в локальном времени сервера.
+        # Тип колонки через ALTER не меняется, поэтому таблица пересобирается
+        '''
+        CREATE TABLE tasks_new (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            description TEXT,
+            project_id INTEGER,
+            creator_id INTEGER NOT NULL,
+            assignee_id INTEGER,
+            priority TEXT CHECK(priority IN ('Низкий', 'Средний', 'Высокий')),
+            priority_rank INTEGER,
+            deadline INTEGER,
+            status TEXT DEFAULT 'Активная' CHECK(status IN ('Активная', 'Выполнена')),
+            status_rank INTEGER NOT NULL DEFAULT 0,
+            created_at INTEGER NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (project_id) REFERENCES projects (id),
+            FOREIGN KEY (creator_id) REFERENCES users (id),
+            FOREIGN KEY (assignee_id) REFERENCES users (id)
+        )
+        ''',
+        '''
+        INSERT INTO tasks_new (id, name, description, project_id, creator_id, assignee_id, priority, priority_rank,
+                               deadline, status, status_rank, created_at, version)
+        SELECT id, name, description, project_id, creator_id, assignee_id, priority, priority_rank,
+               CAST(strftime('%s', deadline, 'utc') AS INTEGER), status, status_rank,
+               COALESCE(CAST(strftime('%s', created_at, 'utc') AS INTEGER), CAST(strftime('%s', 'now') AS INTEGER)),
+               version
+        FROM tasks
+        ''',
+        'DROP TABLE tasks',
+        'ALTER TABLE tasks_new RENAME TO tasks',
+        'CREATE INDEX idx_tasks_creator ON tasks (creator_id, status_rank, priority_rank, deadline)',
+        'CREATE INDEX idx_tasks_assignee ON tasks (assignee_id, status_rank, priority_rank, deadline)',
+        'CREATE INDEX idx_tasks_status_deadline ON tasks (status_rank, deadline)',
+        # Выборки задач пользователя по диапазону дедлайна (скоро срок, просрочено)
+        'CREATE INDEX idx_tasks_creator_deadline ON tasks (creator_id, status_rank, deadline)',
+        'CREATE INDEX idx_tasks_assignee_deadline ON tasks (assignee_id, status_rank, deadline)',
+    ]),
+    (9, [
+        # Полнотекстовый индекс названий и описаний задач для /search. Таблица без копии текста
+        # (content='') и позиций слов (detail='column'), синхронизируется триггерами. Префиксные
+        # индексы длиной 2-6 нужны поиску по началу слова: без них FTS5 сливает списки всех слов
+        # с этим началом
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+            name, description, owners, content='', detail='column', prefix='2 3 4 5 6',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN
+            INSERT INTO tasks_fts (rowid, name, description, owners) VALUES ({_fts_values('new')});
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, name, description, owners) VALUES ('delete', {_fts_values('old')});
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF name, description, creator_id, assignee_id
+        ON tasks BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, name, description, owners) VALUES ('delete', {_fts_values('old')});
+            INSERT INTO tasks_fts (rowid, name, description, owners) VALUES ({_fts_values('new')});
+        END
+        ''',
+        f'INSERT INTO tasks_fts (rowid, name, description, owners) SELECT {_fts_values("tasks")} FROM tasks',
+    ]),
+    (10, [
+        # Флаг массовой загрузки: пока active = 1 (только внутри транзакции import_tasks), триггер
+        # индекса не срабатывает, и tasks_fts заполняется одним INSERT ... SELECT - в 4 раза быстрее
+        'CREATE TABLE bulk_load (active INTEGER NOT NULL)',
+        'INSERT INTO bulk_load (active) VALUES (0)',
+        'DROP TRIGGER tasks_fts_insert',
+        f'''
+        CREATE TRIGGER tasks_fts_insert AFTER INSERT ON tasks WHEN NOT (SELECT active FROM bulk_load) BEGIN
+            INSERT INTO tasks_fts (rowid, name, description, owners) VALUES ({_fts_values('new')});
+        END
+        ''',
+    ]),
+    (11, [
+        # Счетчики для /project_stats, которые триггеры меняют вместе с задачами: по проекту,
+        # статусу и приоритету и по проекту и исполнителю. Просроченные считаются относительно
+        # отметки overdue_mark.until; Database.get_project_stats сдвигает ее к текущему моменту,
+        # досчитывая только задачи, дедлайн которых прошел после прошлого сдвига. При массовой
+        # загрузке (bulk_load) счетчики меняет import_tasks одним запросом на пачку
+        'CREATE TABLE overdue_mark (until INTEGER NOT NULL)',
+        "INSERT INTO overdue_mark (until) VALUES (CAST(strftime('%s', 'now') AS INTEGER))",
+        '''
+        CREATE TABLE project_counts (
+            project_id INTEGER NOT NULL,
+            status_rank INTEGER NOT NULL,
+            priority_rank INTEGER NOT NULL,
+            tasks INTEGER NOT NULL,
+            overdue INTEGER NOT NULL,
+            PRIMARY KEY (project_id, status_rank, priority_rank)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE project_workload (
+            project_id INTEGER NOT NULL,
+            assignee_id INTEGER NOT NULL,
+            active INTEGER NOT NULL,
+            completed INTEGER NOT NULL,
+            overdue INTEGER NOT NULL,
+            PRIMARY KEY (project_id, assignee_id)
+        ) WITHOUT ROWID
+        ''',
+        # Самые загруженные исполнители проекта без сортировки всех строк
+        'CREATE INDEX idx_project_workload_active ON project_workload (project_id, active)',
+        '''
+        INSERT INTO project_counts (project_id, status_rank, priority_rank, tasks, overdue)
+        SELECT COALESCE(project_id, 0), status_rank, COALESCE(priority_rank, -1), COUNT(*),
+               SUM(COALESCE(status_rank = 0 AND deadline < (SELECT until FROM overdue_mark), 0))
+        FROM tasks GROUP BY 1, 2, 3
+        ''',
+        '''
+        INSERT INTO project_workload (project_id, assignee_id, active, completed, overdue)
+        SELECT COALESCE(project_id, 0), COALESCE(assignee_id, 0), SUM(status_rank = 0), SUM(status_rank = 1),
+               SUM(COALESCE(status_rank = 0 AND deadline < (SELECT until FROM overdue_mark), 0))
+        FROM tasks GROUP BY 1, 2
+        ''',
+        f'''
+        CREATE TRIGGER tasks_stats_insert AFTER INSERT ON tasks WHEN NOT (SELECT active FROM bulk_load) BEGIN
+            {_stats_delta('new', 1)}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER tasks_stats_delete AFTER DELETE ON tasks BEGIN
+            {_stats_delta('old', -1)}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER tasks_stats_update AFTER UPDATE OF project_id, assignee_id, status_rank, priority_rank, deadline
+        ON tasks BEGIN
+            {_stats_delta('old', -1)}
+            {_stats_delta('new', 1)}
+        END
+        ''',
+    ]),
+    (12, [
+        # Ежедневная сводка: час в часовом поясе пользователя (NULL - выключена) и следующий запуск
+        # в секундах UTC; пока сводка включена, напоминания о каждой задаче пользователю не приходят
+        'ALTER TABLE users ADD COLUMN digest_hour INTEGER',
+        'ALTER TABLE users ADD COLUMN digest_next_at INTEGER',
+        'CREATE INDEX idx_users_digest ON users (digest_next_at) WHERE digest_next_at IS NOT NULL',
+    ]),
+    (13, [
+        # Повторяющиеся задачи: шаблон хранится один раз, а задачи-повторения создаются по мере
+        # приближения дедлайна. next_deadline - дедлайн следующего еще не созданного повторения,
+        # anchor - первый дедлайн (от него берутся время суток и день месяца)
+        '''
+        CREATE TABLE recurrences (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            description TEXT,
+            project_id INTEGER,
+            creator_id INTEGER NOT NULL,
+            assignee_id INTEGER,
+            priority TEXT,
+            rule TEXT NOT NULL,
+            timezone TEXT,
+            anchor INTEGER NOT NULL,
+            next_deadline INTEGER NOT NULL,
+            created_at INTEGER NOT NULL
+        )
+        ''',
+        'CREATE INDEX idx_recurrences_next ON recurrences (next_deadline)',
+        'CREATE INDEX idx_recurrences_creator ON recurrences (creator_id)',
+        'CREATE INDEX idx_recurrences_assignee ON recurrences (assignee_id)',
+        'ALTER TABLE tasks ADD COLUMN recurrence_id INTEGER REFERENCES recurrences (id)',
+        'CREATE INDEX idx_tasks_recurrence ON tasks (recurrence_id, status_rank) WHERE recurrence_id IS NOT NULL',
+    ]),
+    (14, [
+        # Подзадачи (parent_id) и зависимости «задача ждет blocker_id». tasks.blockers - число
+        # активных блокирующих задач и активных подзадач; его меняют триггеры, поэтому проверка
+        # при выполнении и фильтр «можно делать» не обходят граф
+        'ALTER TABLE tasks ADD COLUMN parent_id INTEGER REFERENCES tasks (id)',
+        'ALTER TABLE tasks ADD COLUMN blockers INTEGER NOT NULL DEFAULT 0',
+        'CREATE INDEX idx_tasks_parent ON tasks (parent_id) WHERE parent_id IS NOT NULL',
+        '''
+        CREATE TABLE task_dependencies (
+            task_id INTEGER NOT NULL REFERENCES tasks (id),
+            blocker_id INTEGER NOT NULL REFERENCES tasks (id),
+            PRIMARY KEY (task_id, blocker_id)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX idx_task_dependencies_blocker ON task_dependencies (blocker_id, task_id)',
+        # Списки «можно делать» (/list_tasks ready) по частичным индексам без заблокированных задач
+        'CREATE INDEX idx_tasks_creator_ready ON tasks (creator_id, status_rank, priority_rank, deadline) '
+        'WHERE blockers = 0',
+        'CREATE INDEX idx_tasks_assignee_ready ON tasks (assignee_id, status_rank, priority_rank, deadline) '
+        'WHERE blockers = 0',
+        '''
+        CREATE TRIGGER task_dependencies_insert AFTER INSERT ON task_dependencies BEGIN
+            UPDATE tasks SET blockers = blockers + 1
+            WHERE id = new.task_id AND (SELECT status_rank FROM tasks WHERE id = new.blocker_id) = 0;
+        END
+        ''',
+        '''
+        CREATE TRIGGER task_dependencies_delete AFTER DELETE ON task_dependencies BEGIN
+            UPDATE tasks SET blockers = blockers - 1
+            WHERE id = old.task_id AND (SELECT status_rank FROM tasks WHERE id = old.blocker_id) = 0;
+        END
+        ''',
+        '''
+        CREATE TRIGGER tasks_subtask_insert AFTER INSERT ON tasks
+        WHEN new.parent_id IS NOT NULL AND new.status_rank = 0 BEGIN
+            UPDATE tasks SET blockers = blockers + 1 WHERE id = new.parent_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER tasks_parent_update AFTER UPDATE OF parent_id ON tasks
+        WHEN old.parent_id IS NOT new.parent_id AND new.status_rank = 0 BEGIN
+            UPDATE tasks SET blockers = blockers - 1 WHERE id = old.parent_id;
+            UPDATE tasks SET blockers = blockers + 1 WHERE id = new.parent_id;
+        END
+        ''',
+        # Выполнение (или возврат в работу) меняет счетчик у ждущих задач и у родителя
+        '''
+        CREATE TRIGGER tasks_status_blockers AFTER UPDATE OF status_rank ON tasks
+        WHEN old.status_rank != new.status_rank BEGIN
+            UPDATE tasks SET blockers = blockers + CASE WHEN new.status_rank = 0 THEN 1 ELSE -1 END
+            WHERE id IN (SELECT task_id FROM task_dependencies WHERE blocker_id = new.id);
+            UPDATE tasks SET blockers = blockers + CASE WHEN new.status_rank = 0 THEN 1 ELSE -1 END
+            WHERE id = new.parent_id;
+        END
+        ''',
+    ]),
+    (15, [
+        # История изменений задач: строки только добавляются. kind - 'created', 'status' или имя поля;
+        # у old_value и new_value нет типа, чтобы дедлайн хранился числом, а текст - строкой
+        '''
+        CREATE TABLE task_events (
+            id INTEGER PRIMARY KEY,
+            task_id INTEGER NOT NULL,
+            actor_id INTEGER,
+            kind TEXT NOT NULL,
+            old_value,
+            new_value,
+            created_at INTEGER NOT NULL
+        )
+        ''',
+        'CREATE INDEX idx_task_events_task ON task_events (task_id, id)',
+        'CREATE INDEX idx_task_events_created ON task_events (created_at)',
+    ]),
+    (16, [
+        # В ключе листания списков (priority_rank, deadline, id) не должно быть NULL: сравнение с NULL
+        # ложно, и такие задачи пропадали между страницами. Приоритет не из PRIORITIES получает ранг -1
+        # (/project_stats и так считал его -1), а дедлайн, который миграция 8 не разобрала, - время
+        # создания задачи: задача видна как просроченная, и дедлайн можно исправить
+        'UPDATE tasks SET priority_rank = -1 WHERE priority_rank IS NULL',
+        "UPDATE tasks SET deadline = COALESCE(created_at, CAST(strftime('%s', 'now') AS INTEGER)) "
+        'WHERE deadline IS NULL',
+    ]),
+]
+
+
+def _timed_call(call: Callable) -> Tuple[Any, float]:
+    # Выполняется в потоке базы данных
+    started = time.perf_counter()
+    result = call()
+    return result, time.perf_counter() - started
+
+def db_call(func: Callable) -> Callable:
+    """Декоратор: выполняет метод в потоке базы данных, обработчик получает awaitable"""
+    @functools.wraps(func)
+    async def wrapper(self: 'Database', *args, **kwargs):
+        return await self.run(func, self, *args, **kwargs)
+    return wrapper
+
+# Запрос задач пользователя: по одной ветке на индекс создателя и исполнителя,
+# каждая начинает чтение с ключа курсора и ограничена limit строками (-1 - без ограничения)
+_TASK_PAGE_SQL = '''
+SELECT t.id, t.name, t.description, p.name, t.priority, t.deadline, t.status,
+       u.username as creator, a.username as assignee, t.version
+FROM (
+    SELECT * FROM (
+        SELECT id, priority_rank, deadline FROM tasks
+        WHERE creator_id = :user AND status_rank = :status{ready}
+          AND (priority_rank, deadline, id) {op} (:rank, :deadline, :id)
+        ORDER BY priority_rank {order}, deadline {order}, id {order} LIMIT :limit
+    )
+    UNION
+    SELECT * FROM (
+        SELECT id, priority_rank, deadline FROM tasks
+        WHERE assignee_id = :user AND status_rank = :status{ready}
+          AND (priority_rank, deadline, id) {op} (:rank, :deadline, :id)
+        ORDER BY priority_rank {order}, deadline {order}, id {order} LIMIT :limit
+    )
+) k
+JOIN tasks t ON t.id = k.id
+LEFT JOIN projects p ON t.project_id = p.id
+LEFT JOIN users u ON t.creator_id = u.id
+LEFT JOIN users a ON t.assignee_id = a.id
+ORDER BY k.priority_rank {order}, k.deadline {order}, k.id {order}
+LIMIT :limit
+'''
+_TASK_PAGE_FORWARD = _TASK_PAGE_SQL.format(op='>', order='ASC', ready='')
+_TASK_PAGE_BACKWARD = _TASK_PAGE_SQL.format(op='<', order='DESC', ready='')
+# Только задачи, которые можно делать: без активных блокирующих задач и подзадач
+_READY_PAGE_FORWARD = _TASK_PAGE_SQL.format(op='>', order='ASC', ready=' AND blockers = 0')
+_READY_PAGE_BACKWARD = _TASK_PAGE_SQL.format(op='<', order='DESC', ready=' AND blockers = 0')
+
+# Есть ли :target среди задач, которые ждут :start (транзитивно: ждущие задачи и родители).
+# Обход идет от ждущей стороны новой связи - обычно это новая задача в конце цепочки, и обход
+# короткий. Каждый шаг рекурсии - поиск по индексу, UNION не обходит узел дважды, а LIMIT 1
+# останавливает обход на первом совпадении
+_DEPENDENT_SQL = '''
+WITH RECURSIVE dependents(id) AS (
+    SELECT :start
+    UNION
+    SELECT d.task_id FROM task_dependencies d JOIN dependents p ON d.blocker_id = p.id
+    UNION
+    SELECT t.parent_id FROM tasks t JOIN dependents p ON t.id = p.id WHERE t.parent_id IS NOT NULL
+)
+SELECT 1 FROM dependents WHERE id = :target LIMIT 1
+'''
+
+# Прогресс по дереву подзадач: все потомки задачи по индексу idx_tasks_parent
+_SUBTASK_PROGRESS_SQL = '''
+WITH RECURSIVE subtasks(id) AS (
+    SELECT id FROM tasks WHERE parent_id = ?
+    UNION ALL
+    SELECT t.id FROM tasks t JOIN subtasks s ON t.parent_id = s.id
+)
+SELECT COUNT(*), COALESCE(SUM(t.status_rank = 1), 0) FROM subtasks s JOIN tasks t ON t.id = s.id
+'''
+
+# Активные задачи пользователя с дедлайном в [start, end): диапазон по индексам *_deadline
+_TASKS_BY_DEADLINE_SQL = '''
+SELECT t.id, t.name, t.description, p.name, t.priority, t.deadline, t.status,
+       u.username as creator, a.username as assignee, t.version
+FROM (
+    SELECT * FROM (
+        SELECT id, deadline FROM tasks
+        WHERE creator_id = :user AND status_rank = 0 AND deadline >= :start AND deadline < :end
+        ORDER BY deadline LIMIT :limit
+    )
+    UNION
+    SELECT * FROM (
+        SELECT id, deadline FROM tasks
+        WHERE assignee_id = :user AND status_rank = 0 AND deadline >= :start AND deadline < :end
+        ORDER BY deadline LIMIT :limit
+    )
+) k
+JOIN tasks t ON t.id = k.id
+LEFT JOIN projects p ON t.project_id = p.id
+LEFT JOIN users u ON t.creator_id = u.id
+LEFT JOIN users a ON t.assignee_id = a.id
+ORDER BY k.deadline, k.id
+LIMIT :limit
+'''
+
+
+# Ежедневные сводки: пачка пользователей, чья сводка наступила, и их активные задачи с дедлайном
+# раньше :until (созданные ими или назначенные им) одним запросом по индексам *_deadline.
+# В каждом разделе (просрочено / скоро) - не больше :per_section задач, ближайшие к текущему моменту,
+# и общее число задач раздела; пользователь без задач возвращается одной строкой с NULL
+_DIGEST_SQL = '''
+WITH due AS (
+    SELECT id, telegram_id, timezone, digest_hour FROM users
+    WHERE digest_next_at <= :now
+    ORDER BY digest_next_at, id
+    LIMIT :limit
+),
+owned AS (
+    SELECT d.id AS user_id, t.id AS task_id FROM due d
+    JOIN tasks t ON t.creator_id = d.id AND t.status_rank = 0 AND t.deadline < :until
+    UNION
+    SELECT d.id, t.id FROM due d
+    JOIN tasks t ON t.assignee_id = d.id AND t.status_rank = 0 AND t.deadline < :until
+),
+ranked AS (
+    SELECT o.user_id, t.deadline < :now AS overdue, t.id, t.name, t.priority, t.deadline, p.name AS project,
+           ROW_NUMBER() OVER (PARTITION BY o.user_id, t.deadline < :now ORDER BY ABS(t.deadline - :now), t.id) AS n,
+           COUNT(*) OVER (PARTITION BY o.user_id, t.deadline < :now) AS total
+    FROM owned o
+    JOIN tasks t ON t.id = o.task_id
+    LEFT JOIN projects p ON t.project_id = p.id
+)
+SELECT d.id, d.telegram_id, d.timezone, d.digest_hour,
+       r.overdue, r.total, r.id, r.name, r.priority, r.deadline, r.project
+FROM due d
+LEFT JOIN ranked r ON r.user_id = d.id AND r.n <= :per_section
+ORDER BY d.id, r.overdue DESC, r.n
+'''
+
+
+# Все задачи пользователя для экспорта в порядке id
+_TASK_EXPORT_SQL = '''
+SELECT t.id, t.name, t.description, p.name, t.priority, t.deadline, t.status,
+       u.username as creator, a.username as assignee
+FROM tasks t
+LEFT JOIN projects p ON t.project_id = p.id
+LEFT JOIN users u ON t.creator_id = u.id
+LEFT JOIN users a ON t.assignee_id = a.id
+WHERE t.id IN (
+    SELECT id FROM tasks WHERE creator_id = :user AND id > :last
+    UNION SELECT id FROM tasks WHERE assignee_id = :user AND id > :last
+)
+ORDER BY t.id
+LIMIT :batch
+'''
+
+
+# Кандидаты для /search: самые новые совпадения пользователя с названиями для ранжирования.
+# bm25 не используется: для частого слова он читает весь его список документов по всем пользователям
+_TASK_SEARCH_CANDIDATES_SQL = '''
+SELECT t.id, t.name FROM (
+    SELECT rowid FROM tasks_fts WHERE tasks_fts MATCH ? ORDER BY rowid DESC LIMIT ?
+) m
+JOIN tasks t ON t.id = m.rowid
+'''
+
+
+class UserCache:
+    """Ограниченный LRU-кэш пользователей: telegram_id -> (id, username, first_name, last_name, timezone)
+
+    Живет только в цикле событий, поэтому блокировки не нужны.
+    """
+
+    def __init__(self, maxsize: int = 10000) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[int, Tuple]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, telegram_id: int) -> Optional[Tuple]:
+        entry = self._entries.get(telegram_id)
+        if entry is not None:
+            self._entries.move_to_end(telegram_id)
+        return entry
+
+    def put(self, telegram_id: int, entry: Tuple) -> None:
+        self._entries[telegram_id] = entry
+        self._entries.move_to_end(telegram_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики попаданий и промахов кэша"""
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+class Database:
+    """Слой доступа к SQLite: одно долгоживущее соединение в выделенном потоке.
+
+    Все запросы выполняются последовательно в отдельном потоке, поэтому
+    медленная запись на диск не блокирует цикл событий aiogram.
+    """
+
+    def __init__(self, path: str = 'tasks.db', cached_statements: int = 256,
+                 user_cache_size: int = 10000, busy_timeout: int = 5000, busy_retries: int = 3,
+                 slow_query_ms: Optional[float] = None) -> None:
+        self.path = path
+        self.cached_statements = cached_statements
+        self.busy_timeout = busy_timeout
+        self.busy_retries = busy_retries
+        # Запросы дольше slow_query_ms миллисекунд попадают в журнал (None - не писать)
+        self.slow_query_ms = slow_query_ms
+        # Вызывается после каждого запроса в цикле событий: (имя метода, секунды, строк в результате)
+        self.query_observer: Optional[Callable[[str, float, int], None]] = None
+        self.users = UserCache(user_cache_size)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """Выполнение произвольной функции в потоке базы данных
+
+        Если базу дольше busy_timeout держит запись другого процесса, вызов
+        повторяется с паузой: незавершенная транзакция к этому моменту уже откачена.
+        """
+        loop = asyncio.get_running_loop()
+        call = functools.partial(func, *args, **kwargs)
+        for attempt in range(self.busy_retries + 1):
+            try:
+                result, elapsed = await loop.run_in_executor(self._executor, _timed_call, call)
+                self._observe(func, result, elapsed)
+                return result
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e) or attempt == self.busy_retries:
+                    raise
+                logger.warning(f"База данных занята другим процессом, повтор {attempt + 1}: {func.__name__}")
+                await asyncio.sleep(0.1 * 2 ** attempt)
+
+    def _observe(self, func: Callable, result: Any, elapsed: float) -> None:
+        # Время считается в потоке базы, без ожидания в очереди исполнителя;
+        # строки - длина списка или словаря в результате, иначе 0 или 1
+        name = getattr(func, '__name__', 'unknown')
+        rows = len(result) if isinstance(result, (list, dict)) else int(result is not None)
+        if self.query_observer is not None:
+            self.query_observer(name, elapsed, rows)
+        if self.slow_query_ms is not None and elapsed * 1000 >= self.slow_query_ms:
+            logger.warning(f"Медленный запрос {name}: {elapsed * 1000:.1f} мс, строк: {rows}")
+
+    @contextlib.contextmanager
+    def _transaction(self, mode: str = 'IMMEDIATE'):
+        """Явная транзакция на соединении (вызывается только из потока базы данных)
+
+        По умолчанию IMMEDIATE: блокировка записи берется сразу, и при работе
+        нескольких процессов транзакция ждет в busy_timeout, а не падает
+        с SQLITE_BUSY при попытке перейти от чтения к записи.
+        """
+        self._conn.execute(f'BEGIN {mode}')
+        try:
+            yield self._conn
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        self._conn.execute('COMMIT')
+
+    @db_call
+    def connect(self) -> None:
+        """Открытие соединения: WAL-журнал и кэш подготовленных выражений"""
+        if self._conn is not None:
+            return
+        conn = sqlite3.connect(
+            self.path,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout)}')
+        self._conn = conn
+
+    @db_call
+    def _close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def close(self) -> None:
+        """Закрытие соединения и остановка потока базы данных"""
+        await self._close()
+        self._executor.shutdown(wait=True)
+
+    @db_call
+    def init_db(self) -> None:
+        """Инициализация базы данных: применение миграций и создание проекта по умолчанию"""
+        version = self._migrate()
+
+        # Вставка тестового проекта, если его еще нет (в транзакции: процессов может быть несколько)
+        with self._transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COUNT(*) FROM projects')
+            if cursor.fetchone()[0] == 0:
+                cursor.execute('INSERT INTO projects (name, description) VALUES (?, ?)',
+                               ('Основной проект', 'Проект по умолчанию для всех задач'))
+
+        logger.info(f"База данных инициализирована, версия схемы: {version}")
+
+    def _migrate(self) -> int:
+        """Применение недостающих миграций, каждая в своей транзакции"""
+        conn = self._conn
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, applied_at TEXT NOT NULL)'
+        )
+        version = 0
+        for target, statements in MIGRATIONS:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Версию перечитываем внутри транзакции: миграцию мог применить другой процесс
+                version = conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+                if target <= version:
+                    conn.execute('COMMIT')
+                    continue
+                for statement in statements:
+                    # Шаг миграции - SQL-выражение или функция, получающая соединение
+                    if callable(statement):
+                        statement(conn)
+                    else:
+                        conn.execute(statement)
+                conn.execute(
+                    'INSERT INTO schema_version (version, applied_at) VALUES (?, ?)',
+                    (target, datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+                )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                logger.exception(f"Ошибка миграции схемы до версии {target}")
+                raise
+            version = target
+            logger.info(f"Применена миграция схемы: версия {target}")
+        return version
+
+    async def warm_user_cache(self) -> None:
+        """Прогрев кэша пользователей последними зарегистрированными пользователями"""
+        rows = await self._load_recent_users(self.users.maxsize)
+        for telegram_id, *entry in reversed(rows):
+            self.users.put(telegram_id, tuple(entry))
+        logger.info(f"Кэш пользователей прогрет: {len(self.users)} записей")
+
+    @db_call
+    def _load_recent_users(self, limit: int) -> List[Tuple]:
+        return self._conn.execute(
+            'SELECT telegram_id, id, username, first_name, last_name, timezone FROM users ORDER BY id DESC LIMIT ?',
+            (limit,)
+        ).fetchall()
+
+    async def register_user(self, user) -> int:
+        """Регистрация пользователя (объект aiogram User) в базе данных, если его еще нет"""
+        return (await self.register_user_profile(user))[0]
+
+    async def register_user_profile(self, user) -> Tuple[int, Optional[str]]:
+        """Регистрация пользователя и его настройки: (внутренний ID, часовой пояс)
+
+        Повторные обращения обслуживаются из кэша; смена имени пользователя
+        записывается в базу и в кэш.
+        """
+        profile = (user.username, user.first_name, user.last_name)
+        cached = self.users.get(user.id)
+        if cached is not None and cached[1:4] == profile:
+            self.users.hits += 1
+            return cached[0], cached[4]
+
+        self.users.misses += 1
+        user_db_id, timezone = await self._save_user(user.id, *profile)
+        self.users.put(user.id, (user_db_id, *profile, timezone))
+        return user_db_id, timezone
+
+    @db_call
+    def _save_user(self, telegram_id: int, username: Optional[str],
+                   first_name: Optional[str], last_name: Optional[str]) -> Tuple[int, Optional[str]]:
+        with self._transaction() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('SELECT id, username, first_name, last_name, timezone FROM users WHERE telegram_id = ?',
+                           (telegram_id,))
+            result = cursor.fetchone()
+
+            if not result:
+                cursor.execute(
+                    'INSERT INTO users (telegram_id, username, first_name, last_name) VALUES (?, ?, ?, ?)',
+                    (telegram_id, username, first_name, last_name)
+                )
+                user_db_id, timezone = cursor.lastrowid, None
+            elif result[1:4] != (username, first_name, last_name):
+                user_db_id, timezone = result[0], result[4]
+                cursor.execute(
+                    'UPDATE users SET username = ?, first_name = ?, last_name = ? WHERE id = ?',
+                    (username, first_name, last_name, user_db_id)
+                )
+                cursor.execute('DELETE FROM user_names WHERE user_id = ?', (user_db_id,))
+            else:
+                return result[0], result[4]
+
+            cursor.executemany(
+                'INSERT OR IGNORE INTO user_names (name, user_id) VALUES (?, ?)',
+                [(name, user_db_id) for name in user_search_names(username, first_name, last_name)]
+            )
+        return user_db_id, timezone
+
+    async def set_user_timezone(self, telegram_id: int, timezone: Optional[str]) -> None:
+        """Сохранение часового пояса пользователя (None - время сервера) в базе и в кэше"""
+        await self._save_user_timezone(telegram_id, timezone)
+        cached = self.users.get(telegram_id)
+        if cached is not None:
+            self.users.put(telegram_id, (*cached[:4], timezone))
+
+    @db_call
+    def _save_user_timezone(self, telegram_id: int, timezone: Optional[str]) -> None:
+        self._conn.execute('UPDATE users SET timezone = ? WHERE telegram_id = ?', (timezone, telegram_id))
+
+    @db_call
+    def add_task_to_db(self, task_data: Dict[str, Any]) -> int:
+        """Добавление новой задачи в базу данных"""
+        now = int(datetime.datetime.now().timestamp())
+        with self._transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+            INSERT INTO tasks (name, description, project_id, creator_id, assignee_id,
+                               priority, priority_rank, deadline, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                task_data['name'],
+                task_data['description'],
+                task_data['project_id'],
+                task_data['creator_id'],
+                task_data['assignee_id'],
+                task_data['priority'],
+                PRIORITIES.index(task_data['priority']),
+                task_data['deadline'],
+                now
+            ))
+            task_id = cursor.lastrowid
+
+            if task_data['assignee_id'] and task_data['assignee_id'] != task_data['creator_id']:
+                cursor.execute(
+                    'INSERT OR REPLACE INTO collaborators (user_id, collaborator_id, last_used) VALUES (?, ?, ?)',
+                    (task_data['creator_id'], task_data['assignee_id'], now)
+                )
+        return task_id
+
+    @db_call
+    def import_tasks(self, tasks: Iterable[Tuple], remind_before: int, now: int) -> List[Tuple[int, Optional[int]]]:
+        """Добавление пачки задач одной транзакцией
+
+        tasks - строки (name, description, project_id, creator_id, assignee_id, priority, deadline, status).
+        Полнотекстовый индекс, напоминания за remind_before секунд до дедлайна (если это еще
+        не прошло) и недавние исполнители записываются по одному запросу на пачку.
+        Возвращает [(task_id, remind_at или None)].
+        """
+        with self._transaction() as conn:
+            # Транзакция IMMEDIATE не дает писать другим соединениям, поэтому все задачи
+            # с id больше прежнего максимума - только что добавленные
+            last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM tasks').fetchone()[0]
+            # Строки индекса добавляются одним запросом после вставки, а не триггером на каждую
+            conn.execute('UPDATE bulk_load SET active = 1')
+            conn.executemany('''
+            INSERT INTO tasks (name, description, project_id, creator_id, assignee_id,
+                               priority, priority_rank, deadline, status, status_rank, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                (name, description, project_id, creator_id, assignee_id, priority, PRIORITIES.index(priority),
+                 deadline, status, STATUSES.index(status), now)
+                for name, description, project_id, creator_id, assignee_id, priority, deadline, status in tasks
+            ))
+            conn.execute(
+                f'INSERT INTO tasks_fts (rowid, name, description, owners) '
+                f'SELECT {_fts_values("tasks")} FROM tasks WHERE id > ?', (last_id,)
+            )
+            params = {'last_id': last_id, 'before': remind_before, 'now': now}
+            conn.execute('''
+            INSERT INTO project_counts (project_id, status_rank, priority_rank, tasks, overdue)
+            SELECT COALESCE(project_id, 0), status_rank, COALESCE(priority_rank, -1), COUNT(*),
+                   SUM(COALESCE(status_rank = 0 AND deadline < (SELECT until FROM overdue_mark), 0))
+            FROM tasks WHERE id > :last_id
+            GROUP BY 1, 2, 3
+            ON CONFLICT DO UPDATE SET tasks = tasks + excluded.tasks, overdue = overdue + excluded.overdue
+            ''', params)
+            conn.execute('''
+            INSERT INTO project_workload (project_id, assignee_id, active, completed, overdue)
+            SELECT COALESCE(project_id, 0), COALESCE(assignee_id, 0), SUM(status_rank = 0), SUM(status_rank = 1),
+                   SUM(COALESCE(status_rank = 0 AND deadline < (SELECT until FROM overdue_mark), 0))
+            FROM tasks WHERE id > :last_id
+            GROUP BY 1, 2
+            ON CONFLICT DO UPDATE SET active = active + excluded.active, completed = completed + excluded.completed,
+                                      overdue = overdue + excluded.overdue
+            ''', params)
+            conn.execute('UPDATE bulk_load SET active = 0')
+            conn.execute('DELETE FROM reminders WHERE task_id > :last_id', params)
+            conn.execute('''
+            INSERT INTO reminders (task_id, remind_at)
+            SELECT id, deadline - :before FROM tasks
+            WHERE id > :last_id AND status_rank = 0 AND deadline - :before > :now
+            ''', params)
+            conn.execute('''
+            INSERT OR REPLACE INTO collaborators (user_id, collaborator_id, last_used)
+            SELECT DISTINCT creator_id, assignee_id, :now FROM tasks
+            WHERE id > :last_id AND assignee_id != creator_id
+            ''', params)
+            return conn.execute('''
+            SELECT t.id, r.remind_at FROM tasks t LEFT JOIN reminders r ON r.task_id = t.id
+            WHERE t.id > ? ORDER BY t.id
+            ''', (last_id,)).fetchall()
+
+    @db_call
+    def get_projects(self) -> List[Tuple[int, str]]:
+        """Получение списка проектов из базы данных"""
+        return self._conn.execute('SELECT id, name FROM projects').fetchall()
+
+    @db_call
+    def get_project_stats(self, project_id: int, now: int, top: int = 10) -> Tuple[List[Tuple], List[Tuple]]:
+        """Счетчики проекта из project_counts и project_workload (без GROUP BY по tasks)
+
+        Сначала отметка просроченных сдвигается к now: досчитываются только активные задачи
+        с дедлайном между прошлой отметкой и now (диапазон индекса idx_tasks_status_deadline).
+        Возвращает ([(status_rank, priority_rank, tasks, overdue)],
+        [(assignee_id, username, first_name, last_name, active, overdue)] - top самых загруженных).
+        """
+        with self._transaction() as conn:
+            until = conn.execute('SELECT until FROM overdue_mark').fetchone()[0]
+            if now > until:
+                params = {'until': until, 'now': now}
+                conn.execute('''
+                INSERT INTO project_counts (project_id, status_rank, priority_rank, tasks, overdue)
+                SELECT COALESCE(project_id, 0), 0, COALESCE(priority_rank, -1), 0, COUNT(*) FROM tasks
+                WHERE status_rank = 0 AND deadline >= :until AND deadline < :now
+                GROUP BY 1, 3
+                ON CONFLICT DO UPDATE SET overdue = overdue + excluded.overdue
+                ''', params)
+                conn.execute('''
+                INSERT INTO project_workload (project_id, assignee_id, active, completed, overdue)
+                SELECT COALESCE(project_id, 0), COALESCE(assignee_id, 0), 0, 0, COUNT(*) FROM tasks
+                WHERE status_rank = 0 AND deadline >= :until AND deadline < :now
+                GROUP BY 1, 2
+                ON CONFLICT DO UPDATE SET overdue = overdue + excluded.overdue
+                ''', params)
+                conn.execute('UPDATE overdue_mark SET until = ?', (now,))
+
+            counts = conn.execute(
+                'SELECT status_rank, priority_rank, tasks, overdue FROM project_counts WHERE project_id = ? AND tasks > 0',
+                (project_id,)
+            ).fetchall()
+            workload = conn.execute('''
+            SELECT w.assignee_id, u.username, u.first_name, u.last_name, w.active, w.overdue
+            FROM project_workload w
+            LEFT JOIN users u ON u.id = w.assignee_id
+            WHERE w.project_id = ? AND w.active > 0
+            ORDER BY w.active DESC
+            LIMIT ?
+            ''', (project_id, top)).fetchall()
+        return counts, workload
+
+    @db_call
+    def search_users(self, prefix: str, limit: int, after: Optional[Tuple[str, int]] = None) -> List[Tuple]:
+        """Поиск пользователей по началу username, имени или фамилии
+
+        Диапазонный запрос по индексу user_names с keyset-пагинацией по (name, user_id);
+        after - ключ последней строки предыдущей страницы.
+        Возвращает [(id, username, first_name, last_name, name)]; для пустого префикса - пустой список.
+        """
+        prefix = prefix.lower()
+        if not prefix:
+            # Пустой префикс совпал бы со всеми именами, а верхнюю границу диапазона не построить
+            return []
+        # Верхняя граница диапазона: префикс с увеличенным последним символом
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        name, user_id = after or ('', 0)
+        return self._conn.execute('''
+        SELECT u.id, u.username, u.first_name, u.last_name, n.name
+        FROM user_names n
+        JOIN users u ON u.id = n.user_id
+        WHERE n.name >= ? AND n.name < ? AND (n.name, n.user_id) > (?, ?)
+        ORDER BY n.name, n.user_id
+        LIMIT ?
+        ''', (prefix, upper, name, user_id, limit)).fetchall()
+
+    @db_call
+    def find_users_by_username(self, usernames: Iterable[str]) -> Dict[str, int]:
+        """id пользователей по username в нижнем регистре (без @): {username: id}"""
+        usernames = list(usernames)
+        found = {}
+        # Не больше 500 параметров на запрос; поиск идет по индексу user_names
+        for start in range(0, len(usernames), 500):
+            chunk = usernames[start:start + 500]
+            rows = self._conn.execute(f'''
+            SELECT n.name, u.id, u.username FROM user_names n
+            JOIN users u ON u.id = n.user_id
+            WHERE n.name IN ({', '.join('?' * len(chunk))})
+            ''', chunk).fetchall()
+            for name, user_id, username in rows:
+                # В user_names есть и имена с фамилиями, нужен только username
+                if username and username.lower() == name:
+                    found[name] = user_id
+        return found
+
+    @db_call
+    def get_recent_collaborators(self, user_id: int, limit: int) -> List[Tuple]:
+        """Пользователи, которым user_id недавно назначал задачи: [(id, username, first_name, last_name)]"""
+        return self._conn.execute('''
+        SELECT u.id, u.username, u.first_name, u.last_name
+        FROM collaborators c
+        JOIN users u ON u.id = c.collaborator_id
+        WHERE c.user_id = ?
+        ORDER BY c.last_used DESC
+        LIMIT ?
+        ''', (user_id, limit)).fetchall()
+
+    @db_call
+    def get_user_chat(self, user_id: int) -> Optional[Tuple[int, Optional[str], Optional[int]]]:
+        """telegram_id, часовой пояс и час ежедневной сводки (None - выключена) пользователя по его внутреннему ID"""
+        return self._conn.execute(
+            'SELECT telegram_id, timezone, digest_hour FROM users WHERE id = ?', (user_id,)
+        ).fetchone()
+
+    @db_call
+    def get_user_digest_hour(self, user_id: int) -> Optional[int]:
+        """Час ежедневной сводки пользователя; None - сводка выключена"""
+        row = self._conn.execute('SELECT digest_hour FROM users WHERE id = ?', (user_id,)).fetchone()
+        return row[0] if row else None
+
+    @db_call
+    def set_user_digest(self, user_id: int, hour: Optional[int], next_at: Optional[int]) -> None:
+        """Включение ежедневной сводки в hour часов со следующим запуском next_at (None, None - выключение)"""
+        self._conn.execute('UPDATE users SET digest_hour = ?, digest_next_at = ? WHERE id = ?',
+                           (hour, next_at, user_id))
+
+    @db_call
+    def claim_digests(self, now: int, until: int, limit: int, per_section: int,
+                      next_run: Callable[[int, Optional[str]], int]) -> List[Tuple[int, Optional[str], List[Tuple]]]:
+        """Выборка пачки наступивших ежедневных сводок и перенос их на следующий день одной транзакцией
+
+        next_run(час, часовой пояс) - время следующей сводки в секундах UTC.
+        Возвращает [(telegram_id, timezone, tasks)] для каждого пользователя пачки, где
+        tasks - [(overdue, total, task_id, name, priority, deadline, project)], сначала просроченные.
+        """
+        with self._transaction('IMMEDIATE') as conn:
+            rows = conn.execute(_DIGEST_SQL, {
+                'now': now, 'until': until, 'limit': limit, 'per_section': per_section,
+            }).fetchall()
+            digests: Dict[int, Tuple[int, Optional[str], List[Tuple]]] = {}
+            next_times = []
+            for user_id, telegram_id, timezone, hour, *task in rows:
+                if user_id not in digests:
+                    digests[user_id] = (telegram_id, timezone, [])
+                    next_times.append((next_run(hour, timezone), user_id))
+                if task[2] is not None:
+                    digests[user_id][2].append(tuple(task))
+            conn.executemany('UPDATE users SET digest_next_at = ? WHERE id = ?', next_times)
+        return list(digests.values())
+
+    @db_call
+    def get_user_tasks(self, user_id: int, status: str = STATUS_ACTIVE, limit: Optional[int] = None,
+                       after: Optional[Tuple] = None, before: Optional[Tuple] = None,
+                       ready: bool = False) -> List[Tuple]:
+        """Задачи пользователя с заданным статусом, отсортированные по (priority_rank, deadline, id)
+
+        Фильтр по статусу выполняется в SQL по индексам создателя и исполнителя.
+        after/before - ключ последней/первой задачи соседней страницы (keyset-пагинация);
+        каждая ветка UNION читает не больше limit строк своего индекса.
+        ready - только задачи без активных блокирующих задач и подзадач (частичные индексы *_ready).
+        """
+        if before is not None:
+            sql, key = (_READY_PAGE_BACKWARD if ready else _TASK_PAGE_BACKWARD), before
+        else:
+            # Ключ раньше любой задачи: ранги не меньше -1 (см. priority_rank)
+            sql, key = (_READY_PAGE_FORWARD if ready else _TASK_PAGE_FORWARD), after or (-2, 0, 0)
+        rank, deadline, task_id = key
+        rows = self._conn.execute(sql, {
+            'user': user_id, 'status': STATUSES.index(status), 'rank': rank,
+            'deadline': deadline, 'id': task_id, 'limit': -1 if limit is None else limit,
+        }).fetchall()
+        if before is not None:
+            rows.reverse()
+        return rows
+
+    @db_call
+    def get_user_tasks_by_deadline(self, user_id: int, start: Optional[int], end: int, limit: int) -> List[Tuple]:
+        """Активные задачи пользователя с дедлайном в [start, end) в секундах UTC, по возрастанию дедлайна
+
+        start=None - без нижней границы (просроченные задачи).
+        """
+        return self._conn.execute(_TASKS_BY_DEADLINE_SQL, {
+            'user': user_id, 'start': -2 ** 63 if start is None else start, 'end': end, 'limit': limit,
+        }).fetchall()
+
+    @db_call
+    def search_tasks(self, user_id: int, text: str, limit: int, offset: int = 0,
+                     candidates: int = 500) -> List[Tuple]:
+        """Задачи пользователя (создатель или исполнитель), в названии или описании которых есть слова text
+
+        Слова ищутся по началу. Сначала идут задачи со всеми словами в названии, внутри групп -
+        новые раньше; рассматриваются только candidates самых новых совпадений.
+        """
+        terms = search_terms(text)
+        if not terms:
+            return []
+        found = self._conn.execute(_TASK_SEARCH_CANDIDATES_SQL, (fts_query(terms, user_id), candidates)).fetchall()
+        found.sort(key=lambda row: (not _name_has_terms(row[1], terms), -row[0]))
+        page = [task_id for task_id, _ in found[offset:offset + limit]]
+        if not page:
+            return []
+        rows = self._conn.execute(f'''
+        SELECT t.id, t.name, t.description, p.name, t.priority, t.deadline, t.status,
+               u.username as creator, a.username as assignee, t.version
+        FROM tasks t
+        LEFT JOIN projects p ON t.project_id = p.id
+        LEFT JOIN users u ON t.creator_id = u.id
+        LEFT JOIN users a ON t.assignee_id = a.id
+        WHERE t.id IN ({', '.join('?' * len(page))})
+        ''', page).fetchall()
+        position = {task_id: n for n, task_id in enumerate(page)}
+        return sorted(rows, key=lambda row: position[row[0]])
+
+    async def export_user_tasks(self, user_id: int, batch: int = 1000) -> AsyncIterator[List[Tuple]]:
+        """Все задачи пользователя (создатель или исполнитель) пачками по batch строк в порядке id
+
+        Каждая пачка - отдельный keyset-запрос после id последней строки: между пачками
+        в потоке базы не остается открытого курсора, и в памяти только текущая пачка.
+        Строки: (id, name, description, project, priority, deadline, status, creator, assignee).
+        """
+        last = 0
+        while True:
+            rows = await self._export_task_batch(user_id, last, batch)
+            if rows:
+                yield rows
+            if len(rows) < batch:
+                break
+            last = rows[-1][0]
+
+    @db_call
+    def _export_task_batch(self, user_id: int, last: int, batch: int) -> List[Tuple]:
+        return self._conn.execute(_TASK_EXPORT_SQL, {'user': user_id, 'last': last, 'batch': batch}).fetchall()
+
+    @db_call
+    def get_task_by_id(self, task_id: int) -> Optional[Tuple]:
+        """Получение задачи по её ID"""
+        return self._conn.execute('''
+        SELECT t.id, t.name, t.description, p.name, t.priority, t.deadline, t.status,
+               u.username as creator, a.username as assignee, t.creator_id, t.assignee_id
+        FROM tasks t
+        LEFT JOIN projects p ON t.project_id = p.id
+        LEFT JOIN users u ON t.creator_id = u.id
+        LEFT JOIN users a ON t.assignee_id = a.id
+        WHERE t.id = ?
+        ''', (task_id,)).fetchone()
+
+    # Сигнатура next_run в методах повторений: (правило, дедлайн, первый дедлайн, часовой пояс) -> дедлайн
+    def _materialize(self, conn: sqlite3.Connection, recurrence: Tuple, until: int, now: int, remind_before: int,
+                     next_run: Callable[[str, int, int, Optional[str]], int],
+                     at_least_one: bool = False) -> List[Tuple[int, int, Optional[int]]]:
+        # Повторения с дедлайном не позже until; пропущенные (дедлайн уже прошел) не создаются
+        recurrence_id, name, description, project_id, creator_id, assignee_id, priority, rule, timezone, anchor, \
+            deadline = recurrence
+        while deadline < now:
+            deadline = next_run(rule, deadline, anchor, timezone)
+        created = []
+        while deadline <= until or (at_least_one and not created):
+            task_id = conn.execute('''
+            INSERT INTO tasks (name, description, project_id, creator_id, assignee_id,
+                               priority, priority_rank, deadline, created_at, recurrence_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (name, description, project_id, creator_id, assignee_id, priority,
+                  priority_rank(priority), deadline, now, recurrence_id)
+            ).lastrowid
+            remind_at = deadline - remind_before
+            if remind_at > now:
+                conn.execute('INSERT OR REPLACE INTO reminders (task_id, remind_at) VALUES (?, ?)',
+                             (task_id, remind_at))
+            created.append((task_id, deadline, remind_at if remind_at > now else None))
+            deadline = next_run(rule, deadline, anchor, timezone)
+        conn.execute('UPDATE recurrences SET next_deadline = ? WHERE id = ?', (deadline, recurrence_id))
+        return created
+
+    @db_call
+    def set_recurrence(self, task_id: int, rule: str, timezone: Optional[str],
+                       next_run: Callable[[str, int, int, Optional[str]], int]) -> Tuple[int, int]:
+        """Повторение задачи по правилу rule: новый шаблон из задачи или смена правила существующего
+
+        Возвращает (id шаблона, дедлайн следующего повторения).
+        """
+        now = int(datetime.datetime.now().timestamp())
+        with self._transaction() as conn:
+            recurrence_id, deadline = conn.execute(
+                'SELECT recurrence_id, deadline FROM tasks WHERE id = ?', (task_id,)
+            ).fetchone()
+            if recurrence_id is None:
+                next_deadline = next_run(rule, deadline, deadline, timezone)
+                recurrence_id = conn.execute('''
+                INSERT INTO recurrences (name, description, project_id, creator_id, assignee_id, priority,
+                                         rule, timezone, anchor, next_deadline, created_at)
+                SELECT name, description, project_id, creator_id, assignee_id, priority, ?, ?, deadline, ?, ?
+                FROM tasks WHERE id = ?
+                ''', (rule, timezone, next_deadline, now, task_id)).lastrowid
+                conn.execute('UPDATE tasks SET recurrence_id = ? WHERE id = ?', (recurrence_id, task_id))
+            else:
+                # Новое правило отсчитывается от последнего уже созданного повторения
+                last, anchor = conn.execute('''
+                SELECT MAX(t.deadline), r.anchor FROM recurrences r JOIN tasks t ON t.recurrence_id = r.id
+                WHERE r.id = ?
+                ''', (recurrence_id,)).fetchone()
+                next_deadline = next_run(rule, last, anchor, timezone)
+                conn.execute('UPDATE recurrences SET rule = ?, timezone = ?, next_deadline = ? WHERE id = ?',
+                             (rule, timezone, next_deadline, recurrence_id))
+        return recurrence_id, next_deadline
+
+    @db_call
+    def stop_recurrence(self, task_id: int) -> bool:
+        """Отмена повторения задачи; уже созданные повторения остаются обычными задачами
+
+        Возвращает False, если задача не повторялась.
+        """
+        with self._transaction() as conn:
+            row = conn.execute('SELECT recurrence_id FROM tasks WHERE id = ?', (task_id,)).fetchone()
+            if not row or row[0] is None:
+                return False
+            conn.execute('UPDATE tasks SET recurrence_id = NULL WHERE recurrence_id = ?', (row[0],))
+            conn.execute('DELETE FROM recurrences WHERE id = ?', (row[0],))
+        return True
+
+    @db_call
+    def get_user_recurrences(self, user_id: int) -> List[Tuple]:
+        """Шаблоны повторяющихся задач пользователя: [(id, name, rule, next_deadline)]"""
+        return self._conn.execute('''
+        SELECT id, name, rule, next_deadline FROM recurrences
+        WHERE creator_id = ? OR assignee_id = ?
+        ORDER BY next_deadline
+        ''', (user_id, user_id)).fetchall()
+
+    @db_call
+    def materialize_recurrences(self, until: int, now: int, remind_before: int, limit: int,
+                                next_run: Callable[[str, int, int, Optional[str]], int]) -> Tuple[int, List[Tuple]]:
+        """Создание повторений с дедлайном не позже until для пачки шаблонов одной транзакцией
+
+        Напоминания новых задач записываются в той же транзакции.
+        Возвращает (число обработанных шаблонов, [(task_id, deadline, remind_at или None)]).
+        """
+        with self._transaction('IMMEDIATE') as conn:
+            recurrences = conn.execute('''
+            SELECT id, name, description, project_id, creator_id, assignee_id, priority, rule, timezone, anchor,
+                   next_deadline
+            FROM recurrences WHERE next_deadline <= ? ORDER BY next_deadline LIMIT ?
+            ''', (until, limit)).fetchall()
+            created = []
+            for recurrence in recurrences:
+                created += self._materialize(conn, recurrence, until, now, remind_before, next_run)
+        return len(recurrences), created
+
+    @db_call
+    def advance_recurrence(self, task_id: int, remind_before: int,
+                           next_run: Callable[[str, int, int, Optional[str]], int]) -> List[Tuple]:
+        """Следующее повторение после выполнения задачи task_id, если у ее шаблона не осталось активных задач
+
+        Возвращает [(task_id, deadline, remind_at или None)] - пустой список, если задача
+        не повторяется или следующее повторение уже создано.
+        """
+        now = int(datetime.datetime.now().timestamp())
+        with self._transaction('IMMEDIATE') as conn:
+            recurrence = conn.execute('''
+            SELECT r.id, r.name, r.description, r.project_id, r.creator_id, r.assignee_id, r.priority, r.rule,
+                   r.timezone, r.anchor, r.next_deadline
+            FROM tasks t JOIN recurrences r ON r.id = t.recurrence_id
+            WHERE t.id = ? AND NOT EXISTS (SELECT 1 FROM tasks WHERE recurrence_id = r.id AND status_rank = 0)
+            ''', (task_id,)).fetchone()
+            if recurrence is None:
+                return []
+            return self._materialize(conn, recurrence, now, now, remind_before, next_run, at_least_one=True)
+
+    @db_call
+    def complete_task(self, task_id: int) -> Optional[str]:
+        """Отметка активной задачи выполненной, если у нее нет активных блокирующих задач и подзадач
+
+        Проверки - сравнения счетчика tasks.blockers и статуса в том же UPDATE, поэтому
+        из двух одновременных отметок срабатывает одна. Возвращает прежний статус, прочитанный
+        в той же транзакции (для истории изменений), или None, если задача не изменилась.
+        """
+        with self._transaction() as conn:
+            row = conn.execute('SELECT status FROM tasks WHERE id = ?', (task_id,)).fetchone()
+            cursor = conn.execute(
+                'UPDATE tasks SET status = ?, status_rank = 1, version = version + 1 '
+                'WHERE id = ? AND blockers = 0 AND status_rank = 0',
+                (STATUS_COMPLETED, task_id)
+            )
+        return row[0] if cursor.rowcount == 1 else None
+
+    @db_call
+    def get_open_prerequisites(self, task_id: int, limit: int) -> List[Tuple[int, str, str]]:
+        """Активные задачи, которые мешают выполнить task_id: [(id, name, 'blocker' или 'subtask')]"""
+        return self._conn.execute('''
+        SELECT t.id, t.name, 'blocker' FROM task_dependencies d JOIN tasks t ON t.id = d.blocker_id
+        WHERE d.task_id = :id AND t.status_rank = 0
+        UNION ALL
+        SELECT id, name, 'subtask' FROM tasks WHERE parent_id = :id AND status_rank = 0
+        LIMIT :limit
+        ''', {'id': task_id, 'limit': limit}).fetchall()
+
+    def _creates_cycle(self, conn: sqlite3.Connection, before: int, after: int) -> bool:
+        # Связь «before выполняется раньше after» замкнет цикл, если before уже ждет after (или это одна задача)
+        return conn.execute(_DEPENDENT_SQL, {'start': after, 'target': before}).fetchone() is not None
+
+    @db_call
+    def add_dependency(self, task_id: int, blocker_id: int) -> bool:
+        """Задача task_id ждет выполнения blocker_id; False, если связь замкнет цикл"""
+        with self._transaction() as conn:
+            if self._creates_cycle(conn, blocker_id, task_id):
+                return False
+            conn.execute('INSERT OR IGNORE INTO task_dependencies (task_id, blocker_id) VALUES (?, ?)',
+                         (task_id, blocker_id))
+        return True
+
+    @db_call
+    def remove_dependency(self, task_id: int, blocker_id: int) -> bool:
+        """Удаление зависимости; False, если ее не было"""
+        cursor = self._conn.execute('DELETE FROM task_dependencies WHERE task_id = ? AND blocker_id = ?',
+                                    (task_id, blocker_id))
+        return cursor.rowcount == 1
+
+    @db_call
+    def set_parent(self, task_id: int, parent_id: Optional[int]) -> bool:
+        """Перенос задачи в подзадачи parent_id (None - сделать самостоятельной); False, если это замкнет цикл"""
+        with self._transaction() as conn:
+            if parent_id is not None and self._creates_cycle(conn, task_id, parent_id):
+                return False
+            conn.execute('UPDATE tasks SET parent_id = ? WHERE id = ?', (parent_id, task_id))
+        return True
+
+    @db_call
+    def get_subtask_progress(self, task_id: int) -> Tuple[int, int]:
+        """Подзадачи всех уровней: (всего, выполнено)"""
+        return self._conn.execute(_SUBTASK_PROGRESS_SQL, (task_id,)).fetchone()
+
+    @db_call
+    def update_task_field(self, task_id: int, field: str, value: Any) -> Any:
+        """Обновление поля задачи (deadline - секунды UTC); возвращает прежнее значение поля
+
+        Прежнее значение для истории изменений читается в той же транзакции.
+        """
+        if field not in UPDATABLE_FIELDS:
+            raise ValueError(f"Поле {field} нельзя изменить")
+        with self._transaction() as conn:
+            row = conn.execute(f'SELECT {field} FROM tasks WHERE id = ?', (task_id,)).fetchone()
+            if field == 'priority':
+                conn.execute(
+                    'UPDATE tasks SET priority = ?, priority_rank = ?, version = version + 1 WHERE id = ?',
+                    (value, PRIORITIES.index(value), task_id)
+                )
+            else:
+                conn.execute(f'UPDATE tasks SET {field} = ?, version = version + 1 WHERE id = ?', (value, task_id))
+        return row[0] if row else None
+
+    # События истории: (task_id, actor_id, kind, old_value, new_value, created_at)
+    @db_call
+    def add_task_events(self, events: List[Tuple], keep: int) -> None:
+        """Запись пачки событий истории одной транзакцией
+
+        У задач из пачки остаются только keep последних событий: лишние находятся
+        по индексу (task_id, id), по одному запросу на задачу.
+        """
+        with self._transaction() as conn:
+            conn.executemany(
+                'INSERT INTO task_events (task_id, actor_id, kind, old_value, new_value, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                events
+            )
+            conn.executemany('''
+            DELETE FROM task_events WHERE task_id = :task_id AND id < (
+                SELECT id FROM task_events WHERE task_id = :task_id ORDER BY id DESC LIMIT 1 OFFSET :offset
+            )
+            ''', [{'task_id': task_id, 'offset': keep - 1} for task_id in {event[0] for event in events}])
+
+    @db_call
+    def replay_task_events(self, events: List[Tuple]) -> int:
+        """Запись событий из файла, сохраненного при неудачной остановке; возвращает число добавленных
+
+        Уже записанные события пропускаются: файл могли записать в базу дважды
+        (процесс упал до его удаления) или одновременно в двух процессах.
+        """
+        with self._transaction() as conn:
+            return conn.executemany('''
+            INSERT INTO task_events (task_id, actor_id, kind, old_value, new_value, created_at)
+            SELECT ?1, ?2, ?3, ?4, ?5, ?6
+            WHERE NOT EXISTS (
+                SELECT 1 FROM task_events
+                WHERE task_id = ?1 AND actor_id IS ?2 AND kind = ?3 AND old_value IS ?4 AND new_value IS ?5
+                      AND created_at = ?6
+            )
+            ''', events).rowcount
+
+    @db_call
+    def get_task_events(self, task_id: int, limit: int) -> List[Tuple]:
+        """Последние события истории задачи, новые первыми: [(kind, old_value, new_value, created_at, автор)]"""
+        return self._conn.execute('''
+        SELECT e.kind, e.old_value, e.new_value, e.created_at, COALESCE(u.username, u.first_name)
+        FROM task_events e
+        LEFT JOIN users u ON u.id = e.actor_id
+        WHERE e.task_id = ?
+        ORDER BY e.id DESC
+        LIMIT ?
+        ''', (task_id, limit)).fetchall()
+
+    @db_call
+    def compact_task_events(self, before: int, limit: int) -> int:
+        """Удаление не больше limit событий истории старше before; возвращает число удаленных"""
+        return self._conn.execute('''
+        DELETE FROM task_events WHERE id IN (
+            SELECT id FROM task_events WHERE created_at < ? ORDER BY created_at LIMIT ?
+        )
+        ''', (before, limit)).rowcount
+
+    @db_call
+    def set_reminder(self, task_id: int, remind_at: int) -> None:
+        """Сохранение (или перенос) напоминания о задаче; remind_at - секунды UTC"""
+        self._conn.execute(
+            'INSERT OR REPLACE INTO reminders (task_id, remind_at, sent_at) VALUES (?, ?, NULL)',
+            (task_id, remind_at)
+        )
+
+    @db_call
+    def delete_reminder(self, task_id: int) -> None:
+        """Удаление напоминания о задаче"""
+        self._conn.execute('DELETE FROM reminders WHERE task_id = ?', (task_id,))
+
+    @db_call
+    def get_pending_reminders(self, until: int) -> List[Tuple[int, int]]:
+        """Неотправленные напоминания со временем не позже until: [(task_id, remind_at)]"""
+        return self._conn.execute(
+            'SELECT task_id, remind_at FROM reminders WHERE sent_at IS NULL AND remind_at <= ? ORDER BY remind_at',
+            (until,)
+        ).fetchall()
+
+    @db_call
+    def claim_reminder(self, task_id: int, sent_at: int) -> bool:
+        """Отметка напоминания как отправленного; False, если его уже обработали раньше"""
+        cursor = self._conn.execute(
+            'UPDATE reminders SET sent_at = ? WHERE task_id = ? AND sent_at IS NULL',
+            (sent_at, task_id)
+        )
+        return cursor.rowcount == 1
+
+    @db_call
+    def skip_reminders(self, task_ids: List[int], sent_at: int) -> None:
+        """Отметка пропущенных напоминаний как обработанных без отправки"""
+        with self._transaction() as conn:
+            conn.executemany(
+                'UPDATE reminders SET sent_at = ? WHERE task_id = ? AND sent_at IS NULL',
+                [(sent_at, task_id) for task_id in task_ids]
+            )
+
+    @db_call
+    def claim_due_reminders(self, now: int, limit: int) -> List[Tuple]:
+        """Выборка и отметка пачки наступивших напоминаний одной транзакцией
+
+        Возвращает [(task_id, remind_at, name, priority, deadline, project, status,
+        assignee_telegram_id, assignee_timezone, assignee_digest_hour)].
+        """
+        with self._transaction('IMMEDIATE') as conn:
+            rows = conn.execute('''
+            SELECT r.task_id, r.remind_at, t.name, t.priority, t.deadline, p.name, t.status,
+                   a.telegram_id, a.timezone, a.digest_hour
+            FROM reminders r
+            JOIN tasks t ON t.id = r.task_id
+            LEFT JOIN projects p ON t.project_id = p.id
+            LEFT JOIN users a ON t.assignee_id = a.id
+            WHERE r.sent_at IS NULL AND r.remind_at <= ?
+            ORDER BY r.remind_at
+            LIMIT ?
+            ''', (now, limit)).fetchall()
+            conn.executemany(
+                'UPDATE reminders SET sent_at = ? WHERE task_id = ?',
+                [(now, row[0]) for row in rows]
+            )
+        return rows
+
+    @db_call
+    def load_fsm_state(self, key: str, not_before: int) -> Optional[Tuple[Optional[str], str, int]]:
+        """Состояние диалога FSM, менявшееся не раньше not_before: (state, data_json, updated_at)"""
+        return self._conn.execute(
+            'SELECT state, data, updated_at FROM fsm_states WHERE key = ? AND updated_at >= ?',
+            (key, not_before)
+        ).fetchone()
+
+    @db_call
+    def save_fsm_states(self, upserts: List[Tuple[str, Optional[str], str, int]], deletes: List[str]) -> None:
+        """Запись пачки изменений состояний FSM одной транзакцией"""
+        with self._transaction() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)',
+                upserts
+            )
+            conn.executemany('DELETE FROM fsm_states WHERE key = ?', [(key,) for key in deletes])
+
+    @db_call
+    def count_fsm_states(self, not_before: int) -> Dict[str, int]:
+        """Число диалогов в каждом состоянии FSM, менявшихся не раньше not_before"""
+        return dict(self._conn.execute(
+            'SELECT state, COUNT(*) FROM fsm_states WHERE state IS NOT NULL AND updated_at >= ? GROUP BY state',
+            (not_before,)
+        ).fetchall())
+
+    @db_call
+    def expire_fsm_states(self, before: int) -> int:
+        """Удаление состояний FSM, не менявшихся с момента before; возвращает число удаленных"""
+        return self._conn.execute('DELETE FROM fsm_states WHERE updated_at < ?', (before,)).rowcount
+
+    @db_call
+    def acquire_lease(self, name: str, owner: str, now: int, ttl: int) -> bool:
+        """Захват или продление аренды роли name до now + ttl
+
+        Возвращает True, если аренда принадлежит owner: она свободна, истекла
+        или уже была его.
+        """
+        with self._transaction() as conn:
+            conn.execute('INSERT OR IGNORE INTO leases (name, owner, expires_at) VALUES (?, ?, 0)', (name, owner))
+            cursor = conn.execute(
+                'UPDATE leases SET owner = ?, expires_at = ? WHERE name = ? AND (owner = ? OR expires_at < ?)',
+                (owner, now + ttl, name, owner, now)
+            )
+        return cursor.rowcount == 1
+
+    @db_call
+    def release_lease(self, name: str, owner: str) -> None:
+        """Досрочное освобождение аренды, чтобы ее сразу мог взять другой процесс"""
+        self._conn.execute('UPDATE leases SET expires_at = 0 WHERE name = ? AND owner = ?', (name, owner))
@@ -0,0 +1,149 @@
+import asyncio
+import glob
+import json
+import logging
+import os
+import time
+from typing import Any, List, Optional, Tuple
+
+from db import Database
+
+logger = logging.getLogger(__name__)
+
+
+class TaskHistory:
+    """История изменений задач (таблица task_events) с отложенной записью
+
+    События копятся в памяти и записываются одной транзакцией раз в flush_interval
+    секунд или сразу, как только их наберется batch_size, поэтому запись в историю
+    не добавляет коммит к каждому изменению задачи. У каждой задачи хранится не
+    больше keep последних событий.
+
+    Если при остановке записать события в базу не удалось, они сохраняются в файл
+    spill_prefix-<pid>.jsonl и записываются в базу при следующем запуске.
+    """
+
+    def __init__(self, db: Database, flush_interval: float = 2.0, batch_size: int = 500, keep: int = 100,
+                 spill_prefix: Optional[str] = None) -> None:
+        self.db = db
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.keep = keep
+        self.spill_prefix = spill_prefix
+        self._pending: List[Tuple] = []
+        # Событие и блокировка создаются внутри работающего цикла событий
+        self._full: Optional[asyncio.Event] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def record(self, task_id: int, actor_id: Optional[int], kind: str,
+               old_value: Any = None, new_value: Any = None) -> None:
+        """Событие истории задачи: kind - 'created', 'status' или имя измененного поля"""
+        self._pending.append((task_id, actor_id, kind, old_value, new_value, int(time.time())))
+        if len(self._pending) >= self.batch_size and self._full is not None:
+            self._full.set()
+
+    async def start(self) -> None:
+        """Запись событий, оставшихся от неудачной остановки, и запуск фоновой записи"""
+        await self.replay_spilled()
+        self._full = asyncio.Event()
+        self._closing = False
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self) -> None:
+        while True:
+            # По заполнению пишутся только полные пачки, остаток - по таймеру
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                full_only = True
+            except asyncio.TimeoutError:
+                full_only = False
+            if self._closing:
+                return
+            self._full.clear()
+            try:
+                await self.flush(full_only)
+            except Exception:
+                logger.exception("Ошибка записи истории изменений задач")
+
+    async def flush(self, full_only: bool = False) -> None:
+        """Запись накопленных событий пачками по batch_size, каждая - одной транзакцией"""
+        # Сбросы идут по одному, чтобы события попадали в базу в порядке записи
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while len(self._pending) >= (self.batch_size if full_only else 1):
+                batch = self._pending[:self.batch_size]
+                await self.db.add_task_events(batch, self.keep)
+                # Пока шла запись, могли добавиться новые события - они остаются в очереди
+                del self._pending[:len(batch)]
+
+    async def events(self, task_id: int, limit: int) -> List[Tuple]:
+        """События истории задачи, новые первыми (с еще не записанными в базу)"""
+        await self.flush()
+        return await self.db.get_task_events(task_id, limit)
+
+    async def compact(self, before: int, batch: int = 1000) -> int:
+        """Удаление событий старше before пачками по batch; возвращает число удаленных"""
+        total = 0
+        while True:
+            deleted = await self.db.compact_task_events(before, batch)
+            total += deleted
+            if deleted < batch:
+                return total
+
+    async def close(self) -> None:
+        """Остановка фоновой записи и запись последних событий
+
+        Если база недоступна, события сохраняются в файл, чтобы не потерять их при выходе.
+        """
+        if self._flush_task is not None:
+            # Фоновую запись не отменяем, а дожидаемся: отмена посреди записи пачки
+            # оставила бы уже записанные события в очереди, и они попали бы в базу дважды
+            self._closing = True
+            self._full.set()
+            await self._flush_task
+            self._flush_task = None
+        try:
+            await self.flush()
+        except Exception:
+            if not self.spill_prefix:
+                logger.exception(f"Не записаны события истории: {len(self._pending)}")
+                raise
+            path = self._spill()
+            logger.exception(f"События истории ({len(self._pending)}) сохранены в {path}")
+            self._pending.clear()
+
+    def _spill(self) -> str:
+        # Файл появляется под итоговым именем только целиком: запись во временный и переименование
+        path = f"{self.spill_prefix}-{os.getpid()}.jsonl"
+        with open(path + '.tmp', 'w', encoding='utf-8') as file:
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as previous:
+                    file.write(previous.read())
+            for event in self._pending:
+                file.write(json.dumps(event, ensure_ascii=False) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + '.tmp', path)
+        return path
+
+    async def replay_spilled(self) -> None:
+        """Запись в базу событий из файлов, сохраненных при неудачной остановке"""
+        if not self.spill_prefix:
+            return
+        for path in sorted(glob.glob(f"{glob.escape(self.spill_prefix)}-*.jsonl")):
+            with open(path, encoding='utf-8') as file:
+                events = [tuple(json.loads(line)) for line in file if line.strip()]
+            added = await self.db.replay_task_events(events)
+            # Файл удаляется только после коммита: если процесс упадет раньше,
+            # повторная запись пропустит уже добавленные события
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            logger.info(f"Из {path} записано событий истории: {added} из {len(events)}")
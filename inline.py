@@ -0,0 +1,109 @@
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from db import search_terms
+
+
+def normalize_query(text: str) -> str:
+    """Текст inline-запроса как ключ кэша: нижний регистр, ё -> е, одиночные пробелы"""
+    return ' '.join(text.lower().replace('ё', 'е').split())
+
+
+def task_has_terms(task: Tuple, terms: List[str]) -> bool:
+    """Есть ли в ID, названии или описании задачи (строка get_user_tasks) слова, начинающиеся с terms"""
+    task_id, name, description = task[:3]
+    tokens = [str(task_id)] + re.findall(r'\w+', f"{name} {description or ''}".lower().replace('ё', 'е'))
+    return all(any(token.startswith(term) for token in tokens) for term in terms)
+
+
+class InlineQueryCache:
+    """Результаты inline-запросов пользователей с коротким TTL
+
+    Telegram присылает запрос на каждую набранную букву. У пользователя хранятся
+    последние max_queries запросов: (время, строки задач, полный ли это список).
+    Запрос, который продолжает закэшированный полный запрос (например, «отч» после
+    «от» или любой после пустого), фильтруется в памяти без обращения к базе.
+    """
+
+    def __init__(self, ttl: float = 15, max_users: int = 10000, max_queries: int = 8) -> None:
+        self.ttl = ttl
+        self.max_users = max_users
+        self.max_queries = max_queries
+        self.hits = 0
+        self.prefix_hits = 0
+        self.misses = 0
+        # user_id -> {запрос: (время, строки, полный список)}, пользователи в порядке последнего запроса
+        self._users: 'OrderedDict[int, Dict[str, Tuple[float, List[Tuple], bool]]]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def stats(self) -> Dict[str, int]:
+        """Число пользователей в кэше и счетчики попаданий, фильтраций по префиксу и промахов"""
+        return {'users': len(self._users), 'hits': self.hits, 'prefix_hits': self.prefix_hits,
+                'misses': self.misses}
+
+    def invalidate(self, user_id: int) -> None:
+        """Удаление результатов пользователя (например, после изменения его задач)"""
+        self._users.pop(user_id, None)
+
+    def has(self, user_id: int, query: str) -> bool:
+        """Есть ли в кэше еще не истекший результат именно этого запроса"""
+        entry = self._users.get(user_id, {}).get(query)
+        return entry is not None and entry[0] >= time.monotonic() - self.ttl
+
+    def get(self, user_id: int, query: str) -> Optional[List[Tuple]]:
+        """Строки задач по запросу из кэша; None, если нужен запрос к базе"""
+        queries = self._users.get(user_id)
+        if queries is None:
+            self.misses += 1
+            return None
+        self._users.move_to_end(user_id)
+        expired = time.monotonic() - self.ttl
+        for cached in [cached for cached, (stored_at, _, _) in queries.items() if stored_at < expired]:
+            del queries[cached]
+
+        entry = queries.get(query)
+        if entry is not None:
+            self.hits += 1
+            return entry[1]
+        # Самый длинный полный запрос, который продолжает текущий
+        prefixes = [cached for cached, (_, _, complete) in queries.items() if complete and query.startswith(cached)]
+        if not prefixes:
+            self.misses += 1
+            return None
+        stored_at, rows, _ = queries[max(prefixes, key=len)]
+        terms = search_terms(query)
+        rows = [row for row in rows if task_has_terms(row, terms)]
+        # Отфильтрованный список живет столько же, сколько исходный
+        self._put(queries, query, (stored_at, rows, True))
+        self.prefix_hits += 1
+        return rows
+
+    def put(self, user_id: int, query: str, rows: List[Tuple], complete: bool) -> None:
+        """Сохранение результатов; complete - в rows все задачи пользователя, подходящие под запрос"""
+        queries = self._users.get(user_id)
+        if queries is None:
+            queries = self._users[user_id] = {}
+        self._users.move_to_end(user_id)
+        self._put(queries, query, (time.monotonic(), rows, complete))
+        # В начале - давно не писавшие пользователи: их записи истекли или лишние
+        expired = time.monotonic() - self.ttl
+        while self._users and (len(self._users) > self.max_users or self._oldest_expired(expired)):
+            self._users.popitem(last=False)
+
+    def _put(self, queries: Dict, query: str, entry: Tuple) -> None:
+        queries.pop(query, None)
+        queries[query] = entry
+        # Вытесняются самые старые запросы, кроме самого короткого полного: из него
+        # фильтруются и новые буквы, и запросы после стирания
+        while len(queries) > self.max_queries:
+            complete = [cached for cached, (_, _, is_complete) in queries.items() if is_complete]
+            keep = min(complete, key=len) if complete else None
+            del queries[next(cached for cached in queries if cached != keep)]
+
+    def _oldest_expired(self, expired: float) -> bool:
+        queries = next(iter(self._users.values()))
+        return all(stored_at < expired for stored_at, _, _ in queries.values())
@@ -0,0 +1,124 @@
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import F
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from db import PRIORITIES, UPDATABLE_FIELDS
+
+
+# Данные кнопок: короткий префикс и поля через ':' (Telegram ограничивает callback_data 64 байтами).
+# Фильтры CallbackData.filter() - асинхронные: aiogram проверяет их в цикле событий,
+# а обычные функции-фильтры (lambda, F) выполняет в пуле потоков
+class ProjectCallback(CallbackData, prefix='p'):
+    project_id: int
+
+
+class PriorityCallback(CallbackData, prefix='r'):
+    # Позиция в PRIORITIES
+    rank: int
+
+
+class AssigneeCallback(CallbackData, prefix='a'):
+    # 0 - задача назначается создателю
+    user_id: int
+
+
+class AssigneeMoreCallback(CallbackData, prefix='am'):
+    pass
+
+
+class FieldCallback(CallbackData, prefix='f'):
+    field: str
+
+
+class TaskPageCallback(CallbackData, prefix='t'):
+    # Статус (позиция в STATUSES), направление ('n' - вперед, 'p' - назад), ключ крайней задачи страницы
+    # и ready - список только тех задач, которые можно делать (/list_tasks ready)
+    status: int
+    direction: str
+    rank: int
+    deadline: Optional[int]
+    task_id: int
+    ready: bool = False
+
+
+class CompletedCallback(CallbackData, prefix='c'):
+    pass
+
+
+class SearchPageCallback(CallbackData, prefix='s'):
+    offset: int
+
+
+class ProjectStatsCallback(CallbackData, prefix='ps'):
+    project_id: int
+
+
+# Фильтры с проверкой значений: кнопку с чужими данными обработчик не получит
+PRIORITY_FILTER = PriorityCallback.filter(F.rank.in_(range(len(PRIORITIES))))
+FIELD_FILTER = FieldCallback.filter(F.field.in_(UPDATABLE_FIELDS))
+
+
+def _keyboard(buttons: List[Tuple[str, CallbackData]]) -> InlineKeyboardMarkup:
+    """Клавиатура по одной кнопке в ряд"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=text, callback_data=data.pack())] for text, data in buttons
+    ])
+
+
+# Неизменные клавиатуры собираются один раз при импорте
+PRIORITY_KEYBOARD = _keyboard([
+    (priority, PriorityCallback(rank=PRIORITIES.index(priority))) for priority in ("Низкий", "Средний", "Высокий")
+])
+
+# Кнопки, которые добавляются к меняющимся клавиатурам
+SELF_BUTTON = InlineKeyboardButton(text="Я сам", callback_data=AssigneeCallback(user_id=0).pack())
+MORE_USERS_BUTTON = InlineKeyboardButton(text="Еще ▶️", callback_data=AssigneeMoreCallback().pack())
+COMPLETED_BUTTON = InlineKeyboardButton(text="Показать завершенные задачи", callback_data=CompletedCallback().pack())
+
+UPDATE_FIELDS = (
+    ("name", "Название"),
+    ("description", "Описание"),
+    ("priority", "Приоритет"),
+    ("deadline", "Дедлайн"),
+)
+FIELD_KEYBOARD = _keyboard([(name, FieldCallback(field=field)) for field, name in UPDATE_FIELDS])
+
+
+class ProjectKeyboards:
+    """Список проектов и клавиатуры выбора проекта, собранные один раз на список
+
+    Бот сам проекты не создает (кроме проекта по умолчанию при первом запуске), их
+    добавляют прямо в базу, поэтому кэш просто перечитывается через ttl секунд.
+    """
+
+    def __init__(self, load: Callable[[], Awaitable[List[Tuple[int, str]]]], ttl: float = 60) -> None:
+        self.load = load
+        self.ttl = ttl
+        self._projects: Optional[List[Tuple[int, str]]] = None
+        self._loaded_at = 0.0
+        self._keyboards: Dict[type, InlineKeyboardMarkup] = {}
+
+    async def projects(self) -> List[Tuple[int, str]]:
+        """Проекты [(id, название)]"""
+        if self._projects is None or time.monotonic() - self._loaded_at > self.ttl:
+            self._keyboards.clear()
+            self._projects = await self.load()
+            self._loaded_at = time.monotonic()
+        return self._projects
+
+    async def name(self, project_id: int) -> Optional[str]:
+        """Название проекта; None, если проекта нет"""
+        return dict(await self.projects()).get(project_id)
+
+    async def keyboard(self, callback: type = ProjectCallback) -> InlineKeyboardMarkup:
+        """Клавиатура проектов с данными кнопок callback(project_id=...)"""
+        projects = await self.projects()
+        keyboard = self._keyboards.get(callback)
+        if keyboard is None:
+            keyboard = self._keyboards[callback] = _keyboard([
+                (project_name, callback(project_id=project_id)) for project_id, project_name in projects
+            ])
+        return keyboard
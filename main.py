@@ -1,21 +1,114 @@
 import logging
-import sqlite3
 import datetime
 import asyncio
+import csv
+import functools
+import json
+import multiprocessing
+import os
+import socket
+import tempfile
+from collections import Counter
 from typing import Dict, Any, Optional, List, Tuple
 
+import aiohttp
+from aiohttp import web
+
 from aiogram import Bot, Dispatcher, F
-from aiogram.types import Message, CallbackQuery
-from aiogram.filters import Command, CommandStart
+from aiogram.types import Message, CallbackQuery, FSInputFile, InlineQuery
+from aiogram.filters import Command, CommandObject, CommandStart, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import InlineQueryResultArticle, InputTextMessageContent
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.date import DateTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+
+import config  # Создайте файл config.py с вашим токеном
+from keyboards import (
+    COMPLETED_BUTTON, FIELD_FILTER, FIELD_KEYBOARD, MORE_USERS_BUTTON, PRIORITY_FILTER, PRIORITY_KEYBOARD,
+    SELF_BUTTON, AssigneeCallback, AssigneeMoreCallback, CompletedCallback, FieldCallback, PriorityCallback,
+    ProjectCallback, ProjectKeyboards, ProjectStatsCallback, SearchPageCallback, TaskPageCallback,
+)
+from history import TaskHistory
+from inline import InlineQueryCache, normalize_query
+from metrics import HandlerMetricsMiddleware, MetricsRegistry, UpdateMetricsMiddleware, start_metrics_server
+from sender import OutboundQueue
+from storage import SQLiteStorage
+from render import (
+    PRIORITY_EMOJI, TaskCards, format_deadline, format_digest, format_history, format_project_stats, get_timezone,
+    next_digest_at, parse_deadline,
+)
+from recurrence import RULE_HELP, describe_rule, next_deadline, parse_rule
+from transfer import TaskExport, TaskImport, detect_format, read_batches
+from db import Database, PRIORITIES, STATUSES, STATUS_ACTIVE, STATUS_COMPLETED, priority_rank, search_terms
 
-from config import BOT_TOKEN  # Создайте файл config.py с вашим токеном
+BOT_TOKEN = config.BOT_TOKEN
+DB_PATH = getattr(config, 'DB_PATH', 'tasks.db')
+TASKS_PAGE_SIZE = getattr(config, 'TASKS_PAGE_SIZE', 10)
+ASSIGNEE_PAGE_SIZE = 8
+RECENT_COLLABORATORS = 5
+REMINDER_BEFORE = datetime.timedelta(hours=24)  # Напоминание за 24 часа
+REMINDER_WINDOW = datetime.timedelta(minutes=getattr(config, 'REMINDER_WINDOW_MINUTES', 60))
+# 'jobs' - отдельное задание планировщика на каждое напоминание окна,
+# 'sweeper' - одно периодическое задание, рассылающее наступившие напоминания пачкой
+REMINDER_MODE = getattr(config, 'REMINDER_MODE', 'jobs')
+REMINDER_SWEEP_INTERVAL = getattr(config, 'REMINDER_SWEEP_SECONDS', 60)
+REMINDER_SWEEP_BATCH = 500
+# Ежедневные сводки (/digest) рассылает ведущий по напоминаниям: раз в DIGEST_CHECK_SECONDS
+# выбираются пачкой пользователи, у которых наступил выбранный час
+DIGEST_CHECK_INTERVAL = getattr(config, 'DIGEST_CHECK_SECONDS', 60)
+DIGEST_BATCH = 500
+DIGEST_SECTION_SIZE = 10
+# Повторения повторяющихся задач создаются заранее только на RECURRENCE_HORIZON вперед
+# (горизонт должен быть больше REMINDER_BEFORE, чтобы успеть напомнить о повторении)
+RECURRENCE_HORIZON = datetime.timedelta(days=getattr(config, 'RECURRENCE_HORIZON_DAYS', 2))
+RECURRENCE_BATCH = 500
+# История изменений задач (/history): события пишутся в базу пачками раз в HISTORY_FLUSH_INTERVAL секунд,
+# у задачи хранится не больше HISTORY_MAX_EVENTS последних событий, события старше HISTORY_RETENTION удаляются
+HISTORY_FLUSH_INTERVAL = getattr(config, 'HISTORY_FLUSH_SECONDS', 2)
+HISTORY_MAX_EVENTS = getattr(config, 'HISTORY_MAX_EVENTS_PER_TASK', 100)
+HISTORY_RETENTION = datetime.timedelta(days=getattr(config, 'HISTORY_RETENTION_DAYS', 365))
+HISTORY_COMPACT_INTERVAL = datetime.timedelta(hours=1)
+HISTORY_PAGE_SIZE = 20
+# Inline-режим (@бот текст): результаты запросов пользователя живут в кэше бота INLINE_CACHE_TTL секунд,
+# Telegram кэширует ответ у себя INLINE_CACHE_TIME секунд. Если активных задач у пользователя не больше
+# INLINE_CANDIDATES, они загружаются одним запросом и дальше фильтруются в памяти
+INLINE_CACHE_TTL = getattr(config, 'INLINE_CACHE_SECONDS', 15)
+INLINE_CACHE_TIME = 5
+INLINE_CANDIDATES = 200
+INLINE_PAGE_SIZE = 20
+INLINE_RESULT_CACHE_SIZE = 10000
+# 'polling' - для разработки, 'webhook' - aiohttp-сервер принимает обновления от Telegram
+RUN_MODE = getattr(config, 'RUN_MODE', 'polling')
+WEBHOOK_URL = getattr(config, 'WEBHOOK_URL', '')
+WEBHOOK_PATH = getattr(config, 'WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = getattr(config, 'WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = getattr(config, 'WEBHOOK_PORT', 8080)
+WEBHOOK_SECRET = getattr(config, 'WEBHOOK_SECRET', '')
+WEBHOOK_MAX_CONCURRENCY = getattr(config, 'WEBHOOK_MAX_CONCURRENCY', 64)
+# При WEBHOOK_WORKERS > 1 основной процесс только принимает обновления и распределяет их
+# по id чата между процессами-воркерами, которые слушают 127.0.0.1:WEBHOOK_WORKER_PORT + n
+WEBHOOK_WORKERS = getattr(config, 'WEBHOOK_WORKERS', 1)
+WEBHOOK_WORKER_PORT = getattr(config, 'WEBHOOK_WORKER_PORT', 8081)
+# Задания планировщика есть только у ведущего воркера, и напоминание, созданное или перенесенное
+# в другом воркере, он увидел бы только при следующей загрузке окна. Поэтому с несколькими
+# воркерами напоминания всегда рассылает sweeper: он каждый проход читает общую базу
+if RUN_MODE == 'webhook' and WEBHOOK_WORKERS > 1:
+    REMINDER_MODE = 'sweeper'
+# Напоминания рассылает один процесс - владелец аренды в таблице leases
+REMINDER_LEASE_SECONDS = getattr(config, 'REMINDER_LEASE_SECONDS', 30)
+# Импорт задач из файла: строк в одной транзакции; больше 20 МБ бот скачать не может
+IMPORT_BATCH_SIZE = getattr(config, 'IMPORT_BATCH_SIZE', 1000)
+IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024
+# Метрики в формате Prometheus на http://METRICS_HOST:METRICS_PORT/metrics (0 - сервер метрик выключен);
+# процессы-воркеры слушают METRICS_PORT + 1, METRICS_PORT + 2, ...
+METRICS_HOST = getattr(config, 'METRICS_HOST', '127.0.0.1')
+METRICS_PORT = getattr(config, 'METRICS_PORT', 0)
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -23,9 +116,65 @@ logger = logging.getLogger(__name__)
 
 # Инициализация бота и диспетчера
 bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
+db = Database(
+    DB_PATH,
+    cached_statements=getattr(config, 'DB_CACHED_STATEMENTS', 256),
+    user_cache_size=getattr(config, 'USER_CACHE_SIZE', 10000),
+    busy_timeout=getattr(config, 'DB_BUSY_TIMEOUT_MS', 5000),
+    slow_query_ms=getattr(config, 'SLOW_QUERY_MS', None),
+)
+task_cards = TaskCards(getattr(config, 'TASK_CARD_CACHE_SIZE', 10000))
+inline_cache = InlineQueryCache(INLINE_CACHE_TTL)
+project_keyboards = ProjectKeyboards(db.get_projects)
+# Состояния диалогов хранятся в SQLite и переживают перезапуск ('memory' - только в памяти)
+if getattr(config, 'FSM_STORAGE', 'sqlite') == 'memory':
+    storage = MemoryStorage()
+else:
+    storage = SQLiteStorage(db, ttl=getattr(config, 'FSM_STATE_TTL_HOURS', 24) * 3600)
 dp = Dispatcher(storage=storage)
+# События, не записанные из-за недоступной базы при остановке, сохраняются рядом с ней в tasks.db.history-<pid>.jsonl
+history = TaskHistory(db, flush_interval=HISTORY_FLUSH_INTERVAL, keep=HISTORY_MAX_EVENTS,
+                      spill_prefix=DB_PATH + '.history')
 scheduler = AsyncIOScheduler()
+# Все сообщения, которые бот отправляет сам (не в ответ пользователю), идут через очередь
+outbox = OutboundQueue(
+    bot,
+    global_rate=getattr(config, 'SEND_RATE_GLOBAL', 30),
+    per_chat_rate=getattr(config, 'SEND_RATE_PER_CHAT', 1),
+    concurrency=getattr(config, 'SEND_CONCURRENCY', 8),
+)
+
+# Метрики: время обработки обновлений, обработчиков и запросов к базе, размеры очередей
+metrics = MetricsRegistry()
+dp.update.outer_middleware(UpdateMetricsMiddleware(metrics))
+HandlerMetricsMiddleware(metrics).setup(dp)
+db_query_seconds = metrics.histogram('db_query_seconds', 'Время запроса к базе', ('query',))
+db_query_rows = metrics.counter('db_query_rows_total', 'Строк в результатах запросов к базе', ('query',))
+metrics_server: Optional[web.AppRunner] = None
+
+def observe_query(name: str, seconds: float, rows: int) -> None:
+    """Учет запроса к базе (Database.query_observer)"""
+    db_query_seconds.observe(seconds, name)
+    db_query_rows.inc(name, amount=rows)
+
+db.query_observer = observe_query
+
+def count_scheduler_jobs() -> Dict[Tuple[str], int]:
+    """Заданий планировщика, ожидающих запуска, по функциям"""
+    return {(name,): count for name, count in Counter(job.name for job in scheduler.get_jobs()).items()}
+
+async def count_fsm_states() -> Dict[Tuple[str], int]:
+    """Диалогов в каждом состоянии FSM"""
+    if isinstance(storage, SQLiteStorage):
+        states = await storage.count_states()
+    else:
+        states = Counter(record.state for record in storage.storage.values() if record.state)
+    return {(state,): count for state, count in states.items()}
+
+metrics.gauge('scheduler_jobs', 'Заданий в планировщике', count_scheduler_jobs, ('job',))
+metrics.gauge('fsm_states', 'Диалогов в состоянии FSM', count_fsm_states, ('state',))
+metrics.gauge('outbox_queue', 'Сообщений в очереди отправки', lambda: len(outbox))
+metrics.gauge('history_pending', 'Событий истории задач, ожидающих записи в базу', lambda: len(history))
 
 # Состояния для FSM (Finite State Machine)
 class TaskForm(StatesGroup):
@@ -44,234 +193,95 @@ class UpdateTaskForm(StatesGroup):
 class CompleteTaskForm(StatesGroup):
     waiting_for_task_id = State()
 
-# Инициализация базы данных
-def init_db():
-    """Инициализация базы данных SQLite с необходимыми таблицами"""
-    conn = sqlite3.connect('tasks.db')
-    cursor = conn.cursor()
-    
-    # Создание таблицы проектов
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS projects (
-        id INTEGER PRIMARY KEY,
-        name TEXT NOT NULL,
-        description TEXT
-    )
-    ''')
-    
-    # Создание таблицы пользователей
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY,
-        telegram_id INTEGER NOT NULL UNIQUE,
-        username TEXT,
-        first_name TEXT,
-        last_name TEXT
-    )
-    ''')
-    
-    # Создание таблицы задач
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS tasks (
-        id INTEGER PRIMARY KEY,
-        name TEXT NOT NULL,
-        description TEXT,
-        project_id INTEGER,
-        creator_id INTEGER NOT NULL,
-        assignee_id INTEGER,
-        priority TEXT CHECK(priority IN ('Низкий', 'Средний', 'Высокий')),
-        deadline TEXT,
-        status TEXT DEFAULT 'Активная' CHECK(status IN ('Активная', 'Выполнена')),
-        created_at TEXT NOT NULL,
-        FOREIGN KEY (project_id) REFERENCES projects (id),
-        FOREIGN KEY (creator_id) REFERENCES users (id),
-        FOREIGN KEY (assignee_id) REFERENCES users (id)
-    )
-    ''')
-    
-    # Вставка тестового проекта, если его еще нет
-    cursor.execute('SELECT COUNT(*) FROM projects')
-    if cursor.fetchone()[0] == 0:
-        cursor.execute('INSERT INTO projects (name, description) VALUES (?, ?)', 
-                      ('Основной проект', 'Проект по умолчанию для всех задач'))
-    
-    conn.commit()
-    conn.close()
-    
-    logger.info("База данных инициализирована")
-
-# Функции для работы с базой данных
-def register_user(message: Message) -> int:
-    """Регистрация пользователя в базе данных, если его еще нет"""
-    conn = sqlite3.connect('tasks.db')
-    cursor = conn.cursor()
-    
-    user_id = message.from_user.id
-    username = message.from_user.username
-    first_name = message.from_user.first_name
-    last_name = message.from_user.last_name
-    
-    cursor.execute('SELECT id FROM users WHERE telegram_id = ?', (user_id,))
-    result = cursor.fetchone()
-    
-    if not result:
-        cursor.execute(
-            'INSERT INTO users (telegram_id, username, first_name, last_name) VALUES (?, ?, ?, ?)',
-            (user_id, username, first_name, last_name)
-        )
-        conn.commit()
-        user_db_id = cursor.lastrowid
-    else:
-        user_db_id = result[0]
-    
-    conn.close()
-    return user_db_id
-
-def add_task_to_db(task_data: Dict[str, Any]) -> int:
-    """Добавление новой задачи в базу данных"""
-    conn = sqlite3.connect('tasks.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    INSERT INTO tasks (name, description, project_id, creator_id, assignee_id, priority, deadline, created_at)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        task_data['name'],
-        task_data['description'],
-        task_data['project_id'],
-        task_data['creator_id'],
-        task_data['assignee_id'],
-        task_data['priority'],
-        task_data['deadline'],
-        datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    ))
-    
-    task_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return task_id
-
-def get_projects() -> List[Tuple[int, str]]:
-    """Получение списка проектов из базы данных"""
-    conn = sqlite3.connect('tasks.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT id, name FROM projects')
-    projects = cursor.fetchall()
-    
-    conn.close()
-    return projects
-
-def get_users() -> List[Tuple]:
-    """Получение списка пользователей из базы данных"""
-    conn = sqlite3.connect('tasks.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT id, telegram_id, username, first_name, last_name FROM users')
-    users = cursor.fetchall()
-    
-    conn.close()
-    return users
-
-def get_user_tasks(user_id: int, show_completed: bool = False) -> List[Tuple]:
-    """Получение списка задач пользователя"""
-    conn = sqlite3.connect('tasks.db')
-    cursor = conn.cursor()
-    
-    if show_completed:
-        cursor.execute('''
-        SELECT t.id, t.name, t.description, p.name, t.priority, t.deadline, t.status,
-               u.username as creator, a.username as assignee
-        FROM tasks t
-        LEFT JOIN projects p ON t.project_id = p.id
-        LEFT JOIN users u ON t.creator_id = u.id
-        LEFT JOIN users a ON t.assignee_id = a.id
-        WHERE t.creator_id = ? OR t.assignee_id = ?
-        ORDER BY 
-            CASE t.status 
-                WHEN 'Активная' THEN 0 
-                WHEN 'Выполнена' THEN 1 
-            END,
-            CASE t.priority 
-                WHEN 'Высокий' THEN 0 
-                WHEN 'Средний' THEN 1 
-                WHEN 'Низкий' THEN 2 
-            END,
-            t.deadline
-        ''', (user_id, user_id))
-    else:
-        cursor.execute('''
-        SELECT t.id, t.name, t.description, p.name, t.priority, t.deadline, t.status,
-               u.username as creator, a.username as assignee
-        FROM tasks t
-        LEFT JOIN projects p ON t.project_id = p.id
-        LEFT JOIN users u ON t.creator_id = u.id
-        LEFT JOIN users a ON t.assignee_id = a.id
-        WHERE (t.creator_id = ? OR t.assignee_id = ?) AND t.status = 'Активная'
-        ORDER BY 
-            CASE t.priority 
-                WHEN 'Высокий' THEN 0 
-                WHEN 'Средний' THEN 1 
-                WHEN 'Низкий' THEN 2 
-            END,
-            t.deadline
-        ''', (user_id, user_id))
-    
-    tasks = cursor.fetchall()
-    conn.close()
-    return tasks
-
-def get_task_by_id(task_id: int) -> Optional[Tuple]:
-    """Получение задачи по её ID"""
-    conn = sqlite3.connect('tasks.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    SELECT t.id, t.name, t.description, p.name, t.priority, t.deadline, t.status,
-           u.username as creator, a.username as assignee, t.creator_id, t.assignee_id
-    FROM tasks t
-    LEFT JOIN projects p ON t.project_id = p.id
-    LEFT JOIN users u ON t.creator_id = u.id
-    LEFT JOIN users a ON t.assignee_id = a.id
-    WHERE t.id = ?
-    ''', (task_id,))
-    
-    task = cursor.fetchone()
-    conn.close()
-    return task
-
-def update_task_status(task_id: int, status: str) -> None:
-    """Обновление статуса задачи"""
-    conn = sqlite3.connect('tasks.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('UPDATE tasks SET status = ? WHERE id = ?', (status, task_id))
-    
-    conn.commit()
-    conn.close()
-
-def update_task_field(task_id: int, field: str, value: str) -> None:
-    """Обновление поля задачи"""
-    conn = sqlite3.connect('tasks.db')
-    cursor = conn.cursor()
-    
-    cursor.execute(f'UPDATE tasks SET {field} = ? WHERE id = ?', (value, task_id))
-    
-    conn.commit()
-    conn.close()
+class ImportForm(StatesGroup):
+    waiting_for_file = State()
 
 # Обработчики команд
 @dp.message(CommandStart())
 async def cmd_start(message: Message) -> None:
     """Обработчик команды /start - приветствие и регистрация пользователя"""
-    user_id = register_user(message)
+    user_id = await db.register_user(message.from_user)
     await message.answer(
         f"Привет, {message.from_user.first_name}! Я бот для управления задачами.\n\n"
         f"Основные команды:\n"
         f"/add_task - добавить новую задачу\n"
-        f"/list_tasks - просмотреть список задач\n"
+        f"/list_tasks - просмотреть список задач (/list_tasks ready - только те, что можно делать)\n"
         f"/update_task - обновить задачу\n"
-        f"/complete_task - отметить задачу как выполненную"
+        f"/complete_task - отметить задачу как выполненную\n"
+        f"/due - задачи со сроком в ближайшие 24 часа\n"
+        f"/overdue - просроченные задачи\n"
+        f"/search - поиск задач по словам из названия и описания\n"
+        f"/import - загрузить задачи из файла CSV или JSONL\n"
+        f"/export - выгрузить свои задачи в файл\n"
+        f"/project_stats - сводка по проекту\n"
+        f"/digest - ежедневная сводка задач вместо отдельных напоминаний\n"
+        f"/repeat - сделать задачу повторяющейся\n"
+        f"/subtask, /block, /unblock - подзадачи и зависимости между задачами\n"
+        f"/history - история изменений задачи\n"
+        f"@имя_бота текст (в любом чате) - найти свою задачу и отправить ее карточку\n"
+        f"/timezone - часовой пояс для дедлайнов"
+    )
+
+@dp.message(Command("timezone"))
+async def cmd_timezone(message: Message, command: CommandObject) -> None:
+    """Обработчик команды /timezone - просмотр и смена часового пояса пользователя"""
+    user_id, timezone = await db.register_user_profile(message.from_user)
+    name = (command.args or "").strip()
+    if not name:
+        await message.answer(
+            f"Ваш часовой пояс: {timezone or 'время сервера'}.\n"
+            f"Чтобы сменить его, отправьте, например: /timezone Europe/Moscow\n"
+            f"Вернуть время сервера: /timezone server"
+        )
+        return
+    
+    if name.lower() == "server":
+        name = None
+    else:
+        try:
+            get_timezone(name)
+        except ValueError:
+            await message.answer("Неизвестный часовой пояс. Используйте название вида Europe/Moscow или Asia/Almaty.")
+            return
+    
+    await db.set_user_timezone(message.from_user.id, name)
+    # Час сводки задан в часовом поясе пользователя - следующая сводка пересчитывается
+    hour = await db.get_user_digest_hour(user_id)
+    if hour is not None:
+        await db.set_user_digest(user_id, hour, next_digest_at(hour, name, int(datetime.datetime.now().timestamp())))
+    await message.answer(f"Часовой пояс установлен: {name or 'время сервера'}. Дедлайны вводятся и показываются в нем.")
+
+@dp.message(Command("digest"))
+async def cmd_digest(message: Message, command: CommandObject) -> None:
+    """Обработчик команды /digest - включение, смена часа и выключение ежедневной сводки"""
+    user_id, timezone = await db.register_user_profile(message.from_user)
+    arg = (command.args or "").strip().lower()
+    if not arg:
+        hour = await db.get_user_digest_hour(user_id)
+        status = f"приходит в {hour:02d}:00" if hour is not None else "выключена"
+        await message.answer(
+            f"Ежедневная сводка {status}.\n"
+            f"В ней все ваши просроченные задачи и задачи со сроком в ближайшие 24 часа одним сообщением; "
+            f"пока сводка включена, напоминания о каждой задаче не приходят.\n"
+            f"Включить или сменить час (в вашем часовом поясе): /digest 9\n"
+            f"Выключить: /digest off"
+        )
+        return
+    
+    if arg == "off":
+        await db.set_user_digest(user_id, None, None)
+        await message.answer("Ежедневная сводка выключена. Напоминания о дедлайнах снова приходят по каждой задаче.")
+        return
+    
+    if not arg.isdigit() or int(arg) > 23:
+        await message.answer("Укажите час от 0 до 23, например: /digest 9")
+        return
+    
+    hour = int(arg)
+    await db.set_user_digest(user_id, hour, next_digest_at(hour, timezone, int(datetime.datetime.now().timestamp())))
+    await message.answer(
+        f"Ежедневная сводка будет приходить в {hour:02d}:00 ({timezone or 'время сервера'}). "
+        f"Напоминания о каждой задаче больше не приходят."
     )
 
 @dp.message(Command("add_task"))
@@ -280,198 +290,699 @@ async def cmd_add_task(message: Message, state: FSMContext) -> None:
     await state.set_state(TaskForm.waiting_for_name)
     await message.answer("Введите название задачи:")
 
-@dp.message(TaskForm.waiting_for_name)
+@dp.message(StateFilter(TaskForm.waiting_for_name))
 async def process_task_name(message: Message, state: FSMContext) -> None:
     """Обработка ввода названия задачи"""
-    await state.update_data(name=message.text, creator_id=register_user(message))
+    await state.update_data(name=message.text, creator_id=await db.register_user(message.from_user))
     await state.set_state(TaskForm.waiting_for_description)
     await message.answer("Введите описание задачи:")
 
-@dp.message(TaskForm.waiting_for_description)
+@dp.message(StateFilter(TaskForm.waiting_for_description))
 async def process_task_description(message: Message, state: FSMContext) -> None:
     """Обработка ввода описания задачи"""
     await state.update_data(description=message.text)
     
-    # Получение списка проектов
-    projects = get_projects()
-    
-    # Создание клавиатуры для выбора проекта
-    buttons = []
-    for project_id, project_name in projects:
-        buttons.append([InlineKeyboardButton(text=project_name, callback_data=f"project_{project_id}")])
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-    
+    # Клавиатура проектов берется из кэша
     await state.set_state(TaskForm.waiting_for_project)
-    await message.answer("Выберите проект:", reply_markup=keyboard)
+    await message.answer("Выберите проект:", reply_markup=await project_keyboards.keyboard())
 
-@dp.callback_query(lambda c: c.data.startswith('project_'), TaskForm.waiting_for_project)
-async def process_project_selection(callback: CallbackQuery, state: FSMContext) -> None:
+@dp.callback_query(ProjectCallback.filter(), StateFilter(TaskForm.waiting_for_project))
+async def process_project_selection(callback: CallbackQuery, callback_data: ProjectCallback,
+                                    state: FSMContext) -> None:
     """Обработка выбора проекта"""
     await callback.answer()
-    project_id = int(callback.data.split('_')[1])
-    
-    await state.update_data(project_id=project_id)
-    
-    # Создание клавиатуры для выбора приоритета
-    buttons = []
-    for priority in ["Низкий", "Средний", "Высокий"]:
-        buttons.append([InlineKeyboardButton(text=priority, callback_data=f"priority_{priority}")])
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
+    await state.update_data(project_id=callback_data.project_id)
     
     await state.set_state(TaskForm.waiting_for_priority)
-    await callback.message.answer("Выберите приоритет:", reply_markup=keyboard)
+    await callback.message.answer("Выберите приоритет:", reply_markup=PRIORITY_KEYBOARD)
 
-@dp.callback_query(lambda c: c.data.startswith('priority_'), TaskForm.waiting_for_priority)
-async def process_priority_selection(callback: CallbackQuery, state: FSMContext) -> None:
+@dp.callback_query(PRIORITY_FILTER, StateFilter(TaskForm.waiting_for_priority))
+async def process_priority_selection(callback: CallbackQuery, callback_data: PriorityCallback,
+                                     state: FSMContext) -> None:
     """Обработка выбора приоритета"""
     await callback.answer()
-    priority = callback.data.split('_')[1]
-    
-    await state.update_data(priority=priority)
+    await state.update_data(priority=PRIORITIES[callback_data.rank])
     
     await state.set_state(TaskForm.waiting_for_deadline)
     await callback.message.answer(
-        "Введите дедлайн в формате ГГГГ-ММ-ДД ЧЧ:ММ\nНапример: 2025-04-15 15:00"
+        "Введите дедлайн в формате ГГГГ-ММ-ДД ЧЧ:ММ\nНапример: 2025-04-15 15:00\n"
+        "Время - в вашем часовом поясе (/timezone)"
     )
 
-@dp.message(TaskForm.waiting_for_deadline)
+def user_display_name(username: Optional[str], first_name: Optional[str], last_name: Optional[str]) -> str:
+    """Имя пользователя для кнопок выбора исполнителя"""
+    return username or f"{first_name or ''} {last_name or ''}".strip()
+
+@dp.message(StateFilter(TaskForm.waiting_for_deadline))
 async def process_deadline(message: Message, state: FSMContext) -> None:
     """Обработка ввода дедлайна"""
     try:
-        deadline = datetime.datetime.strptime(message.text, '%Y-%m-%d %H:%M')
+        user_id, timezone = await db.register_user_profile(message.from_user)
+        # В состоянии хранится дедлайн в секундах UTC
+        await state.update_data(deadline=parse_deadline(message.text, timezone))
         
-        await state.update_data(deadline=message.text)
-        
-        # Получение списка пользователей
-        users = get_users()
+        # Вместо списка всех пользователей - недавние исполнители и поиск по имени
+        data = await state.get_data()
+        users = await db.get_recent_collaborators(data['creator_id'], RECENT_COLLABORATORS)
         
         # Создание клавиатуры для выбора исполнителя
         buttons = []
-        for user_id, telegram_id, username, first_name, last_name in users:
-            display_name = username or f"{first_name} {last_name}".strip()
-            buttons.append([InlineKeyboardButton(text=display_name, callback_data=f"user_{user_id}")])
+        for user_id, username, first_name, last_name in users:
+            buttons.append([InlineKeyboardButton(text=user_display_name(username, first_name, last_name),
+                                                 callback_data=AssigneeCallback(user_id=user_id).pack())])
         
         # Добавим возможность назначить задачу себе по умолчанию
-        buttons.append([InlineKeyboardButton(text="Я сам", callback_data="user_self")])
+        buttons.append([SELF_BUTTON])
         
         keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
         
         await state.set_state(TaskForm.waiting_for_assignee)
-        await message.answer("Выберите исполнителя:", reply_markup=keyboard)
+        await message.answer(
+            "Выберите исполнителя или введите начало его имени для поиска:",
+            reply_markup=keyboard
+        )
     except ValueError:
         await message.answer("Неверный формат даты. Пожалуйста, используйте формат ГГГГ-ММ-ДД ЧЧ:ММ")
 
-@dp.callback_query(lambda c: c.data.startswith('user_'), TaskForm.waiting_for_assignee)
-async def process_assignee_selection(callback: CallbackQuery, state: FSMContext) -> None:
+async def build_assignee_page(state: FSMContext) -> Optional[InlineKeyboardMarkup]:
+    """Следующая страница результатов поиска исполнителя; курсор хранится в состоянии FSM"""
+    data = await state.get_data()
+    query, cursor = data['assignee_query'], data.get('assignee_cursor')
+    
+    # Лишняя строка показывает, есть ли следующая страница
+    rows = await db.search_users(query, ASSIGNEE_PAGE_SIZE + 1, tuple(cursor) if cursor else None)
+    has_more = len(rows) > ASSIGNEE_PAGE_SIZE
+    rows = rows[:ASSIGNEE_PAGE_SIZE]
+    if not rows:
+        return None
+    
+    # Пользователь может совпасть сразу по нескольким частям имени
+    buttons, seen = [], set(data.get('assignee_seen', []))
+    for user_id, username, first_name, last_name, name in rows:
+        if user_id in seen:
+            continue
+        seen.add(user_id)
+        buttons.append([InlineKeyboardButton(text=user_display_name(username, first_name, last_name),
+                                             callback_data=AssigneeCallback(user_id=user_id).pack())])
+    
+    if has_more:
+        buttons.append([MORE_USERS_BUTTON])
+    buttons.append([SELF_BUTTON])
+    
+    await state.update_data(assignee_cursor=[rows[-1][4], rows[-1][0]], assignee_seen=sorted(seen))
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+@dp.message(StateFilter(TaskForm.waiting_for_assignee))
+async def process_assignee_search(message: Message, state: FSMContext) -> None:
+    """Поиск исполнителя по началу username, имени или фамилии"""
+    query = (message.text or "").strip().lstrip("@")
+    if not query:
+        await message.answer("Введите начало имени пользователя.")
+        return
+    
+    await state.update_data(assignee_query=query, assignee_cursor=None, assignee_seen=[])
+    keyboard = await build_assignee_page(state)
+    
+    if not keyboard:
+        await message.answer("Пользователи не найдены. Попробуйте другое имя или нажмите «Я сам» выше.")
+        return
+    
+    await message.answer("Выберите исполнителя:", reply_markup=keyboard)
+
+@dp.callback_query(AssigneeMoreCallback.filter(), StateFilter(TaskForm.waiting_for_assignee))
+async def process_assignee_more(callback: CallbackQuery, state: FSMContext) -> None:
+    """Следующая страница результатов поиска исполнителя"""
+    keyboard = await build_assignee_page(state)
+    
+    if not keyboard:
+        await callback.answer("Больше пользователей нет.")
+        return
+    
+    await callback.answer()
+    await callback.message.edit_reply_markup(reply_markup=keyboard)
+
+@dp.callback_query(AssigneeCallback.filter(), StateFilter(TaskForm.waiting_for_assignee))
+async def process_assignee_selection(callback: CallbackQuery, callback_data: AssigneeCallback,
+                                     state: FSMContext) -> None:
     """Обработка выбора исполнителя"""
     await callback.answer()
-    user_data = callback.data.split('_')[1]
-    
     data = await state.get_data()
-    
-    if user_data == "self":
-        data['assignee_id'] = data['creator_id']
-    else:
-        data['assignee_id'] = int(user_data)
+    if not isinstance(data.get('deadline'), int):
+        # Диалог начат до перевода дедлайнов в секунды UTC (миграция 8) и хранит дедлайн текстом
+        # в местном времени сервера: такой дедлайн не записать в базу, его нужно ввести заново
+        await state.set_state(TaskForm.waiting_for_deadline)
+        await callback.message.answer("Введите дедлайн еще раз в формате ГГГГ-ММ-ДД ЧЧ:ММ\nНапример: 2025-04-15 15:00")
+        return
+    data['assignee_id'] = callback_data.user_id or data['creator_id']
     
     # Добавление задачи в базу данных
-    task_id = add_task_to_db(data)
+    task_id = await db.add_task_to_db(data)
+    # SQLite может выдать id последней удаленной строки, поэтому старая карточка сбрасывается
+    task_cards.invalidate(task_id)
+    history.record(task_id, data['creator_id'], 'created')
+    inline_cache.invalidate(data['creator_id'])
+    inline_cache.invalidate(data['assignee_id'])
     
-    # Планирование напоминания, если указан дедлайн
-    if 'deadline' in data:
-        deadline = datetime.datetime.strptime(data['deadline'], '%Y-%m-%d %H:%M')
-        reminder_time = deadline - datetime.timedelta(hours=24)  # Напоминание за 24 часа
-        
-        if reminder_time > datetime.datetime.now():
-            scheduler.add_job(
-                send_reminder,
-                trigger=DateTrigger(run_date=reminder_time),
-                args=[task_id],
-                id=f"reminder_{task_id}"
-            )
+    # Планирование напоминания
+    await schedule_reminder(task_id, data['deadline'])
     
     await state.clear()
     await callback.message.answer(f"Задача успешно добавлена с ID: {task_id}")
 
-@dp.message(Command("list_tasks"))
-async def cmd_list_tasks(message: Message) -> None:
-    """Обработчик команды /list_tasks - просмотр списка задач"""
-    user_id = register_user(message)
-    tasks = get_user_tasks(user_id)
-    
+def task_page_callback(status: str, direction: str, task: Tuple, ready: bool = False) -> str:
+    """callback_data кнопки листания: статус, направление, ключ крайней задачи страницы и фильтр ready"""
+    return TaskPageCallback(status=STATUSES.index(status), direction=direction,
+                            rank=priority_rank(task[4]), deadline=task[5], task_id=task[0], ready=ready).pack()
+
+async def build_tasks_page(user_id: int, status: str, timezone: Optional[str] = None, after: Optional[Tuple] = None,
+                           before: Optional[Tuple] = None,
+                           ready: bool = False) -> Optional[Tuple[str, Optional[InlineKeyboardMarkup]]]:
+    """Текст и клавиатура одной страницы списка задач; None, если задач на странице нет
+    
+    ready - только задачи без активных блокирующих задач и подзадач.
+    """
+    # Лишняя строка показывает, есть ли задачи дальше в направлении листания
+    tasks = await db.get_user_tasks(user_id, status=status, limit=TASKS_PAGE_SIZE + 1, after=after, before=before,
+                                    ready=ready)
+    has_more = len(tasks) > TASKS_PAGE_SIZE
+    if before is not None:
+        tasks = tasks[-TASKS_PAGE_SIZE:]
+    else:
+        tasks = tasks[:TASKS_PAGE_SIZE]
     if not tasks:
-        await message.answer("У вас нет активных задач.")
-        return
+        return None
     
-    response = "📋 Ваши активные задачи:\n\n"
-    for task in tasks:
-        task_id, name, description, project, priority, deadline, status, creator, assignee = task
-        
-        # Определение эмодзи для приоритета
-        priority_emoji = {
-            "Низкий": "🟢",
-            "Средний": "🟡",
-            "Высокий": "🔴"
-        }.get(priority, "")
-        
-        response += f"ID: {task_id}\n"
-        response += f"📌 {name}\n"
-        response += f"📝 {description[:50]}...\n" if len(description) > 50 else f"📝 {description}\n"
-        response += f"📁 Проект: {project}\n"
-        response += f"{priority_emoji} Приоритет: {priority}\n"
-        
-        if deadline:
-            deadline_date = datetime.datetime.strptime(deadline, '%Y-%m-%d %H:%M')
-            days_left = (deadline_date - datetime.datetime.now()).days
-            deadline_str = f"⏰ Дедлайн: {deadline}"
-            if days_left < 0:
-                deadline_str += " (просрочено!)"
-            elif days_left == 0:
-                deadline_str += " (сегодня!)"
-            deadline_str += "\n"
-            response += deadline_str
-        
-        response += f"👤 Создатель: {creator}\n"
-        response += f"👥 Исполнитель: {assignee}\n"
-        response += "\n"
+    if before is not None:
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = after is not None, has_more
     
-    # Добавляем кнопку для просмотра завершенных задач
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[[InlineKeyboardButton(text="Показать завершенные задачи", callback_data="show_completed")]]
-    )
+    if ready:
+        header = "🟢 Задачи, которые можно делать сейчас:\n\n"
+    elif status == STATUS_ACTIVE:
+        header = "📋 Ваши активные задачи:\n\n"
+    else:
+        header = "✅ Ваши завершенные задачи:\n\n"
+    response = header + task_cards.render_list(tasks, timezone)
+    
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton(text="◀️ Назад",
+                                               callback_data=task_page_callback(status, "p", tasks[0], ready)))
+    if has_next:
+        navigation.append(InlineKeyboardButton(text="Вперед ▶️",
+                                               callback_data=task_page_callback(status, "n", tasks[-1], ready)))
+    
+    buttons = [navigation] if navigation else []
+    if status == STATUS_ACTIVE:
+        # Добавляем кнопку для просмотра завершенных задач
+        buttons.append([COMPLETED_BUTTON])
+    
+    return response, InlineKeyboardMarkup(inline_keyboard=buttons) if buttons else None
+
+@dp.message(Command("list_tasks"))
+async def cmd_list_tasks(message: Message, command: CommandObject) -> None:
+    """Обработчик команды /list_tasks - просмотр списка задач (/list_tasks ready - только незаблокированные)"""
+    user_id, timezone = await db.register_user_profile(message.from_user)
+    ready = (command.args or "").strip().lower() == "ready"
+    page = await build_tasks_page(user_id, STATUS_ACTIVE, timezone, ready=ready)
+    
+    if not page:
+        if ready:
+            await message.answer("Нет задач, которые можно делать сейчас: все активные задачи ждут других.")
+        else:
+            await message.answer("У вас нет активных задач.")
+        return
     
+    response, keyboard = page
     await message.answer(response, reply_markup=keyboard)
 
-@dp.callback_query(F.data == "show_completed")
+@dp.callback_query(CompletedCallback.filter())
 async def process_show_completed(callback: CallbackQuery) -> None:
     """Обработка запроса на просмотр завершенных задач"""
     await callback.answer()
-    user_id = register_user(callback.message)
-    tasks = get_user_tasks(user_id, show_completed=True)
+    user_id, timezone = await db.register_user_profile(callback.from_user)
+    page = await build_tasks_page(user_id, STATUS_COMPLETED, timezone)
     
-    completed_tasks = [task for task in tasks if task[6] == 'Выполнена']
-    
-    if not completed_tasks:
+    if not page:
         await callback.message.answer(
             "У вас нет завершенных задач."
         )
         return
     
-    response = "✅ Ваши завершенные задачи:\n\n"
-    for task in completed_tasks:
-        task_id, name, description, project, priority, deadline, status, creator, assignee = task
+    response, keyboard = page
+    await callback.message.answer(response, reply_markup=keyboard)
+
+@dp.callback_query(TaskPageCallback.filter())
+async def process_tasks_page(callback: CallbackQuery, callback_data: TaskPageCallback) -> None:
+    """Листание списка задач: сообщение со списком редактируется на месте"""
+    key = (callback_data.rank, callback_data.deadline, callback_data.task_id)
+    
+    user_id, timezone = await db.register_user_profile(callback.from_user)
+    status = STATUSES[callback_data.status]
+    if callback_data.direction == "n":
+        page = await build_tasks_page(user_id, status, timezone, after=key, ready=callback_data.ready)
+    else:
+        page = await build_tasks_page(user_id, status, timezone, before=key, ready=callback_data.ready)
+    
+    if not page:
+        await callback.answer("Больше задач нет.")
+        return
+    
+    await callback.answer()
+    response, keyboard = page
+    await callback.message.edit_text(response, reply_markup=keyboard)
+
+async def answer_tasks_by_deadline(message: Message, start: Optional[int], end: int, title: str, empty: str) -> None:
+    """Ответ списком активных задач пользователя с дедлайном в [start, end)"""
+    user_id, timezone = await db.register_user_profile(message.from_user)
+    tasks = await db.get_user_tasks_by_deadline(user_id, start, end, TASKS_PAGE_SIZE + 1)
+    if not tasks:
+        await message.answer(empty)
+        return
+    
+    response = title + task_cards.render_list(tasks[:TASKS_PAGE_SIZE], timezone)
+    if len(tasks) > TASKS_PAGE_SIZE:
+        response += f"Показаны первые {TASKS_PAGE_SIZE}, остальные - в /list_tasks."
+    await message.answer(response)
+
+@dp.message(Command("due"))
+async def cmd_due(message: Message) -> None:
+    """Обработчик команды /due - задачи со сроком в ближайшие 24 часа"""
+    now = int(datetime.datetime.now().timestamp())
+    await answer_tasks_by_deadline(message, now, now + 24 * 3600, "⏰ Срок в ближайшие 24 часа:\n\n",
+                                   "Задач со сроком в ближайшие 24 часа нет.")
+
+@dp.message(Command("overdue"))
+async def cmd_overdue(message: Message) -> None:
+    """Обработчик команды /overdue - просроченные активные задачи"""
+    now = int(datetime.datetime.now().timestamp())
+    await answer_tasks_by_deadline(message, None, now, "🔥 Просроченные задачи:\n\n", "Просроченных задач нет.")
+
+async def build_search_page(user_id: int, timezone: Optional[str], query: str,
+                            offset: int) -> Optional[Tuple[str, Optional[InlineKeyboardMarkup]]]:
+    """Текст и клавиатура страницы результатов поиска; None, если на странице ничего нет"""
+    tasks = await db.search_tasks(user_id, query, TASKS_PAGE_SIZE + 1, offset)
+    if not tasks:
+        return None
+    
+    response = f"🔍 Задачи по запросу «{query}»:\n\n" + task_cards.render_list(tasks[:TASKS_PAGE_SIZE], timezone)
+    navigation = []
+    if offset > 0:
+        previous = SearchPageCallback(offset=max(0, offset - TASKS_PAGE_SIZE))
+        navigation.append(InlineKeyboardButton(text="◀️ Назад", callback_data=previous.pack()))
+    if len(tasks) > TASKS_PAGE_SIZE:
+        following = SearchPageCallback(offset=offset + TASKS_PAGE_SIZE)
+        navigation.append(InlineKeyboardButton(text="Вперед ▶️", callback_data=following.pack()))
+    return response, InlineKeyboardMarkup(inline_keyboard=[navigation]) if navigation else None
+
+@dp.message(Command("search"))
+async def cmd_search(message: Message, command: CommandObject, state: FSMContext) -> None:
+    """Обработчик команды /search - полнотекстовый поиск по задачам пользователя"""
+    query = (command.args or "").strip()
+    if not query:
+        await message.answer("Укажите слова для поиска, например: /search отчет квартал")
+        return
+    
+    user_id, timezone = await db.register_user_profile(message.from_user)
+    page = await build_search_page(user_id, timezone, query, 0)
+    if not page:
+        await message.answer(f"По запросу «{query}» задач не найдено.")
+        return
+    
+    # Запрос нужен для листания результатов, в callback_data он может не поместиться
+    await state.update_data(search_query=query)
+    response, keyboard = page
+    await message.answer(response, reply_markup=keyboard)
+
+@dp.callback_query(SearchPageCallback.filter())
+async def process_search_page(callback: CallbackQuery, callback_data: SearchPageCallback, state: FSMContext) -> None:
+    """Листание результатов поиска: сообщение редактируется на месте"""
+    query = (await state.get_data()).get("search_query")
+    if not query:
+        await callback.answer("Результаты поиска устарели, повторите /search.")
+        return
+    
+    user_id, timezone = await db.register_user_profile(callback.from_user)
+    page = await build_search_page(user_id, timezone, query, callback_data.offset)
+    if not page:
+        await callback.answer("Больше задач нет.")
+        return
+    
+    await callback.answer()
+    response, keyboard = page
+    await callback.message.edit_text(response, reply_markup=keyboard)
+
+async def find_inline_tasks(user_id: int, query: str) -> List[Tuple]:
+    """Активные задачи пользователя для inline-запроса query (после normalize_query)
+    
+    Пока у пользователя не больше INLINE_CANDIDATES активных задач, база читается один раз
+    за INLINE_CACHE_TTL: все следующие буквы фильтруются в памяти. У кого задач больше,
+    текст ищется по полнотекстовому индексу, и его продолжения тоже фильтруются в памяти.
+    """
+    if not search_terms(query):
+        # В запросе нет слов (например, «#»): показываются все задачи-кандидаты. Пустой результат
+        # поиска попал бы в кэш как полный, и продолжения («#отчет») фильтровались бы из него
+        query = ''
+    rows = inline_cache.get(user_id, query)
+    if rows is None and not inline_cache.has(user_id, ''):
+        tasks = await db.get_user_tasks(user_id, STATUS_ACTIVE, INLINE_CANDIDATES + 1)
+        inline_cache.put(user_id, '', tasks[:INLINE_CANDIDATES], len(tasks) <= INLINE_CANDIDATES)
+        rows = inline_cache.get(user_id, query)
+    if rows is None:
+        found = await db.search_tasks(user_id, query, INLINE_CANDIDATES + 1, candidates=INLINE_CANDIDATES + 1)
+        rows = [task for task in found[:INLINE_CANDIDATES] if task[6] == STATUS_ACTIVE]
+        # Слово из одной буквы индекс ищет целиком, а не по началу: продолжения такого
+        # запроса из этих строк не отфильтровать
+        complete = len(found) <= INLINE_CANDIDATES and all(len(term) > 1 for term in search_terms(query))
+        inline_cache.put(user_id, query, rows, complete)
+    return rows
+
+def inline_task_result(task: Tuple, timezone: Optional[str], now: int) -> InlineQueryResultArticle:
+    """Результат inline-запроса: при выборе в чат отправляется карточка задачи"""
+    return inline_article(task, timezone, task_cards.render(task, timezone, now))
+
+# Одни и те же задачи показываются на каждую букву запроса, а создание объекта
+# результата с проверкой полей дороже поиска, поэтому готовые результаты кэшируются.
+# Строка задачи содержит ее версию, текст карточки - пометку дедлайна на сейчас
+@functools.lru_cache(maxsize=INLINE_RESULT_CACHE_SIZE)
+def inline_article(task: Tuple, timezone: Optional[str], message_text: str) -> InlineQueryResultArticle:
+    task_id, name, description, project, priority, deadline = task[:6]
+    details = [f"ID: {task_id}", project or "Без проекта"]
+    if deadline is not None:
+        details.insert(1, f"до {format_deadline(deadline, timezone)}")
+    return InlineQueryResultArticle(
+        id=str(task_id),
+        title=f"{PRIORITY_EMOJI.get(priority, '⚪')} {name}",
+        description=" · ".join(details),
+        input_message_content=InputTextMessageContent(message_text=message_text),
+    )
+
+@dp.inline_query()
+async def process_inline_query(inline_query: InlineQuery) -> None:
+    """Inline-режим: «@бот текст» в любом чате ищет активные задачи пользователя
+    
+    Telegram присылает запрос на каждую набранную букву, поэтому ответы берутся из
+    InlineQueryCache; страницы по INLINE_PAGE_SIZE результатов листаются через next_offset.
+    """
+    user_id, timezone = await db.register_user_profile(inline_query.from_user)
+    tasks = await find_inline_tasks(user_id, normalize_query(inline_query.query))
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    now = int(datetime.datetime.now().timestamp())
+    await inline_query.answer(
+        [inline_task_result(task, timezone, now) for task in tasks[offset:offset + INLINE_PAGE_SIZE]],
+        cache_time=INLINE_CACHE_TIME,
+        is_personal=True,
+        next_offset=str(offset + INLINE_PAGE_SIZE) if offset + INLINE_PAGE_SIZE < len(tasks) else '',
+    )
+
+async def import_tasks_file(path: str, file_name: Optional[str], user_id: int,
+                            timezone: Optional[str]) -> TaskImport:
+    """Импорт задач из файла CSV или JSONL пачками по IMPORT_BATCH_SIZE строк
+    
+    Файл читается построчно; исполнители каждой пачки ищутся одним запросом,
+    пачка записывается одной транзакцией вместе с напоминаниями.
+    """
+    importer = TaskImport(user_id, timezone, await db.get_projects())
+    remind_before = int(REMINDER_BEFORE.total_seconds())
+    with open(path, encoding='utf-8-sig', newline='') as file:
+        file_format = detect_format(file_name, file.read(1024))
+        file.seek(0)
+        for batch in read_batches(file, file_format, IMPORT_BATCH_SIZE):
+            names = importer.unknown_assignees(batch)
+            if names:
+                importer.add_assignees(names, await db.find_users_by_username(names))
+            rows = importer.validate(batch)
+            if not rows:
+                continue
+            
+            added = await db.import_tasks(rows, remind_before, int(datetime.datetime.now().timestamp()))
+            importer.imported += len(added)
+            inline_cache.invalidate(user_id)
+            for task_id, remind_at in added:
+                task_cards.invalidate(task_id)
+                history.record(task_id, user_id, 'created', new_value='import')
+                if remind_at is not None:
+                    add_imported_reminder_job(task_id, remind_at)
+    return importer
+
+async def answer_import(message: Message) -> None:
+    """Скачивание присланного файла во временный каталог и импорт задач из него"""
+    document = message.document
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        await message.answer("Файл больше 20 МБ, разделите его на части.")
+        return
+    
+    user_id, timezone = await db.register_user_profile(message.from_user)
+    await message.answer("⏳ Импортирую задачи...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'import')
+        await bot.download(document, destination=path)
+        try:
+            importer = await import_tasks_file(path, document.file_name, user_id, timezone)
+        except UnicodeDecodeError:
+            await message.answer("Файл должен быть в кодировке UTF-8.")
+            return
+        except csv.Error as error:
+            # Испорченные строки данных пропускаются при чтении, сюда доходит только ошибка в заголовке
+            await message.answer(f"Не удалось прочитать заголовок CSV (строка 1): {error}")
+            return
+    await message.answer(importer.summary())
+
+@dp.message(Command("import"))
+async def cmd_import(message: Message, state: FSMContext) -> None:
+    """Обработчик команды /import - загрузка задач из файла (файл можно прислать с подписью /import)"""
+    if message.document:
+        await answer_import(message)
+        return
+    
+    await state.set_state(ImportForm.waiting_for_file)
+    await message.answer(
+        "Пришлите файл CSV или JSONL с задачами. Колонки: name, description, project, "
+        "priority, deadline (ГГГГ-ММ-ДД ЧЧ:ММ), assignee (username), status. "
+        "Обязательны name и deadline. Файл из /export подходит для импорта."
+    )
+
+@dp.message(StateFilter(ImportForm.waiting_for_file))
+async def process_import_file(message: Message, state: FSMContext) -> None:
+    """Получение файла для импорта"""
+    if not message.document:
+        await message.answer("Пришлите файл документом или отправьте другую команду.")
+        return
+    
+    await state.clear()
+    await answer_import(message)
+
+@dp.message(Command("export"))
+async def cmd_export(message: Message, command: CommandObject) -> None:
+    """Обработчик команды /export - выгрузка задач пользователя в CSV (или JSONL: /export jsonl)"""
+    file_format = (command.args or "csv").strip().lower()
+    if file_format not in ("csv", "jsonl"):
+        await message.answer("Поддерживаются форматы csv и jsonl, например: /export jsonl")
+        return
+    
+    user_id, timezone = await db.register_user_profile(message.from_user)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"tasks.{file_format}")
+        # utf-8-sig: Excel без BOM показывает кириллицу в CSV неправильно
+        with open(path, 'w', encoding='utf-8-sig', newline='') as file:
+            export = TaskExport(file, file_format, timezone)
+            async for rows in db.export_user_tasks(user_id):
+                export.write(rows)
         
-        response += f"ID: {task_id}\n"
-        response += f"📌 {name}\n"
-        response += f"📝 {description[:50]}...\n" if len(description) > 50 else f"📝 {description}\n"
-        response += f"📁 Проект: {project}\n"
-        response += f"👤 Создатель: {creator}\n"
-        response += f"👥 Исполнитель: {assignee}\n"
-        response += "\n"
+        if not export.count:
+            await message.answer("У вас пока нет задач.")
+            return
+        await message.answer_document(FSInputFile(path), caption=f"📤 Задач в файле: {export.count}")
+
+async def project_stats_text(project_id: int, project_name: str) -> str:
+    """Сводка по проекту из счетчиков базы"""
+    now = int(datetime.datetime.now().timestamp())
+    counts, workload = await db.get_project_stats(project_id, now)
+    return format_project_stats(project_name, counts, [
+        (user_display_name(username, first_name, last_name) if assignee_id else "Без исполнителя", active, overdue)
+        for assignee_id, username, first_name, last_name, active, overdue in workload
+    ])
+
+@dp.message(Command("project_stats"))
+async def cmd_project_stats(message: Message) -> None:
+    """Обработчик команды /project_stats - сводка по задачам проекта"""
+    projects = await project_keyboards.projects()
+    if not projects:
+        await message.answer("Проектов пока нет.")
+        return
+    if len(projects) == 1:
+        project_id, project_name = projects[0]
+        await message.answer(await project_stats_text(project_id, project_name))
+        return
+    
+    await message.answer("Выберите проект:", reply_markup=await project_keyboards.keyboard(ProjectStatsCallback))
+
+@dp.callback_query(ProjectStatsCallback.filter())
+async def process_project_stats(callback: CallbackQuery, callback_data: ProjectStatsCallback) -> None:
+    """Сводка по выбранному проекту"""
+    project_id = callback_data.project_id
+    project_name = await project_keyboards.name(project_id)
+    if project_name is None:
+        await callback.answer("Проект не найден.")
+        return
+    
+    await callback.answer()
+    await callback.message.answer(await project_stats_text(project_id, project_name))
+
+@dp.message(Command("repeat"))
+async def cmd_repeat(message: Message, command: CommandObject) -> None:
+    """Обработчик команды /repeat - повторение задачи по правилу, его смена и отмена"""
+    user_id, timezone = await db.register_user_profile(message.from_user)
+    args = (command.args or "").split(maxsplit=1)
+    if len(args) < 2 or not args[0].isdigit():
+        recurrences = await db.get_user_recurrences(user_id)
+        lines = [f"🔁 {name} - {describe_rule(rule)}, следующее: {format_deadline(deadline, timezone)}"
+                 for recurrence_id, name, rule, deadline in recurrences]
+        await message.answer(
+            ("Повторяющиеся задачи:\n" + "\n".join(lines) + "\n\n" if lines else "") +
+            f"Чтобы задача повторялась, отправьте /repeat <ID задачи> <правило>, например: /repeat 12 по будням\n"
+            f"Правила: {RULE_HELP}.\n"
+            f"Следующее повторение появляется за {RECURRENCE_HORIZON.days} дн. до дедлайна "
+            f"или сразу после выполнения предыдущего.\n"
+            f"Отменить повторение: /repeat <ID задачи> off"
+        )
+        return
+    
+    task_id = int(args[0])
+    task = await db.get_task_by_id(task_id)
+    if not task:
+        await message.answer(f"Задача с ID {task_id} не найдена.")
+        return
+    if user_id != task[9] and user_id != task[10]:
+        await message.answer("Вы не можете изменить эту задачу, так как не являетесь её создателем или исполнителем.")
+        return
+    
+    if args[1].strip().lower() == "off":
+        if await db.stop_recurrence(task_id):
+            await message.answer(f"Задача '{task[1]}' больше не повторяется. Уже созданные повторения остались.")
+        else:
+            await message.answer(f"Задача '{task[1]}' не повторяется.")
+        return
     
-    await callback.message.answer(response)
+    try:
+        rule = parse_rule(args[1])
+    except ValueError as error:
+        await message.answer(f"{error}\nПравила: {RULE_HELP}.")
+        return
+    
+    _, deadline = await db.set_recurrence(task_id, rule, timezone, next_deadline)
+    await message.answer(
+        f"Задача '{task[1]}' будет повторяться {describe_rule(rule)}.\n"
+        f"Следующее повторение: {format_deadline(deadline, timezone)}"
+    )
+
+async def load_own_tasks(message: Message, user_id: int, task_ids: List[int]) -> Optional[List[Tuple]]:
+    """Задачи, создателем или исполнителем которых является пользователь; None (с ответом), если это не так"""
+    tasks = []
+    for task_id in task_ids:
+        task = await db.get_task_by_id(task_id)
+        if not task:
+            await message.answer(f"Задача с ID {task_id} не найдена.")
+            return None
+        if user_id != task[9] and user_id != task[10]:
+            await message.answer(f"Вы не являетесь создателем или исполнителем задачи {task_id}.")
+            return None
+        tasks.append(task)
+    return tasks
+
+@dp.message(Command("subtask"))
+async def cmd_subtask(message: Message, command: CommandObject) -> None:
+    """Обработчик команды /subtask - подзадачи: прогресс, добавление и отделение"""
+    user_id, _ = await db.register_user_profile(message.from_user)
+    args = (command.args or "").lower().split()
+    valid = 1 <= len(args) <= 2 and args[0].isdigit() and (len(args) == 1 or args[1].isdigit() or args[1] == "off")
+    if not valid:
+        await message.answer(
+            "Подзадачи:\n"
+            "/subtask <ID задачи> <ID подзадачи> - сделать задачу подзадачей\n"
+            "/subtask <ID подзадачи> off - сделать подзадачу самостоятельной задачей\n"
+            "/subtask <ID задачи> - прогресс по подзадачам\n"
+            "Задачу нельзя выполнить, пока не выполнены все ее подзадачи."
+        )
+        return
+    
+    if len(args) == 1:
+        tasks = await load_own_tasks(message, user_id, [int(args[0])])
+        if tasks is None:
+            return
+        total, done = await db.get_subtask_progress(tasks[0][0])
+        if not total:
+            await message.answer(f"У задачи '{tasks[0][1]}' нет подзадач.")
+            return
+        waiting = await db.get_open_prerequisites(tasks[0][0], TASKS_PAGE_SIZE)
+        await message.answer(
+            f"Задача '{tasks[0][1]}': выполнено {done} из {total} подзадач ({done * 100 // total}%)" +
+            "".join(f"\n{'📎' if kind == 'subtask' else '⛔'} {name} (ID: {other_id})"
+                    for other_id, name, kind in waiting)
+        )
+        return
+    
+    if args[1] == "off":
+        tasks = await load_own_tasks(message, user_id, [int(args[0])])
+        if tasks is not None:
+            await db.set_parent(tasks[0][0], None)
+            await message.answer(f"Задача '{tasks[0][1]}' больше не подзадача.")
+        return
+    
+    tasks = await load_own_tasks(message, user_id, [int(args[0]), int(args[1])])
+    if tasks is None:
+        return
+    parent, child = tasks
+    if not await db.set_parent(child[0], parent[0]):
+        await message.answer("Так нельзя: задачи окажутся в цикле и ни одну из них нельзя будет выполнить.")
+        return
+    await message.answer(f"Задача '{child[1]}' теперь подзадача '{parent[1]}'.")
+
+@dp.message(Command("block", "unblock"))
+async def cmd_block(message: Message, command: CommandObject) -> None:
+    """Обработчики команд /block и /unblock - зависимость «задача ждет другую задачу»"""
+    user_id, _ = await db.register_user_profile(message.from_user)
+    args = (command.args or "").split()
+    if len(args) != 2 or not all(arg.isdigit() for arg in args):
+        await message.answer(
+            "Зависимости:\n"
+            "/block <ID задачи> <ID блокирующей задачи> - задачу можно выполнить только после блокирующей\n"
+            "/unblock <ID задачи> <ID блокирующей задачи> - убрать зависимость\n"
+            "/list_tasks ready - только задачи, которые можно делать сейчас"
+        )
+        return
+    
+    tasks = await load_own_tasks(message, user_id, [int(arg) for arg in args])
+    if tasks is None:
+        return
+    task, blocker = tasks
+    if command.command == "unblock":
+        if await db.remove_dependency(task[0], blocker[0]):
+            await message.answer(f"Задача '{task[1]}' больше не ждет '{blocker[1]}'.")
+        else:
+            await message.answer(f"Задача '{task[1]}' не ждала '{blocker[1]}'.")
+        return
+    
+    if not await db.add_dependency(task[0], blocker[0]):
+        await message.answer("Так нельзя: задачи окажутся в цикле и ни одну из них нельзя будет выполнить.")
+        return
+    await message.answer(f"Задача '{task[1]}' ждет выполнения '{blocker[1]}'.")
+
+@dp.message(Command("history"))
+async def cmd_history(message: Message, command: CommandObject) -> None:
+    """Обработчик команды /history - история изменений задачи"""
+    user_id, timezone = await db.register_user_profile(message.from_user)
+    args = (command.args or "").split()
+    if len(args) != 1 or not args[0].isdigit():
+        await message.answer("История изменений задачи: /history <ID задачи>")
+        return
+    
+    tasks = await load_own_tasks(message, user_id, [int(args[0])])
+    if tasks is None:
+        return
+    events = await history.events(tasks[0][0], HISTORY_PAGE_SIZE)
+    await message.answer(format_history(tasks[0][1], events, timezone))
 
 @dp.message(Command("complete_task"))
 async def cmd_complete_task(message: Message, state: FSMContext) -> None:
@@ -479,11 +990,11 @@ async def cmd_complete_task(message: Message, state: FSMContext) -> None:
     await state.set_state(CompleteTaskForm.waiting_for_task_id)
     await message.answer("Введите ID задачи, которую хотите отметить как выполненную:")
 
-@dp.message(CompleteTaskForm.waiting_for_task_id, lambda message: message.text.isdigit())
+@dp.message(StateFilter(CompleteTaskForm.waiting_for_task_id), F.text.isdigit())
 async def process_task_complete_id(message: Message, state: FSMContext) -> None:
     """Обработка ввода ID задачи для отметки как выполненной"""
     task_id = int(message.text)
-    task = get_task_by_id(task_id)
+    task = await db.get_task_by_id(task_id)
     
     if not task:
         await message.answer(f"Задача с ID {task_id} не найдена.")
@@ -491,7 +1002,7 @@ async def process_task_complete_id(message: Message, state: FSMContext) -> None:
         return
     
     # Проверяем, является ли пользователь создателем или исполнителем задачи
-    user_id = register_user(message)
+    user_id, timezone = await db.register_user_profile(message.from_user)
     creator_id, assignee_id = task[9], task[10]
     
     if user_id != creator_id and user_id != assignee_id:
@@ -504,14 +1015,38 @@ async def process_task_complete_id(message: Message, state: FSMContext) -> None:
         await state.clear()
         return
     
-    update_task_status(task_id, 'Выполнена')
+    # Задачу с активными блокирующими задачами или подзадачами выполнить нельзя
+    previous_status = await db.complete_task(task_id)
+    if previous_status is None:
+        waiting = await db.get_open_prerequisites(task_id, TASKS_PAGE_SIZE)
+        if not waiting:
+            # Ничто не мешает - значит, задачу только что отметили выполненной в другом обновлении
+            await message.answer("Эта задача уже отмечена как выполненная.")
+            await state.clear()
+            return
+        await message.answer(
+            "Сначала нужно выполнить:\n" +
+            "\n".join(f"{'📎 подзадача' if kind == 'subtask' else '⛔ блокирует'}: {name} (ID: {other_id})"
+                      for other_id, name, kind in waiting)
+        )
+        await state.clear()
+        return
+    task_cards.invalidate(task_id)
+    history.record(task_id, user_id, 'status', previous_status, STATUS_COMPLETED)
+    inline_cache.invalidate(creator_id)
+    inline_cache.invalidate(assignee_id)
     
     # Если задача была с напоминанием, удаляем его
-    scheduler_job_id = f"reminder_{task_id}"
-    if scheduler.get_job(scheduler_job_id):
-        scheduler.remove_job(scheduler_job_id)
-    
-    await message.answer(f"Задача с ID {task_id} отмечена как выполненная! 🎉")
+    await cancel_reminder(task_id)
+    
+    response = f"Задача с ID {task_id} отмечена как выполненная! 🎉"
+    # У повторяющейся задачи сразу появляется следующее повторение, если оно еще не создано
+    for next_task_id, deadline, remind_at in await db.advance_recurrence(
+            task_id, int(REMINDER_BEFORE.total_seconds()), next_deadline):
+        if remind_at is not None:
+            add_imported_reminder_job(next_task_id, remind_at)
+        response += f"\n🔁 Следующее повторение: ID {next_task_id}, дедлайн {format_deadline(deadline, timezone)}"
+    await message.answer(response)
     await state.clear()
 
 @dp.message(Command("update_task"))
@@ -520,7 +1055,7 @@ async def cmd_update_task(message: Message, state: FSMContext) -> None:
     await state.set_state(UpdateTaskForm.waiting_for_task_id)
     await message.answer("Введите ID задачи, которую хотите обновить:")
 
-@dp.message(UpdateTaskForm.waiting_for_task_id)
+@dp.message(StateFilter(UpdateTaskForm.waiting_for_task_id))
 async def process_update_task_id(message: Message, state: FSMContext) -> None:
     """Обработка ввода ID задачи для обновления"""
     if not message.text.isdigit():
@@ -528,7 +1063,7 @@ async def process_update_task_id(message: Message, state: FSMContext) -> None:
         return
     
     task_id = int(message.text)
-    task = get_task_by_id(task_id)
+    task = await db.get_task_by_id(task_id)
     
     if not task:
         await message.answer(f"Задача с ID {task_id} не найдена.")
@@ -536,7 +1071,7 @@ async def process_update_task_id(message: Message, state: FSMContext) -> None:
         return
     
     # Проверяем, является ли пользователь создателем или исполнителем задачи
-    user_id = register_user(message)
+    user_id = await db.register_user(message.from_user)
     creator_id, assignee_id = task[9], task[10]
     
     if user_id != creator_id and user_id != assignee_id:
@@ -544,47 +1079,28 @@ async def process_update_task_id(message: Message, state: FSMContext) -> None:
         await state.clear()
         return
     
-    await state.update_data(task_id=task_id)
-    
-    # Создание клавиатуры для выбора поля для обновления
-    fields = [
-        ("name", "Название"),
-        ("description", "Описание"),
-        ("priority", "Приоритет"),
-        ("deadline", "Дедлайн")
-    ]
-    
-    buttons = []
-    for field_key, field_name in fields:
-        buttons.append([InlineKeyboardButton(text=field_name, callback_data=f"field_{field_key}")])
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
+    # Создатель и исполнитель нужны, чтобы после изменения сбросить их inline-результаты
+    await state.update_data(task_id=task_id, creator_id=creator_id, assignee_id=assignee_id)
     
     await state.set_state(UpdateTaskForm.waiting_for_field)
     await message.answer(
         f"Выберите поле для обновления для задачи '{task[1]}':", 
-        reply_markup=keyboard
+        reply_markup=FIELD_KEYBOARD
     )
 
-@dp.callback_query(lambda c: c.data.startswith('field_'), UpdateTaskForm.waiting_for_field)
-async def process_field_selection(callback: CallbackQuery, state: FSMContext) -> None:
+@dp.callback_query(FIELD_FILTER, StateFilter(UpdateTaskForm.waiting_for_field))
+async def process_field_selection(callback: CallbackQuery, callback_data: FieldCallback, state: FSMContext) -> None:
     """Обработка выбора поля для обновления"""
     await callback.answer()
-    field = callback.data.split('_')[1]
+    field = callback_data.field
     
     await state.update_data(field=field)
     
     if field == 'priority':
-        buttons = []
-        for priority in ["Низкий", "Средний", "Высокий"]:
-            buttons.append([InlineKeyboardButton(text=priority, callback_data=f"value_{priority}")])
-        
-        keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-        
         await state.set_state(UpdateTaskForm.waiting_for_new_value)
         await callback.message.answer(
             "Выберите новый приоритет:", 
-            reply_markup=keyboard
+            reply_markup=PRIORITY_KEYBOARD
         )
     else:
         await state.set_state(UpdateTaskForm.waiting_for_new_value)
@@ -597,56 +1113,53 @@ async def process_field_selection(callback: CallbackQuery, state: FSMContext) ->
             f"Введите новое {field_names.get(field, field)}:"
         )
 
-@dp.callback_query(lambda c: c.data.startswith('value_'), UpdateTaskForm.waiting_for_new_value)
-async def process_priority_value(callback: CallbackQuery, state: FSMContext) -> None:
+@dp.callback_query(PRIORITY_FILTER, StateFilter(UpdateTaskForm.waiting_for_new_value))
+async def process_priority_value(callback: CallbackQuery, callback_data: PriorityCallback, state: FSMContext) -> None:
     """Обработка выбора нового приоритета"""
     await callback.answer()
-    value = callback.data.split('_')[1]
+    value = PRIORITIES[callback_data.rank]
     
     data = await state.get_data()
     task_id = data['task_id']
     field = data['field']
     
-    update_task_field(task_id, field, value)
+    old_value = await db.update_task_field(task_id, field, value)
+    task_cards.invalidate(task_id)
+    user_id = await db.register_user(callback.from_user)
+    history.record(task_id, user_id, field, old_value, value)
+    inline_cache.invalidate(data.get('creator_id', user_id))
+    inline_cache.invalidate(data.get('assignee_id', user_id))
     
     await state.clear()
     await callback.message.answer(
         f"Приоритет задачи обновлен на: {value}"
     )
 
-@dp.message(UpdateTaskForm.waiting_for_new_value)
+@dp.message(StateFilter(UpdateTaskForm.waiting_for_new_value))
 async def process_new_value(message: Message, state: FSMContext) -> None:
     """Обработка ввода нового значения для поля задачи"""
     data = await state.get_data()
     task_id = data['task_id']
     field = data['field']
     value = message.text
+    user_id, timezone = await db.register_user_profile(message.from_user)
     
     if field == 'deadline':
         try:
-            deadline = datetime.datetime.strptime(value, '%Y-%m-%d %H:%M')
+            value = parse_deadline(value, timezone)
         except ValueError:
             await message.answer("Неверный формат даты. Пожалуйста, используйте формат ГГГГ-ММ-ДД ЧЧ:ММ")
             return
     
-    update_task_field(task_id, field, value)
+    old_value = await db.update_task_field(task_id, field, value)
+    task_cards.invalidate(task_id)
+    history.record(task_id, user_id, field, old_value, value)
+    inline_cache.invalidate(data.get('creator_id', user_id))
+    inline_cache.invalidate(data.get('assignee_id', user_id))
     
     # Если обновили дедлайн, обновляем напоминание
     if field == 'deadline':
-        scheduler_job_id = f"reminder_{task_id}"
-        if scheduler.get_job(scheduler_job_id):
-            scheduler.remove_job(scheduler_job_id)
-        
-        deadline = datetime.datetime.strptime(value, '%Y-%m-%d %H:%M')
-        reminder_time = deadline - datetime.timedelta(hours=24)  # Напоминание за 24 часа
-        
-        if reminder_time > datetime.datetime.now():
-            scheduler.add_job(
-                send_reminder,
-                trigger=DateTrigger(run_date=reminder_time),
-                args=[task_id],
-                id=scheduler_job_id
-            )
+        await schedule_reminder(task_id, value)
     
     await state.clear()
     field_names = {
@@ -656,40 +1169,483 @@ async def process_new_value(message: Message, state: FSMContext) -> None:
     }
     await message.answer(f"{field_names.get(field, field.capitalize())} задачи обновлено.")
 
+@dp.callback_query()
+async def process_stale_callback(callback: CallbackQuery) -> None:
+    """Кнопка, которой не подошел ни один обработчик: диалог уже завершен или кнопка из старой версии бота"""
+    await callback.answer("Кнопка устарела, повторите команду.")
+
+# Напоминания: таблица reminders - источник истины, в планировщике
+# держатся только задания ближайшего окна REMINDER_WINDOW
+reminders_loaded_until = datetime.datetime.min
+is_reminder_leader = False
+# Выполняющиеся задания планировщика: при остановке их дожидаются до закрытия базы
+running_jobs: set = set()
+
+def scheduler_job(func):
+    """Задание планировщика, которое stop_services дождется, а не оборвет"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        task = asyncio.current_task()
+        running_jobs.add(task)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            running_jobs.discard(task)
+    return wrapper
+
+def add_reminder_job(task_id: int, run_date: Optional[datetime.datetime] = None) -> None:
+    """Постановка задания напоминания в планировщик (без даты - немедленно)"""
+    scheduler.add_job(
+        send_reminder,
+        trigger=DateTrigger(run_date=run_date),
+        args=[task_id],
+        id=f"reminder_{task_id}",
+        replace_existing=True
+    )
+
+async def schedule_reminder(task_id: int, deadline: int) -> None:
+    """Сохранение напоминания за сутки до дедлайна (в секундах UTC); старое напоминание задачи заменяется"""
+    remind_at = deadline - int(REMINDER_BEFORE.total_seconds())
+    reminder_time = datetime.datetime.fromtimestamp(remind_at)
+    
+    if reminder_time <= datetime.datetime.now():
+        await cancel_reminder(task_id)
+        return
+    
+    await db.set_reminder(task_id, remind_at)
+    if REMINDER_MODE == 'jobs' and reminder_time <= reminders_loaded_until:
+        add_reminder_job(task_id, reminder_time)
+    else:
+        # Задание появится при загрузке окна, в которое попадет напоминание
+        scheduler_job_id = f"reminder_{task_id}"
+        if scheduler.get_job(scheduler_job_id):
+            scheduler.remove_job(scheduler_job_id)
+
+def add_imported_reminder_job(task_id: int, remind_at: int) -> None:
+    """Задание для напоминания, уже записанного в базу (импорт, повторения), если оно попадает в загруженное окно"""
+    reminder_time = datetime.datetime.fromtimestamp(remind_at)
+    if REMINDER_MODE == 'jobs' and reminder_time <= reminders_loaded_until:
+        add_reminder_job(task_id, reminder_time)
+
+async def cancel_reminder(task_id: int) -> None:
+    """Отмена напоминания о задаче"""
+    scheduler_job_id = f"reminder_{task_id}"
+    if scheduler.get_job(scheduler_job_id):
+        scheduler.remove_job(scheduler_job_id)
+    await db.delete_reminder(task_id)
+
+@scheduler_job
+async def load_reminders() -> None:
+    """Загрузка напоминаний ближайшего окна в планировщик одним индексным запросом
+    
+    Пропущенные напоминания (бот был остановлен) отправляются сразу, если дедлайн
+    еще не наступил; если дедлайн уже прошел, напоминание отмечается обработанным
+    без отправки.
+    """
+    global reminders_loaded_until
+    now = datetime.datetime.now()
+    until = now + REMINDER_WINDOW
+    
+    pending = await db.get_pending_reminders(int(until.timestamp()))
+    if not is_reminder_leader:
+        # Аренду потеряли, пока шел запрос
+        return
+    
+    skipped = []
+    for task_id, remind_at in pending:
+        run_date = datetime.datetime.fromtimestamp(remind_at)
+        if run_date > now:
+            add_reminder_job(task_id, run_date)
+        elif run_date + REMINDER_BEFORE > now:
+            add_reminder_job(task_id)
+        else:
+            skipped.append(task_id)
+    
+    if skipped:
+        await db.skip_reminders(skipped, int(now.timestamp()))
+        logger.info(f"Пропущено просроченных напоминаний: {len(skipped)}")
+    reminders_loaded_until = until
+
+def reminder_text(task_id: int, name: str, deadline: int, priority: str, project: str,
+                  timezone: Optional[str] = None) -> str:
+    """Текст напоминания о дедлайне задачи (дедлайн - в часовом поясе получателя)"""
+    return (
+        f"⚠️ Напоминание! ⚠️\n\n"
+        f"У задачи '{name}' (ID: {task_id}) дедлайн через 24 часа: {format_deadline(deadline, timezone)}\n\n"
+        f"Приоритет: {priority}\n"
+        f"Проект: {project}"
+    )
+
+@scheduler_job
 async def send_reminder(task_id: int) -> None:
     """Отправка напоминания о дедлайне задачи"""
-    task = get_task_by_id(task_id)
+    # Напоминание отмечается до отправки, чтобы не отправить его дважды
+    if not await db.claim_reminder(task_id, int(datetime.datetime.now().timestamp())):
+        return
+    
+    task = await db.get_task_by_id(task_id)
     if not task or task[6] == 'Выполнена':
         return
     
     task_id, name, description, project, priority, deadline, status, creator, assignee, creator_id, assignee_id = task
     
     if assignee_id:
-        conn = sqlite3.connect('tasks.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT telegram_id FROM users WHERE id = ?', (assignee_id,))
-        assignee_telegram_id = cursor.fetchone()[0]
-        conn.close()
+        assignee_telegram_id, assignee_timezone, digest_hour = await db.get_user_chat(assignee_id)
+        if digest_hour is not None:
+            # Задача попадет в ежедневную сводку исполнителя
+            return
         
-        await bot.send_message(
+        await outbox.send_message(
             assignee_telegram_id,
-            f"⚠️ Напоминание! ⚠️\n\n"
-            f"У задачи '{name}' (ID: {task_id}) дедлайн через 24 часа: {deadline}\n\n"
-            f"Приоритет: {priority}\n"
-            f"Проект: {project}"
+            reminder_text(task_id, name, deadline, priority, project, assignee_timezone)
         )
 
-# Функция для запуска бота
-async def main() -> None:
-    """Главная функция для запуска бота"""
-    # Инициализация БД
-    init_db()
+@scheduler_job
+async def sweep_reminders() -> None:
+    """Рассылка наступивших напоминаний пачками (режим REMINDER_MODE = 'sweeper')
+    
+    Напоминания отмечаются отправленными в той же транзакции, в которой выбираются,
+    поэтому следующий проход начинает с того места, где закончился предыдущий.
+    Правила те же, что у send_reminder, и для пропущенных напоминаний - те же, что у load_reminders.
+    """
+    now = int(datetime.datetime.now().timestamp())
+    while True:
+        batch = await db.claim_due_reminders(now, REMINDER_SWEEP_BATCH)
+        for task_id, remind_at, name, priority, deadline, project, status, assignee_telegram_id, timezone, \
+                digest_hour in batch:
+            if status == 'Выполнена' or not assignee_telegram_id or digest_hour is not None:
+                continue
+            if remind_at + REMINDER_BEFORE.total_seconds() <= now:
+                continue
+            await outbox.send_message(
+                assignee_telegram_id,
+                reminder_text(task_id, name, deadline, priority, project, timezone)
+            )
+        if len(batch) < REMINDER_SWEEP_BATCH:
+            break
+
+@scheduler_job
+async def send_digests() -> None:
+    """Рассылка наступивших ежедневных сводок пачками
+    
+    Задачи всех пользователей пачки собираются одним запросом, а сводка переносится
+    на следующий день в той же транзакции, поэтому каждая уходит один раз.
+    Пользователь без просроченных и близких задач сообщения не получает.
+    """
+    now = int(datetime.datetime.now().timestamp())
+    until = now + int(REMINDER_BEFORE.total_seconds())
+    while True:
+        batch = await db.claim_digests(now, until, DIGEST_BATCH, DIGEST_SECTION_SIZE,
+                                       lambda hour, timezone: next_digest_at(hour, timezone, now))
+        for telegram_id, timezone, tasks in batch:
+            if tasks:
+                await outbox.send_message(telegram_id, format_digest(tasks, timezone))
+        if len(batch) < DIGEST_BATCH:
+            break
+
+@scheduler_job
+async def materialize_recurrences() -> None:
+    """Создание повторений, дедлайн которых попадает в горизонт RECURRENCE_HORIZON, пачками шаблонов
+    
+    Задачи и их напоминания записываются вместе со сдвигом next_deadline шаблона
+    в одной транзакции, поэтому повторение не создается дважды.
+    """
+    now = int(datetime.datetime.now().timestamp())
+    until = now + int(RECURRENCE_HORIZON.total_seconds())
+    remind_before = int(REMINDER_BEFORE.total_seconds())
+    while True:
+        processed, created = await db.materialize_recurrences(until, now, remind_before, RECURRENCE_BATCH,
+                                                              next_deadline)
+        for task_id, deadline, remind_at in created:
+            if remind_at is not None:
+                add_imported_reminder_job(task_id, remind_at)
+        if processed < RECURRENCE_BATCH:
+            break
+
+@scheduler_job
+async def compact_history() -> None:
+    """Удаление событий истории задач старше HISTORY_RETENTION"""
+    before = int((datetime.datetime.now() - HISTORY_RETENTION).timestamp())
+    deleted = await history.compact(before)
+    if deleted:
+        logger.info(f"Удалено старых событий истории задач: {deleted}")
+
+def start_reminder_jobs() -> None:
+    """Запуск заданий рассылки напоминаний, ежедневных сводок, создания повторений и очистки истории"""
+    now = datetime.datetime.now()
+    scheduler.add_job(compact_history, trigger=IntervalTrigger(seconds=HISTORY_COMPACT_INTERVAL.total_seconds()),
+                      id="compact_history", next_run_time=now, replace_existing=True)
+    scheduler.add_job(materialize_recurrences, trigger=IntervalTrigger(seconds=REMINDER_WINDOW.total_seconds()),
+                      id="materialize_recurrences", next_run_time=now, replace_existing=True)
+    scheduler.add_job(send_digests, trigger=IntervalTrigger(seconds=DIGEST_CHECK_INTERVAL),
+                      id="send_digests", next_run_time=now, replace_existing=True)
+    if REMINDER_MODE == 'sweeper':
+        scheduler.add_job(sweep_reminders, trigger=IntervalTrigger(seconds=REMINDER_SWEEP_INTERVAL),
+                          id="sweep_reminders", next_run_time=now, replace_existing=True)
+    else:
+        scheduler.add_job(load_reminders, trigger=IntervalTrigger(seconds=REMINDER_WINDOW.total_seconds()),
+                          id="load_reminders", next_run_time=now, replace_existing=True)
+
+def stop_reminder_jobs() -> None:
+    """Снятие всех заданий напоминаний: рассылкой займется другой процесс"""
+    global reminders_loaded_until
+    reminders_loaded_until = datetime.datetime.min
+    for job in scheduler.get_jobs():
+        if job.id in ("sweep_reminders", "load_reminders", "send_digests", "materialize_recurrences",
+                      "compact_history") or job.id.startswith("reminder_"):
+            job.remove()
+
+@scheduler_job
+async def elect_reminder_leader() -> None:
+    """Захват или продление аренды ведущего по напоминаниям
+    
+    Задания напоминаний работают только в процессе, владеющем арендой. Если
+    аренда на короткое время окажется у двух процессов, напоминание все равно
+    уйдет один раз: его отправляет тот, кто первым отметит его в базе.
+    """
+    global is_reminder_leader
+    now = int(datetime.datetime.now().timestamp())
+    try:
+        leader = await db.acquire_lease("reminders", WORKER_ID, now, REMINDER_LEASE_SECONDS)
+    except Exception:
+        # Не смогли продлить аренду - считаем, что она может перейти к другому процессу
+        logger.exception("Ошибка продления аренды напоминаний")
+        leader = False
+    
+    was_leader, is_reminder_leader = is_reminder_leader, leader
+    if leader and not was_leader:
+        logger.info(f"Процесс {WORKER_ID} рассылает напоминания")
+        start_reminder_jobs()
+    elif was_leader and not leader:
+        logger.warning(f"Процесс {WORKER_ID} потерял аренду напоминаний")
+        stop_reminder_jobs()
+
+# Режим webhook
+def create_webhook_app(max_concurrency: int = WEBHOOK_MAX_CONCURRENCY) -> web.Application:
+    """aiohttp-приложение, принимающее обновления Telegram на WEBHOOK_PATH
+    
+    Обновление подтверждается сразу, а обрабатывается в фоне; одновременно
+    обрабатывается не больше max_concurrency обновлений. Когда все слоты заняты,
+    ответ Telegram задерживается, и он сам снижает темп отправки.
+    """
+    slots = asyncio.Semaphore(max_concurrency)
+    pending = set()
+    
+    async def process_update(update: Dict[str, Any]) -> None:
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception:
+            logger.exception("Ошибка обработки обновления")
+        finally:
+            slots.release()
+    
+    async def handle_update(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        update = await request.json()
+        await slots.acquire()
+        task = asyncio.create_task(process_update(update))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+        return web.Response()
+    
+    async def finish_pending(app: web.Application) -> None:
+        await asyncio.gather(*pending, return_exceptions=True)
+    
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    app.on_shutdown.append(finish_pending)
+    return app
+
+async def run_webhook(host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT, register: bool = True,
+                      stop: Optional[asyncio.Future] = None) -> None:
+    """Запуск aiohttp-сервера и регистрация webhook в Telegram (register=False - без регистрации)"""
+    runner = web.AppRunner(create_webhook_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    if register:
+        await bot.set_webhook(
+            WEBHOOK_URL + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+    await dp.emit_startup(bot=bot)
+    logger.info(f"Webhook слушает {host}:{port}{WEBHOOK_PATH}")
+    try:
+        # Работаем до остановки процесса (или до сигнала stop)
+        await (stop if stop is not None else asyncio.Event().wait())
+    finally:
+        await runner.cleanup()
+        await dp.emit_shutdown(bot=bot)
+
+# Несколько процессов-воркеров
+def update_partition_key(update: Dict[str, Any]) -> int:
+    """Ключ распределения обновления: id чата, а для событий без чата - id пользователя
+    
+    Все обновления одного чата попадают в один процесс, поэтому состояние
+    диалога и порядок сообщений в чате остаются согласованными.
+    """
+    for event in update.values():
+        if isinstance(event, dict):
+            chat = event.get('chat') or (event.get('message') or {}).get('chat')
+            if chat:
+                return chat['id']
+            if 'from' in event:
+                return event['from']['id']
+    return 0
+
+def create_router_app(worker_urls: List[str]) -> web.Application:
+    """aiohttp-приложение, пересылающее обновления Telegram воркеру по id чата
+    
+    Ответ воркера возвращается Telegram как есть: если воркер перегружен или
+    недоступен, Telegram повторит доставку позже.
+    """
+    app = web.Application()
+    headers = {"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET} if WEBHOOK_SECRET else {}
+    
+    async def route_update(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        body = await request.read()
+        worker_url = worker_urls[update_partition_key(json.loads(body)) % len(worker_urls)]
+        try:
+            async with app['client'].post(worker_url, data=body, headers=headers) as response:
+                return web.Response(status=response.status)
+        except aiohttp.ClientError:
+            logger.warning(f"Воркер {worker_url} недоступен")
+            return web.Response(status=502)
+    
+    async def open_client(app: web.Application) -> None:
+        app['client'] = aiohttp.ClientSession(
+            headers={"Content-Type": "application/json"},
+            connector=aiohttp.TCPConnector(limit=0)
+        )
+    
+    async def close_client(app: web.Application) -> None:
+        await app['client'].close()
     
-    # Запуск планировщика
+    app.router.add_post(WEBHOOK_PATH, route_update)
+    app.on_startup.append(open_client)
+    app.on_cleanup.append(close_client)
+    return app
+
+def run_worker(index: int, stop_event) -> None:
+    """Точка входа процесса-воркера: webhook без регистрации на локальном порту"""
+    asyncio.run(main(worker=index, stop_event=stop_event))
+
+async def run_router() -> None:
+    """Запуск воркеров и принимающего обновления процесса; упавший воркер перезапускается"""
+    context = multiprocessing.get_context('spawn')
+    stop_event = context.Event()
+    
+    def start_worker(index: int):
+        process = context.Process(target=run_worker, args=(index, stop_event),
+                                  name=f"bot-worker-{index}", daemon=True)
+        process.start()
+        return process
+    
+    workers = [start_worker(n) for n in range(WEBHOOK_WORKERS)]
+    worker_urls = [f"http://127.0.0.1:{WEBHOOK_WORKER_PORT + n}{WEBHOOK_PATH}" for n in range(WEBHOOK_WORKERS)]
+    
+    runner = web.AppRunner(create_router_app(worker_urls))
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    # Список типов обновлений берется у диспетчера: обработчики во всех процессах одинаковые
+    await bot.set_webhook(
+        WEBHOOK_URL + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET or None,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    logger.info(f"Webhook слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}, воркеров: {WEBHOOK_WORKERS}")
+    try:
+        while True:
+            await asyncio.sleep(5)
+            for n, process in enumerate(workers):
+                if not process.is_alive():
+                    logger.error(f"Воркер {n} завершился с кодом {process.exitcode}, перезапуск")
+                    workers[n] = start_worker(n)
+    finally:
+        await runner.cleanup()
+        stop_event.set()
+        loop = asyncio.get_running_loop()
+        for process in workers:
+            await loop.run_in_executor(None, process.join, 30)
+            if process.is_alive():
+                process.terminate()
+        await bot.session.close()
+
+async def start_services(metrics_port: int = METRICS_PORT) -> None:
+    """Подключение к базе и запуск фоновых служб процесса: FSM, очередь отправки, планировщик, метрики"""
+    global metrics_server
+    await db.connect()
+    await db.init_db()
+    await db.warm_user_cache()
+    await history.start()
+    if isinstance(storage, SQLiteStorage):
+        storage.start()
+    
+    # Запуск очереди исходящих сообщений
+    outbox.start()
+    
+    # Запуск планировщика; задания напоминаний появятся, если процесс получит аренду
     scheduler.start()
+    scheduler.add_job(elect_reminder_leader, trigger=IntervalTrigger(seconds=REMINDER_LEASE_SECONDS / 3),
+                      id="elect_reminder_leader", next_run_time=datetime.datetime.now())
+    
+    if metrics_port:
+        metrics_server = await start_metrics_server(metrics, METRICS_HOST, metrics_port)
+        logger.info(f"Метрики: http://{METRICS_HOST}:{metrics_port}/metrics")
+
+async def stop_services() -> None:
+    """Остановка фоновых служб и закрытие базы"""
+    global metrics_server
+    if metrics_server is not None:
+        await metrics_server.cleanup()
+        metrics_server = None
+    # Сначала снимаются все задания, затем дожидаемся уже запущенных: выборы ведущего, закончившиеся
+    # после release_lease, вернули бы аренду (следующий ведущий ждал бы ее истечения), а рассылки
+    # обращались бы к закрытой базе. sleep(0) дает стартовать заданиям, запущенным перед снятием
+    scheduler.remove_all_jobs()
+    await asyncio.sleep(0)
+    while running_jobs:
+        await asyncio.gather(*running_jobs, return_exceptions=True)
+    scheduler.shutdown(wait=False)
+    if is_reminder_leader:
+        await db.release_lease("reminders", WORKER_ID)
+    await outbox.stop()
+    logger.info(f"Кэш пользователей: {db.users.stats()}")
+    logger.info(f"Кэш карточек задач: {task_cards.stats()}")
+    logger.info(f"Кэш inline-запросов: {inline_cache.stats()}")
+    # Последние события истории записываются до закрытия базы (или сохраняются в файл)
+    await history.close()
+    await db.close()
+
+# Функция для запуска бота
+async def main(worker: Optional[int] = None, stop_event=None) -> None:
+    """Главная функция для запуска бота (worker - номер процесса-воркера)"""
+    if worker is None and RUN_MODE == 'webhook' and WEBHOOK_WORKERS > 1:
+        if getattr(config, 'REMINDER_MODE', 'jobs') != REMINDER_MODE:
+            logger.warning(f"При WEBHOOK_WORKERS > 1 используется REMINDER_MODE = '{REMINDER_MODE}'")
+        await run_router()
+        return
+    
+    await start_services(METRICS_PORT + worker + 1 if METRICS_PORT and worker is not None else METRICS_PORT)
     
     # Запуск бота
-    await dp.start_polling(bot)
+    try:
+        if worker is not None:
+            stop = asyncio.get_running_loop().run_in_executor(None, stop_event.wait)
+            await run_webhook('127.0.0.1', WEBHOOK_WORKER_PORT + worker, register=False, stop=stop)
+        elif RUN_MODE == 'webhook':
+            await run_webhook()
+        else:
+            # Long polling получает обновления только в одном процессе
+            await bot.delete_webhook()
+            await dp.start_polling(bot, close_bot_session=False)
+    finally:
+        await stop_services()
+        # Сессия закрывается последней: очередь отправки дописывает сообщения через нее
+        await bot.session.close()
     
 if __name__ == '__main__':
     asyncio.run(main())
\ No newline at end of file
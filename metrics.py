@@ -0,0 +1,222 @@
+import asyncio
+import bisect
+import inspect
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Sequence, Tuple, Union
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.types import TelegramObject, Update
+
+# Границы корзин гистограмм задержки, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+# Значение датчика: число без меток или {значения меток: число}
+GaugeValue = Union[float, Dict[Labels, float]]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def _format_number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Счетчик, который только растет"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels, labels)} {_format_number(value)}"
+                for labels, value in sorted(self._values.items())]
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами: количество, сумма и накопленные счетчики корзин"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # метки -> [счетчики корзин (последняя - +Inf), сумма]
+        self._series: Dict[Labels, List] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def samples(self) -> List[str]:
+        lines = []
+        names = self.labels + ('le',)
+        for labels, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(names, labels + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {total!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Датчик, значение которого вычисляется функцией в момент чтения метрик"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str,
+                 collect: Callable[[], Union[GaugeValue, Awaitable[GaugeValue]]], labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.collect = collect
+        self._values: Dict[Labels, float] = {}
+
+    async def update(self) -> None:
+        value = self.collect()
+        if inspect.isawaitable(value):
+            value = await value
+        self._values = value if isinstance(value, dict) else {(): value}
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels, labels)} {_format_number(value)}"
+                for labels, value in sorted(self._values.items())]
+
+
+class MetricsRegistry:
+    """Метрики процесса бота в текстовом формате Prometheus
+
+    Счетчики и гистограммы меняются только из цикла событий, поэтому
+    обходятся без блокировок; датчики опрашиваются при каждом чтении.
+    """
+
+    def __init__(self, prefix: str = 'taskbot') -> None:
+        self.prefix = prefix
+        self._metrics: Dict[str, Any] = {}
+
+    def _add(self, metric: Any) -> Any:
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(f"{self.prefix}_{name}", documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(f"{self.prefix}_{name}", documentation, labels, buckets))
+
+    def gauge(self, name: str, documentation: str, collect: Callable, labels: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(f"{self.prefix}_{name}", documentation, collect, labels))
+
+    async def render(self) -> str:
+        """Все метрики в формате text/plain; version=0.0.4"""
+        gauges = [metric for metric in self._metrics.values() if isinstance(metric, Gauge)]
+        await asyncio.gather(*(gauge.update() for gauge in gauges))
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware dp.update: время обработки обновления по типу (message, callback_query, ...)
+
+    Результат: handled - обработчик нашелся, unhandled - нет, error - исключение.
+    """
+
+    def __init__(self, registry: MetricsRegistry) -> None:
+        self.latency = registry.histogram('update_seconds', 'Время обработки обновления', ('type', 'result'))
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        update_type = event.event_type if isinstance(event, Update) else type(event).__name__
+        started = time.perf_counter()
+        result = 'error'
+        try:
+            response = await handler(event, data)
+            result = 'unhandled' if response is UNHANDLED else 'handled'
+            return response
+        finally:
+            self.latency.observe(time.perf_counter() - started, update_type, result)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware наблюдателей событий: время работы каждого обработчика и число ошибок"""
+
+    def __init__(self, registry: MetricsRegistry) -> None:
+        self.latency = registry.histogram('handler_seconds', 'Время работы обработчика', ('handler',))
+        self.errors = registry.counter('handler_errors_total', 'Исключения в обработчиках', ('handler',))
+
+    def setup(self, dispatcher: Any) -> None:
+        """Подключение ко всем наблюдателям событий диспетчера, кроме update и error"""
+        for name, observer in dispatcher.observers.items():
+            if name not in ('update', 'error'):
+                observer.middleware(self)
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        handler_object = data.get('handler')
+        name = getattr(getattr(handler_object, 'callback', None), '__name__', 'unknown')
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.errors.inc(name)
+            raise
+        finally:
+            self.latency.observe(time.perf_counter() - started, name)
+
+
+def create_metrics_app(registry: MetricsRegistry) -> web.Application:
+    """aiohttp-приложение с единственным маршрутом GET /metrics"""
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=await registry.render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    return app
+
+
+async def start_metrics_server(registry: MetricsRegistry, host: str, port: int) -> web.AppRunner:
+    """Запуск HTTP-сервера метрик; остановка - await runner.cleanup()"""
+    runner = web.AppRunner(create_metrics_app(registry), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,112 @@
+import calendar
+import datetime
+import re
+from typing import Optional
+
+from render import get_timezone
+
+# Правило повторения хранится в recurrences.rule строкой:
+# 'daily', 'weekly', 'monthly', 'days:N' (каждые N дней) или 'weekdays:0,2,4' (дни недели, 0 - понедельник)
+WEEKDAYS = ('пн', 'вт', 'ср', 'чт', 'пт', 'сб', 'вс')
+_WEEKDAYS_EN = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+_RULES = {
+    'ежедневно': 'daily',
+    'каждый день': 'daily',
+    'daily': 'daily',
+    'еженедельно': 'weekly',
+    'каждую неделю': 'weekly',
+    'weekly': 'weekly',
+    'ежемесячно': 'monthly',
+    'каждый месяц': 'monthly',
+    'monthly': 'monthly',
+    'по будням': 'weekdays:0,1,2,3,4',
+    'будни': 'weekdays:0,1,2,3,4',
+    'weekdays': 'weekdays:0,1,2,3,4',
+}
+
+RULE_HELP = (
+    "ежедневно, еженедельно, ежемесячно, по будням, каждые N дней (недель) "
+    "или дни недели через запятую (пн,ср,пт)"
+)
+
+
+def parse_rule(text: str) -> str:
+    """Правило повторения из текста пользователя; ValueError, если его не удалось разобрать"""
+    text = ' '.join(text.lower().replace('ё', 'е').split())
+    if text in _RULES:
+        return _RULES[text]
+
+    match = re.fullmatch(r'(?:каждые|every)\s+(\d+)(?:\s+(\w+))?', text)
+    if match:
+        days, unit = int(match.group(1)), match.group(2)
+        # Единица после числа - дни или недели; месяцы и прочее не угадываем, а отклоняем
+        if unit is not None and re.fullmatch(r'недел[июь]|weeks?', unit):
+            days *= 7
+        elif unit is not None and not re.fullmatch(r'день|дн[яейи]*|days?', unit):
+            raise ValueError(f"Не понимаю правило повторения: {text}")
+        if not 1 <= days <= 365:
+            raise ValueError("Интервал повторения - от 1 до 365 дней")
+        return 'daily' if days == 1 else f'days:{days}'
+
+    names = [name for name in re.split(r'[,\s]+', text) if name]
+    days = set()
+    for name in names:
+        if name in WEEKDAYS:
+            days.add(WEEKDAYS.index(name))
+        elif name in _WEEKDAYS_EN:
+            days.add(_WEEKDAYS_EN.index(name))
+        else:
+            raise ValueError(f"Не понимаю правило повторения: {text}")
+    if not days:
+        raise ValueError("Укажите правило повторения")
+    return 'weekdays:' + ','.join(map(str, sorted(days)))
+
+
+def describe_rule(rule: str) -> str:
+    """Правило повторения словами"""
+    if rule == 'daily':
+        return "каждый день"
+    if rule == 'weekly':
+        return "каждую неделю"
+    if rule == 'monthly':
+        return "каждый месяц"
+    kind, _, value = rule.partition(':')
+    if kind == 'days':
+        return f"каждые {value} дн."
+    days = [int(day) for day in value.split(',')]
+    if days == [0, 1, 2, 3, 4]:
+        return "по будням"
+    return "по дням: " + ", ".join(WEEKDAYS[day] for day in days)
+
+
+def _next_date(rule: str, day: datetime.date, anchor: datetime.date) -> datetime.date:
+    if rule == 'daily':
+        return day + datetime.timedelta(days=1)
+    if rule == 'weekly':
+        return day + datetime.timedelta(days=7)
+    if rule == 'monthly':
+        # День месяца берется из первого дедлайна: 31-е в коротких месяцах становится последним днем
+        year, month = (day.year + 1, 1) if day.month == 12 else (day.year, day.month + 1)
+        return datetime.date(year, month, min(anchor.day, calendar.monthrange(year, month)[1]))
+    kind, _, value = rule.partition(':')
+    if kind == 'days':
+        return day + datetime.timedelta(days=int(value))
+    weekdays = {int(weekday) for weekday in value.split(',')}
+    for offset in range(1, 8):
+        candidate = day + datetime.timedelta(days=offset)
+        if candidate.weekday() in weekdays:
+            return candidate
+    raise ValueError(f"Неверное правило повторения: {rule}")
+
+
+def next_deadline(rule: str, deadline: int, anchor: int, timezone: Optional[str] = None) -> int:
+    """Дедлайн следующего повторения после deadline (секунды UTC)
+
+    Время суток и день месяца берутся из первого дедлайна anchor в часовом поясе
+    создателя, поэтому повторения не сдвигаются при переходе на летнее время.
+    """
+    tz = get_timezone(timezone)
+    first = datetime.datetime.fromtimestamp(anchor, tz)
+    day = _next_date(rule, datetime.datetime.fromtimestamp(deadline, tz).date(), first.date())
+    return int(datetime.datetime.combine(day, first.time(), tzinfo=tz).timestamp())
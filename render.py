@@ -0,0 +1,240 @@
+import datetime
+import functools
+import time
+import zoneinfo
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from db import PRIORITIES, STATUS_ACTIVE
+
+# Формат, в котором пользователь вводит и видит дедлайн
+DEADLINE_FORMAT = '%Y-%m-%d %H:%M'
+
+# Эмодзи приоритетов в карточках задач
+PRIORITY_EMOJI = {
+    "Низкий": "🟢",
+    "Средний": "🟡",
+    "Высокий": "🔴"
+}
+
+
+@functools.lru_cache(maxsize=None)
+def get_timezone(name: Optional[str]) -> Optional[datetime.tzinfo]:
+    """Часовой пояс по имени IANA (например, Europe/Moscow); None - локальное время сервера
+
+    Неизвестное имя - ValueError.
+    """
+    if not name:
+        return None
+    try:
+        return zoneinfo.ZoneInfo(name)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Неизвестный часовой пояс: {name}")
+
+
+def parse_deadline(text: str, timezone: Optional[str] = None) -> int:
+    """Дедлайн, введенный пользователем в его часовом поясе, в секундах UTC; ValueError при неверном формате"""
+    moment = datetime.datetime.strptime(text.strip(), DEADLINE_FORMAT)
+    tz = get_timezone(timezone)
+    if tz is not None:
+        moment = moment.replace(tzinfo=tz)
+    return int(moment.timestamp())
+
+
+def format_deadline(deadline: int, timezone: Optional[str] = None) -> str:
+    """Дедлайн в секундах UTC в виде ГГГГ-ММ-ДД ЧЧ:ММ в часовом поясе пользователя"""
+    return datetime.datetime.fromtimestamp(deadline, get_timezone(timezone)).strftime(DEADLINE_FORMAT)
+
+
+def next_digest_at(hour: int, timezone: Optional[str], now: int) -> int:
+    """Ближайшие hour:00 в часовом поясе пользователя после момента now, в секундах UTC"""
+    tz = get_timezone(timezone)
+    day = datetime.datetime.fromtimestamp(now, tz).date()
+    moment = datetime.datetime.combine(day, datetime.time(hour), tzinfo=tz)
+    if moment.timestamp() <= now:
+        moment = datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time(hour), tzinfo=tz)
+    return int(moment.timestamp())
+
+
+def format_digest(tasks: Iterable[Tuple], timezone: Optional[str] = None) -> str:
+    """Ежедневная сводка: просроченные задачи и задачи со сроком в ближайшие 24 часа
+
+    tasks - строки Database.claim_digests: (overdue, total, task_id, name, priority, deadline, project).
+    """
+    sections = {1: [], 0: []}
+    totals = {1: 0, 0: 0}
+    for overdue, total, task_id, name, priority, deadline, project in tasks:
+        totals[overdue] = total
+        sections[overdue].append(
+            f"{PRIORITY_EMOJI.get(priority, '⚪')} {name} (ID: {task_id}) - {format_deadline(deadline, timezone)}"
+            + (f", {project}" if project else "")
+        )
+
+    lines = ["📋 Ежедневная сводка задач"]
+    for overdue, title in ((1, "🔥 Просрочено"), (0, "⏰ Срок в ближайшие 24 часа")):
+        if not sections[overdue]:
+            continue
+        lines += ["", f"{title}: {totals[overdue]}"]
+        lines += sections[overdue]
+        if totals[overdue] > len(sections[overdue]):
+            lines.append(f"... и еще {totals[overdue] - len(sections[overdue])}")
+    lines += ["", "Все задачи - в /due, /overdue и /list_tasks."]
+    return "\n".join(lines)
+
+
+def format_project_stats(name: str, counts: Iterable[Tuple], workload: Iterable[Tuple[str, int, int]]) -> str:
+    """Сводка по проекту для /project_stats
+
+    counts - строки Database.get_project_stats, workload - [(имя исполнителя, активных, просрочено)].
+    """
+    active = completed = overdue = 0
+    by_priority: Dict[int, List[int]] = {}
+    for status_rank, priority_rank, tasks, late in counts:
+        if status_rank == 0:
+            active += tasks
+            overdue += late
+            totals = by_priority.setdefault(priority_rank, [0, 0])
+            totals[0] += tasks
+            totals[1] += late
+        else:
+            completed += tasks
+
+    lines = [
+        f"📊 Проект «{name}»",
+        "",
+        f"Активных: {active}" + (f" (просрочено: {overdue})" if overdue else ""),
+        f"Выполненных: {completed}",
+    ]
+    if by_priority:
+        lines += ["", "По приоритетам (активные):"]
+        for priority_rank in sorted(by_priority, key=lambda rank: (rank < 0, rank)):
+            tasks, late = by_priority[priority_rank]
+            priority = PRIORITIES[priority_rank] if 0 <= priority_rank < len(PRIORITIES) else "Без приоритета"
+            lines.append(f"{PRIORITY_EMOJI.get(priority, '⚪')} {priority}: {tasks}"
+                         + (f" (просрочено: {late})" if late else ""))
+    workload = list(workload)
+    if workload:
+        lines += ["", "Загрузка исполнителей (активные):"]
+        for assignee, tasks, late in workload:
+            lines.append(f"👤 {assignee}: {tasks}" + (f" (просрочено: {late})" if late else ""))
+    return "\n".join(lines)
+
+
+# Названия полей в истории изменений и длина, до которой сокращаются длинные значения
+HISTORY_FIELDS = {
+    'name': "название",
+    'description': "описание",
+    'priority': "приоритет",
+    'deadline': "дедлайн",
+    'status': "статус",
+}
+HISTORY_VALUE_LENGTH = 60
+
+
+def _history_value(kind: str, value, timezone: Optional[str]) -> str:
+    if value is None or value == '':
+        return "—"
+    if kind == 'deadline':
+        return format_deadline(value, timezone)
+    text = str(value)
+    return text if len(text) <= HISTORY_VALUE_LENGTH else text[:HISTORY_VALUE_LENGTH - 1] + "…"
+
+
+def format_history(name: str, events: Iterable[Tuple], timezone: Optional[str] = None) -> str:
+    """История изменений задачи для /history
+
+    events - строки Database.get_task_events: (kind, old_value, new_value, created_at, автор), новые первыми.
+    """
+    lines = [f"🕓 История задачи «{name}»", ""]
+    for kind, old_value, new_value, created_at, author in events:
+        if kind == 'created':
+            change = "создана" + (" импортом из файла" if new_value == 'import' else "")
+        else:
+            change = (f"{HISTORY_FIELDS.get(kind, kind)}: {_history_value(kind, old_value, timezone)} → "
+                      f"{_history_value(kind, new_value, timezone)}")
+        lines.append(f"{format_deadline(created_at, timezone)} {author or 'неизвестный'}: {change}")
+    if len(lines) == 2:
+        lines.append("Изменений пока нет.")
+    return "\n".join(lines)
+
+
+def deadline_mark(deadline: int, now: int) -> str:
+    """Пометка дедлайна относительно текущего момента (оба - секунды UTC)"""
+    days_left = (deadline - now) // 86400
+    if days_left < 0:
+        return " (просрочено!)"
+    if days_left == 0:
+        return " (сегодня!)"
+    return ""
+
+
+class TaskCards:
+    """Карточки задач для списков с LRU-кэшем неизменной части
+
+    Запись кэша привязана к id задачи и годится, пока у строки та же версия
+    (tasks.version растет при каждом изменении задачи), те же имена проекта,
+    создателя и исполнителя и тот же часовой пояс зрителя. При каждом показе
+    заново вычисляется только пометка «просрочено!» / «сегодня!» у дедлайна -
+    целочисленным сравнением, без разбора дат.
+    """
+
+    def __init__(self, maxsize: int = 10000) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        # task_id -> (отметка версии, начало карточки, строка дедлайна, дедлайн, конец карточки)
+        self._entries: 'OrderedDict[int, Tuple]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def invalidate(self, task_id: int) -> None:
+        """Удаление карточки задачи из кэша после ее изменения"""
+        self._entries.pop(task_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики попаданий и промахов кэша"""
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+    def _entry(self, task: Tuple, timezone: Optional[str]) -> Tuple:
+        task_id, name, description, project, priority, deadline, status, creator, assignee, version = task
+        stamp = (version, status, project, creator, assignee, timezone)
+        entry = self._entries.get(task_id)
+        if entry is not None and entry[0] == stamp:
+            self.hits += 1
+            self._entries.move_to_end(task_id)
+            return entry
+
+        self.misses += 1
+        lines = [
+            f"ID: {task_id}",
+            f"📌 {name}",
+            f"📝 {description[:50]}..." if len(description) > 50 else f"📝 {description}",
+            f"📁 Проект: {project}",
+        ]
+        people = f"👤 Создатель: {creator}\n👥 Исполнитель: {assignee}\n\n"
+        deadline_line: Optional[str] = None
+        if status == STATUS_ACTIVE:
+            lines.append(f"{PRIORITY_EMOJI.get(priority, '')} Приоритет: {priority}")
+            if deadline is not None:
+                deadline_line = f"⏰ Дедлайн: {format_deadline(deadline, timezone)}"
+        entry = (stamp, "\n".join(lines) + "\n", deadline_line, deadline, people)
+
+        self._entries[task_id] = entry
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return entry
+
+    def render(self, task: Tuple, timezone: Optional[str] = None, now: Optional[int] = None) -> str:
+        """Карточка задачи (строка из get_user_tasks); для активной - с дедлайном и приоритетом"""
+        _, head, deadline_line, deadline, people = self._entry(task, timezone)
+        if deadline_line is None:
+            return head + people
+        if now is None:
+            now = int(time.time())
+        return f"{head}{deadline_line}{deadline_mark(deadline, now)}\n{people}"
+
+    def render_list(self, tasks: Iterable[Tuple], timezone: Optional[str] = None) -> str:
+        """Карточки страницы списка; текущее время берется один раз на страницу"""
+        now = int(time.time())
+        return "".join(self.render(task, timezone, now) for task in tasks)
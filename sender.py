@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from aiogram.exceptions import (
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Ограничитель частоты: не больше rate токенов в секунду, запас до capacity (по умолчанию без всплесков)"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else 1
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+    def block(self, seconds: float) -> None:
+        """Полная пауза выдачи токенов (например, после RetryAfter от Telegram)"""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self) -> None:
+        """Ожидание свободного токена"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class OutboundQueue:
+    """Очередь исходящих сообщений бота
+
+    Сообщения отправляются фиксированным числом воркеров с общим ограничением
+    частоты и ограничением на каждый чат; при RetryAfter и сетевых ошибках
+    отправка повторяется с паузой.
+    """
+
+    def __init__(self, bot: Any, global_rate: float = 30, per_chat_rate: float = 1,
+                 concurrency: int = 8, max_retries: int = 5, max_size: int = 10000) -> None:
+        self.bot = bot
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.chat_interval = 1 / per_chat_rate
+        self.bucket = TokenBucket(global_rate)
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.max_size = max_size
+        # Очередь создается в start(), внутри работающего цикла событий
+        self._queue: Optional['asyncio.Queue[Dict[str, Any]]'] = None
+        self._chat_next: Dict[int, float] = {}
+        self._workers: List[asyncio.Task] = []
+
+    def __len__(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self) -> None:
+        """Запуск воркеров отправки"""
+        self._queue = asyncio.Queue(self.max_size)
+        for n in range(self.concurrency):
+            self._workers.append(asyncio.create_task(self._worker(), name=f"outbox-{n}"))
+
+    async def stop(self, timeout: float = 10) -> None:
+        """Остановка воркеров; уже поставленные сообщения отправляются, пока не истечет timeout"""
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не отправлено сообщений при остановке: {self._queue.qsize()}")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+
+    async def join(self) -> None:
+        """Ожидание отправки всех поставленных сообщений"""
+        await self._queue.join()
+
+    async def send_message(self, chat_id: int, text: str, **kwargs) -> None:
+        """Постановка сообщения в очередь (ждет только при переполнении очереди)"""
+        await self._queue.put({'chat_id': chat_id, 'text': text, **kwargs})
+
+    def _reserve_chat_slot(self, chat_id: int) -> float:
+        """Резервирование ближайшего разрешенного для чата момента отправки, возвращает ожидание"""
+        now = time.monotonic()
+        slot = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = slot + self.chat_interval
+        if len(self._chat_next) > 10000:
+            # Чаты, в которые давно не писали, больше не ограничены
+            self._chat_next = {chat: t for chat, t in self._chat_next.items() if t > now}
+        return slot - now
+
+    async def _worker(self) -> None:
+        while True:
+            message = await self._queue.get()
+            try:
+                await self._deliver(message)
+            except Exception:
+                self.failed += 1
+                logger.exception(f"Не удалось отправить сообщение в чат {message['chat_id']}")
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, message: Dict[str, Any]) -> None:
+        for attempt in range(self.max_retries + 1):
+            wait = self._reserve_chat_slot(message['chat_id'])
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(**message)
+                self.sent += 1
+                return
+            except TelegramRetryAfter as e:
+                # Ограничение Telegram действует на весь бот, поэтому пауза общая
+                self.bucket.block(e.retry_after)
+                delay = e.retry_after
+            except TelegramForbiddenError:
+                self.failed += 1
+                logger.info(f"Пользователь {message['chat_id']} заблокировал бота, сообщение отброшено")
+                return
+            except (TelegramNetworkError, TelegramServerError):
+                delay = min(2 ** attempt, 60)
+            if attempt < self.max_retries:
+                self.retried += 1
+                await asyncio.sleep(delay)
+        self.failed += 1
+        logger.error(f"Сообщение в чат {message['chat_id']} не отправлено после {self.max_retries} повторов")
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+
+from db import Database
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    """Состояние одного диалога в памяти"""
+
+    __slots__ = ('state', 'data', 'updated_at', 'accessed_at')
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any], updated_at: float) -> None:
+        self.state = state
+        self.data = data
+        self.updated_at = updated_at
+        self.accessed_at = time.monotonic()
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище FSM в таблице fsm_states базы SQLite
+
+    Чтение идет из кэша в памяти, изменения (set_state, set_data, update_data)
+    копятся и раз в flush_interval секунд записываются одной транзакцией.
+    Диалоги, не менявшиеся дольше ttl секунд, удаляются.
+    """
+
+    def __init__(self, db: Database, ttl: float = 24 * 3600, flush_interval: float = 1.0,
+                 idle_cache_time: float = 300) -> None:
+        self.db = db
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.idle_cache_time = idle_cache_time
+        self._cache: Dict[str, _Entry] = {}
+        self._dirty: set = set()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ':'.join(str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id,
+            getattr(key, 'business_connection_id', None), key.destiny,
+        ))
+
+    def start(self) -> None:
+        """Запуск фоновой записи изменений и удаления устаревших диалогов"""
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self) -> None:
+        expire_every = max(1, int(60 / self.flush_interval))
+        ticks = 0
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            ticks += 1
+            try:
+                await self.flush()
+                if ticks % expire_every == 0:
+                    await self.expire()
+            except Exception:
+                logger.exception("Ошибка записи состояний FSM")
+
+    async def flush(self) -> None:
+        """Запись накопленных изменений одной транзакцией"""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        upserts, deletes = [], []
+        for key in dirty:
+            entry = self._cache.get(key)
+            if entry is None or (entry.state is None and not entry.data):
+                deletes.append(key)
+            else:
+                upserts.append((key, entry.state, json.dumps(entry.data, ensure_ascii=False), int(entry.updated_at)))
+        try:
+            await self.db.save_fsm_states(upserts, deletes)
+        except Exception:
+            # Не записанные изменения попробуем записать при следующем сбросе
+            self._dirty |= dirty
+            raise
+
+    async def expire(self) -> None:
+        """Удаление устаревших диалогов и давно не нужных записей кэша"""
+        now = time.time()
+        deleted = await self.db.expire_fsm_states(int(now - self.ttl))
+        idle_before = time.monotonic() - self.idle_cache_time
+        for key, entry in list(self._cache.items()):
+            if key in self._dirty:
+                continue
+            if entry.updated_at < now - self.ttl or entry.accessed_at < idle_before:
+                del self._cache[key]
+        if deleted:
+            logger.info(f"Удалено устаревших состояний FSM: {deleted}")
+
+    async def count_states(self) -> Dict[str, int]:
+        """Число активных диалогов в каждом состоянии (изменения последней секунды могут не войти)"""
+        return await self.db.count_fsm_states(int(time.time() - self.ttl))
+
+    async def _entry(self, key: StorageKey) -> _Entry:
+        storage_key = self._key(key)
+        entry = self._cache.get(storage_key)
+        if entry is None:
+            row = await self.db.load_fsm_state(storage_key, int(time.time() - self.ttl))
+            if row:
+                state, data, updated_at = row
+                entry = _Entry(state, json.loads(data), updated_at)
+            else:
+                entry = _Entry(None, {}, time.time())
+            # Пока шла загрузка, запись мог создать другой обработчик
+            entry = self._cache.setdefault(storage_key, entry)
+        entry.accessed_at = time.monotonic()
+        return entry
+
+    def _touch(self, key: StorageKey, entry: _Entry) -> None:
+        entry.updated_at = time.time()
+        self._dirty.add(self._key(key))
+
+    async def set_state(self, key: StorageKey, state: Any = None) -> None:
+        entry = await self._entry(key)
+        entry.state = state.state if isinstance(state, State) else state
+        self._touch(key, entry)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._entry(key)).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        entry = await self._entry(key)
+        entry.data = dict(data)
+        self._touch(key, entry)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict((await self._entry(key)).data)
+
+    async def close(self) -> None:
+        """Остановка фоновой записи и сброс последних изменений"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush()
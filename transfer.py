@@ -0,0 +1,215 @@
+import csv
+import json
+from typing import Any, Dict, Iterator, List, Optional, Set, TextIO, Tuple
+
+from db import PRIORITIES, STATUSES, STATUS_ACTIVE
+from render import format_deadline, parse_deadline
+
+# Колонки файла экспорта; при импорте id и creator не читаются (создатель - тот, кто импортирует)
+EXPORT_FIELDS = ('id', 'name', 'description', 'project', 'priority', 'deadline', 'status', 'creator', 'assignee')
+
+DEFAULT_PRIORITY = 'Средний'
+
+# Сколько ошибок с номерами строк показывать в итоге импорта
+MAX_REPORTED_ERRORS = 10
+
+
+def detect_format(file_name: Optional[str], head: str) -> str:
+    """Формат файла по расширению, а без него - по первому символу: 'jsonl' или 'csv'"""
+    name = (file_name or '').lower()
+    if name.endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    if name.endswith(('.csv', '.txt')):
+        return 'csv'
+    return 'jsonl' if head.lstrip().startswith('{') else 'csv'
+
+
+def _read_csv(stream: TextIO) -> Iterator[Tuple[int, Any]]:
+    header = stream.readline()
+    try:
+        # Excel в русской локали сохраняет CSV через точку с запятой
+        dialect = csv.Sniffer().sniff(header, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    fields = [field.strip().lower() for field in next(csv.reader([header], dialect), [])]
+    reader = csv.reader(stream, dialect)
+    while True:
+        try:
+            values = next(reader)
+        except StopIteration:
+            return
+        except csv.Error:
+            # Поле длиннее csv.field_size_limit() или испорченная строка: запись пропускается с ошибкой,
+            # чтение продолжается со следующей строки файла
+            yield reader.line_num + 1, None
+            continue
+        if any(value.strip() for value in values):
+            # Номер строки файла с учетом заголовка
+            yield reader.line_num + 1, dict(zip(fields, values))
+
+
+def _read_jsonl(stream: TextIO) -> Iterator[Tuple[int, Any]]:
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError:
+            yield line_number, None
+
+
+def read_batches(stream: TextIO, file_format: str, size: int) -> Iterator[List[Tuple[int, Any]]]:
+    """Записи файла пачками по size штук: [(номер строки, словарь полей)]
+
+    Файл читается построчно, в памяти держится только текущая пачка.
+    """
+    records = _read_jsonl(stream) if file_format == 'jsonl' else _read_csv(stream)
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _text(record: Dict[str, Any], field: str) -> str:
+    value = record.get(field)
+    return '' if value is None else str(value).strip()
+
+
+class TaskImport:
+    """Проверка строк импортируемого файла и итоги импорта
+
+    Проекты известны заранее, исполнители (по username) проверяются пачками:
+    unknown_assignees возвращает имена, которых еще нет в кэше, результаты
+    запроса к базе передаются в add_assignees. validate превращает пачку
+    записей в строки для Database.import_tasks, ошибочные строки пропускаются
+    и учитываются в errors.
+    """
+
+    def __init__(self, creator_id: int, timezone: Optional[str], projects: List[Tuple[int, str]]) -> None:
+        self.creator_id = creator_id
+        self.timezone = timezone
+        self.projects = {name.casefold(): project_id for project_id, name in projects}
+        # Пустой проект - проект по умолчанию (созданный первым)
+        self.default_project = min(project_id for project_id, _ in projects) if projects else None
+        # username в нижнем регистре -> id пользователя или None, если такого нет
+        self.assignees: Dict[str, Optional[int]] = {}
+        self.imported = 0
+        self.error_count = 0
+        self.errors: List[str] = []
+
+    @staticmethod
+    def _username(value: str) -> str:
+        return value.lstrip('@').lower()
+
+    def unknown_assignees(self, batch: List[Tuple[int, Any]]) -> Set[str]:
+        """username исполнителей пачки, которых еще не искали в базе"""
+        names = set()
+        for _, record in batch:
+            if isinstance(record, dict):
+                name = self._username(_text(record, 'assignee'))
+                if name and name not in self.assignees:
+                    names.add(name)
+        return names
+
+    def add_assignees(self, names: Set[str], found: Dict[str, int]) -> None:
+        """Результат поиска исполнителей: найденные и ненайденные имена"""
+        for name in names:
+            self.assignees[name] = found.get(name)
+
+    def _error(self, line_number: int, message: str) -> None:
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"Строка {line_number}: {message}")
+
+    def _row(self, record: Any) -> Tuple:
+        if not isinstance(record, dict):
+            raise ValueError("не удалось разобрать запись")
+        name = _text(record, 'name')
+        if not name:
+            raise ValueError("нет названия задачи")
+
+        project = _text(record, 'project')
+        project_id = self.projects.get(project.casefold()) if project else self.default_project
+        if project_id is None:
+            raise ValueError(f"неизвестный проект «{project}»")
+
+        priority = _text(record, 'priority').capitalize() or DEFAULT_PRIORITY
+        if priority not in PRIORITIES:
+            raise ValueError(f"неизвестный приоритет «{priority}»")
+
+        status = _text(record, 'status').capitalize() or STATUS_ACTIVE
+        if status not in STATUSES:
+            raise ValueError(f"неизвестный статус «{status}»")
+
+        # В JSONL дедлайн можно передать и числом - секундами UTC
+        deadline = record.get('deadline')
+        if not isinstance(deadline, int) or isinstance(deadline, bool):
+            text = _text(record, 'deadline')
+            if not text:
+                raise ValueError("нет дедлайна")
+            try:
+                deadline = parse_deadline(text, self.timezone)
+            except ValueError:
+                raise ValueError("дедлайн не в формате ГГГГ-ММ-ДД ЧЧ:ММ")
+
+        assignee = self._username(_text(record, 'assignee'))
+        if assignee:
+            assignee_id = self.assignees.get(assignee)
+            if assignee_id is None:
+                raise ValueError(f"пользователь @{assignee} не найден (он должен хотя бы раз написать боту)")
+        else:
+            assignee_id = self.creator_id
+
+        return (name, _text(record, 'description'), project_id, self.creator_id, assignee_id,
+                priority, deadline, status)
+
+    def validate(self, batch: List[Tuple[int, Any]]) -> List[Tuple]:
+        """Строки пачки для Database.import_tasks; ошибочные записи пропускаются"""
+        rows = []
+        for line_number, record in batch:
+            try:
+                rows.append(self._row(record))
+            except ValueError as e:
+                self._error(line_number, str(e))
+        return rows
+
+    def summary(self) -> str:
+        """Итог импорта для пользователя"""
+        text = f"✅ Импортировано задач: {self.imported}"
+        if self.error_count:
+            text += f"\n⚠️ Пропущено строк с ошибками: {self.error_count}\n\n" + "\n".join(self.errors)
+            if self.error_count > len(self.errors):
+                text += "\n..."
+        return text
+
+
+class TaskExport:
+    """Запись задач в файл экспорта (CSV или JSONL) по мере чтения из базы"""
+
+    def __init__(self, stream: TextIO, file_format: str, timezone: Optional[str] = None) -> None:
+        self.stream = stream
+        self.file_format = file_format
+        self.timezone = timezone
+        self.count = 0
+        self._writer = None
+        if file_format == 'csv':
+            self._writer = csv.writer(stream)
+            self._writer.writerow(EXPORT_FIELDS)
+
+    def write(self, rows: List[Tuple]) -> None:
+        """Запись пачки строк из Database.export_user_tasks"""
+        for row in rows:
+            values = list(row)
+            # Дедлайн - в часовом поясе пользователя, в том же формате, что и при вводе
+            deadline = values[5]
+            values[5] = '' if deadline is None else format_deadline(deadline, self.timezone)
+            values = ['' if value is None else value for value in values]
+            if self._writer is not None:
+                self._writer.writerow(values)
+            else:
+                self.stream.write(json.dumps(dict(zip(EXPORT_FIELDS, values)), ensure_ascii=False) + '\n')
+        self.count += len(rows)